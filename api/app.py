@@ -1,53 +1,133 @@
+import os
 import time
+import random
 import logging
-import sys
-import traceback
+import click
 from flask import Flask, g, request, jsonify
-from prometheus_flask_exporter import PrometheusMetrics
-from pythonjsonlogger import jsonlogger
+from werkzeug.exceptions import HTTPException
+import routes
 from routes import flags_bp
+from feature_flag_service import FeatureFlagService
+from tenants import TenantRegistry
+from instrumentation import SlowRequestProfiler, start_request_stages, request_stages
 
-app = Flask(__name__)
-metrics = PrometheusMetrics(app)
-
-# Logging Setup
 logger = logging.getLogger(__name__)
-logHandler = logging.StreamHandler(sys.stdout)
-logHandler.setFormatter(jsonlogger.JsonFormatter("%(asctime)s %(levelname)s %(message)s"))
-logger.addHandler(logHandler)
 
-@app.before_request
+# Share of successful requests that get an api_request log entry; errors and
+# profiled requests are always logged
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get('FLAGS_ACCESS_LOG_SAMPLE_RATE', '1.0'))
+
+profiler = SlowRequestProfiler()
+log_writer = None
+
+def create_app(service=None):
+    """Build the API: metrics, logging, request hooks, routes and the flag service.
+
+    Importing this module is cheap and has no side effects; storage is
+    connected by the first request, by Gunicorn's post_worker_init hook or by
+    `/ready`. Build one app per process: the Prometheus metrics are global.
+    Serve it with `gunicorn 'app:create_app()'`.
+    """
+    app = Flask(__name__)
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # Under Gunicorn every worker writes its samples to the shared directory
+        # and /metrics aggregates them across workers.
+        from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+        GunicornInternalPrometheusMetrics(app)
+    else:
+        from prometheus_flask_exporter import PrometheusMetrics
+        PrometheusMetrics(app)
+
+    _configure_logging()
+
+    app.before_request(start_timer)
+    app.after_request(log_request)
+    app.register_error_handler(Exception, handle_exception)
+    app.cli.command('seed')(seed)
+
+    routes.service = service if service is not None else FeatureFlagService()
+    routes.tenants = TenantRegistry(routes.service)
+    app.register_blueprint(flags_bp)
+    return app
+
+def _configure_logging():
+    """Requests only enqueue records; a background thread formats and writes them to stdout in batches."""
+    global log_writer
+    if log_writer is not None:
+        return
+    from pythonjsonlogger import jsonlogger
+    from async_logging import configure_async_logging
+
+    # The service logs the audit trail of coalesced writes
+    service_logger = logging.getLogger('feature_flag_service')
+    for app_logger in (logger, service_logger):
+        app_logger.setLevel(logging.INFO)
+        app_logger.propagate = False
+    log_writer = configure_async_logging([logger, service_logger], jsonlogger.JsonFormatter(
+        "%(asctime)s %(levelname)s %(message)s",
+        rename_fields={"exc_info": "traceback"}
+    ))
+
 def start_timer():
-    g.start_time = time.time()
+    g.start_time = time.perf_counter()
+    start_request_stages()
+    g.profile = profiler.start()
 
-@app.after_request
 def log_request(response):
-    latency = int((time.time() - g.start_time) * 1000)
-    logger.info({"event": "api_request", "path": request.path, "latency_ms": latency})
+    latency = (time.perf_counter() - g.start_time) * 1000
+    profile_path = None
+    if g.get('profile') is not None:
+        profile_path = profiler.finish(g.pop('profile'), latency, f"{request.method} {request.path}")
+    if response.status_code < 400 and profile_path is None and random.random() >= ACCESS_LOG_SAMPLE_RATE:
+        return response
+
+    entry = {
+        "event": "api_request",
+        "method": request.method,
+        "path": request.path,
+        "tenant": g.get('tenant'),
+        "status": response.status_code,
+        "latency_ms": round(latency, 3),
+        "stages_ms": request_stages()
+    }
+    if profile_path:
+        entry["profile"] = profile_path
+    logger.info(entry)
     return response
 
-@app.errorhandler(Exception)
 def handle_exception(e):
-    # Capture the full stack trace
-    tb = traceback.format_exc()
-    
+    # 404s, 405s and the like are answered by Flask, not failures of the app
+    if isinstance(e, HTTPException):
+        return e
+
+    # The stack trace is rendered into "traceback" by the log writer thread
     logger.error({
         "event": "unhandled_exception",
         "error_type": type(e).__name__,
         "error_message": str(e),
-        "traceback": tb,
         "path": request.path,
         "method": request.method,
         "client_ip": request.remote_addr
-    })
-    
+    }, exc_info=e)
+
     # Return a 500 response
     return jsonify({
-        "error": "Internal Server Error", 
+        "error": "Internal Server Error",
         "message": "An unexpected error occurred"
     }), 500
 
-app.register_blueprint(flags_bp)
+def seed():
+    """Create indexes and insert the demo flags if the store is empty."""
+    storage = routes.service.storage
+    storage.warm_up()
+    storage.seed()
+    click.echo(f"Flag storage ready with {len(storage.find_all())} flags")
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app = create_app()
+    try:
+        routes.service.warm_up()
+    except Exception as e:
+        logger.error({"event": "warm_up_failed", "error_message": str(e)})
+    app.run(host='0.0.0.0', port=5000)
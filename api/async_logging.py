@@ -0,0 +1,125 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler
+from prometheus_client import Counter
+
+LOG_RECORDS_DROPPED = Counter(
+    'flags_log_records_dropped_total',
+    'Log records dropped because the log queue was full'
+)
+
+_STOP = object()
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to a bounded queue without formatting them.
+
+    The request thread only pays for creating the record; when the writer
+    falls behind and the queue is full, records are dropped and counted
+    instead of blocking the request.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting (and rendering exc_info) happens on the writer thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+class BatchingLogWriter(threading.Thread):
+    """Background thread that formats queued records and writes them in batches.
+
+    Every wake-up drains up to `batch_size` records and writes them with a
+    single write and flush, so a burst of requests costs one syscall rather
+    than one per line, and an idle queue adds no delay.
+    """
+
+    def __init__(self, handler, formatter, stream=None, batch_size=256):
+        super().__init__(name='log-writer', daemon=True)
+        self.handler = handler
+        self.queue = handler.queue
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._reported_dropped = 0
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            stopping = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            self._write(batch)
+            if stopping:
+                return
+
+    def stop(self, timeout=5.0):
+        """Flush what is queued and stop the thread."""
+        if not self.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.join(timeout)
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception:
+                self.handler.handleError(record)
+        dropped = self.handler.dropped
+        if dropped > self._reported_dropped:
+            lines.append(self.formatter.format(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': {"event": "log_records_dropped", "count": dropped - self._reported_dropped}
+            })))
+            self._reported_dropped = dropped
+        if not lines:
+            return
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except (OSError, ValueError):
+            # Closed or broken stream; there is nowhere left to report it
+            pass
+
+def configure_async_logging(loggers, formatter, stream=None, queue_size=None, batch_size=None):
+    """Route `loggers` through one bounded queue to a background writer and start it.
+
+    The queue size and batch size default to FLAGS_LOG_QUEUE_SIZE and
+    FLAGS_LOG_BATCH_SIZE. Returns the writer; it is flushed at interpreter exit.
+    """
+    queue_size = queue_size or int(os.environ.get('FLAGS_LOG_QUEUE_SIZE', '10000'))
+    batch_size = batch_size or int(os.environ.get('FLAGS_LOG_BATCH_SIZE', '256'))
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    writer = BatchingLogWriter(handler, formatter, stream, batch_size)
+    for logger in loggers:
+        logger.addHandler(handler)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
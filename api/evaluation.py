@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import numbers
+
+logger = logging.getLogger(__name__)
+
+# A flag's per-environment targeting looks like:
+#
+#   "targeting": {
+#       "production": {
+#           "rules": [{"attribute": "country", "operator": "in", "values": ["IL", "US"]}],
+#           "match": "all",
+#           "rollout": {"percentage": 25, "key": "user_id"}
+#       }
+#   },
+#   "segments": {"beta-testers": ["user-1", "user-2"]}
+#
+# A context is enabled when the environment is on, its rules match ("all" or
+# "any" of them) and its key falls inside the rollout percentage.
+
+OPERATORS = (
+    'in', 'not_in', 'in_segment', 'equals', 'not_equals',
+    'starts_with', 'ends_with', 'contains', 'gt', 'gte', 'lt', 'lte'
+)
+NUMERIC_OPERATORS = ('gt', 'gte', 'lt', 'lte')
+TARGETING_FIELDS = ('rules', 'match', 'rollout')
+BUCKETS = 10000
+DEFAULT_ROLLOUT_KEY = 'key'
+
+_MISSING = object()
+
+def bucket(flag_name, key):
+    """Map a context key to a stable bucket in [0, BUCKETS) for a flag."""
+    digest = hashlib.sha1(f"{flag_name}:{key}".encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % BUCKETS
+
+class CompiledFlag:
+    """A flag with its targeting turned into plain Python predicates.
+
+    Built once per flag version so evaluating a context costs a few function
+    calls and set lookups instead of re-reading the raw document.
+    """
+
+    __slots__ = ('name', '_enabled', '_targeted')
+
+    def __init__(self, flag):
+        self.name = flag.get('name')
+        self._enabled = dict(flag.get('environments') or {})
+        segments = flag.get('segments') or {}
+        self._targeted = {}
+        for environment, targeting in (flag.get('targeting') or {}).items():
+            if not self._enabled.get(environment):
+                continue
+            try:
+                self._targeted[environment] = _compile_environment(self.name, targeting, segments)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                # Documents written around the API can hold anything; fail closed
+                logger.error(f"Invalid targeting for flag {self.name} in {environment}: {e}")
+                self._targeted[environment] = _never
+
+    def evaluate(self, environment, context=None):
+        """Evaluate for a context; without one, return the environment's on/off state."""
+        if not self._enabled.get(environment, False):
+            return False
+        if context is None:
+            return True
+        predicate = self._targeted.get(environment)
+        return predicate is None or predicate(context)
+
+def compile_flag(flag):
+    return CompiledFlag(flag)
+
+def _never(context):
+    return False
+
+def _compile_environment(flag_name, targeting, segments):
+    clauses = [_compile_clause(rule, segments) for rule in targeting.get('rules') or []]
+    match_any = targeting.get('match') == 'any'
+    rollout = targeting.get('rollout')
+    threshold = None
+    rollout_key = DEFAULT_ROLLOUT_KEY
+    if rollout:
+        threshold = round(rollout['percentage'] * BUCKETS / 100)
+        rollout_key = rollout.get('key', DEFAULT_ROLLOUT_KEY)
+
+    def predicate(context):
+        if clauses:
+            if match_any:
+                if not any(clause(context) for clause in clauses):
+                    return False
+            elif not all(clause(context) for clause in clauses):
+                return False
+        if threshold is None or threshold >= BUCKETS:
+            return True
+        key = context.get(rollout_key)
+        return key is not None and bucket(flag_name, key) < threshold
+
+    return predicate
+
+def _compile_clause(rule, segments):
+    attribute = rule['attribute']
+    operator = rule['operator']
+    values = rule['values']
+
+    if operator == 'in':
+        members = frozenset(values)
+        test = members.__contains__
+    elif operator == 'not_in':
+        excluded = frozenset(values)
+        test = lambda value: value not in excluded
+    elif operator == 'in_segment':
+        members = frozenset(key for name in values for key in segments.get(name, ()))
+        test = members.__contains__
+    elif operator == 'equals':
+        expected = values[0]
+        test = lambda value: value == expected
+    elif operator == 'not_equals':
+        expected = values[0]
+        test = lambda value: value != expected
+    elif operator == 'starts_with':
+        prefixes = tuple(values)
+        test = lambda value: isinstance(value, str) and value.startswith(prefixes)
+    elif operator == 'ends_with':
+        suffixes = tuple(values)
+        test = lambda value: isinstance(value, str) and value.endswith(suffixes)
+    elif operator == 'contains':
+        parts = tuple(values)
+        test = lambda value: isinstance(value, str) and any(part in value for part in parts)
+    else:
+        test = _compile_comparison(operator, values[0])
+
+    def clause(context):
+        value = context.get(attribute, _MISSING)
+        if value is _MISSING:
+            return False
+        try:
+            return test(value)
+        except TypeError:
+            # Unhashable or incomparable context values never match
+            return False
+
+    return clause
+
+def _compile_comparison(operator, threshold):
+    def test(value):
+        if not _is_number(value):
+            return False
+        if operator == 'gt':
+            return value > threshold
+        if operator == 'gte':
+            return value >= threshold
+        if operator == 'lt':
+            return value < threshold
+        return value <= threshold
+    return test
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+def validate_targeting(targeting, segments=None):
+    """Return an error message if targeting or segments are malformed, else None."""
+    if segments is not None:
+        if not isinstance(segments, dict):
+            return "segments must be an object of segment name to list of keys"
+        for name, keys in segments.items():
+            if not isinstance(keys, list) or not all(isinstance(key, (str, numbers.Real)) for key in keys):
+                return f"Segment {name} must be a list of keys"
+
+    if targeting is None:
+        return None
+    if not isinstance(targeting, dict):
+        return "targeting must be an object of environment name to rules"
+    for environment, config in targeting.items():
+        if not isinstance(config, dict) or any(key not in TARGETING_FIELDS for key in config):
+            return f"targeting.{environment} may only contain {', '.join(TARGETING_FIELDS)}"
+        if config.get('match', 'all') not in ('all', 'any'):
+            return f"targeting.{environment}.match must be all or any"
+
+        rules = config.get('rules', [])
+        if not isinstance(rules, list):
+            return f"targeting.{environment}.rules must be a list"
+        for rule in rules:
+            error = _validate_rule(rule)
+            if error:
+                return f"targeting.{environment}.rules: {error}"
+
+        rollout = config.get('rollout')
+        if rollout is not None:
+            if not isinstance(rollout, dict) or not _is_number(rollout.get('percentage')) \
+                    or not 0 <= rollout['percentage'] <= 100:
+                return f"targeting.{environment}.rollout.percentage must be between 0 and 100"
+            if not isinstance(rollout.get('key', DEFAULT_ROLLOUT_KEY), str):
+                return f"targeting.{environment}.rollout.key must be a string"
+    return None
+
+def _validate_rule(rule):
+    if not isinstance(rule, dict) or not isinstance(rule.get('attribute'), str):
+        return "every rule needs an attribute"
+    if rule.get('operator') not in OPERATORS:
+        return f"operator must be one of {', '.join(OPERATORS)}"
+    values = rule.get('values')
+    if not isinstance(values, list) or not values:
+        return "values must be a non-empty list"
+    if rule['operator'] in NUMERIC_OPERATORS and not _is_number(values[0]):
+        return f"{rule['operator']} needs a numeric value"
+    if rule['operator'] in ('starts_with', 'ends_with', 'contains') \
+            and not all(isinstance(value, str) for value in values):
+        return f"{rule['operator']} needs string values"
+    if rule['operator'] in ('in', 'not_in', 'in_segment') \
+            and not all(isinstance(value, (str, numbers.Real)) for value in values):
+        return f"{rule['operator']} needs string or numeric values"
+    return None
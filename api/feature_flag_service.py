@@ -1,65 +1,420 @@
-from storage import FeatureFlagStorage
-from bson.objectid import ObjectId
+import os
+import time
+import logging
+from storage_backend import create_storage, DuplicateNameError
+from flag_cache import FlagCache, with_enabled
+from flag_events import FlagEventBus
+from flag_history import FlagHistory
+from evaluation import validate_targeting
+from instrumentation import timed
+from write_coalescer import WriteCoalescer
+
+logger = logging.getLogger(__name__)
+
+UPDATABLE_FIELDS = ('name', 'description', 'environments', 'targeting', 'segments')
+MAX_NAME_LENGTH = 256
+NAME_ERROR = f"Name must be a non-empty string of at most {MAX_NAME_LENGTH} characters"
+
+def is_valid_environment(environment):
+    # Environment names become document field paths
+    return isinstance(environment, str) and environment != '' and '.' not in environment and not environment.startswith('$')
+
+def is_valid_name(name):
+    # Names are the keys of the binary snapshot file, which stores key lengths in 16 bits
+    return isinstance(name, str) and name != '' and len(name) <= MAX_NAME_LENGTH
+
+def is_valid_version(version):
+    return version is None or (isinstance(version, int) and not isinstance(version, bool) and version >= 0)
 
 class FeatureFlagService:
-    def __init__(self):
-        self.storage = FeatureFlagStorage()
+    def __init__(self, storage=None, snapshot_path=None):
+        self.storage = storage if storage is not None else create_storage()
+        self.events = FlagEventBus()
+        self.cache = FlagCache(self.storage, self.events, snapshot_path)
+        self.history = FlagHistory(self.storage)
+        # Toggles and updates of one flag arriving within this window are
+        # written, cached and published once
+        window = float(os.environ.get('FLAGS_WRITE_COALESCE_MS', '0')) / 1000
+        self.coalescer = WriteCoalescer(window) if window > 0 else None
+        # Most flags a tenant may have, 0 for no limit; also bounds the size of its cache partition
+        self.max_flags = int(os.environ.get('FLAGS_TENANT_MAX_FLAGS', '0'))
+
+    def warm_up(self):
+        """Connect to storage and load the flag snapshot ahead of traffic."""
+        self.storage.warm_up()
+        self.cache.snapshot()
+
+    def readiness(self):
+        """Load the flag snapshot if needed; returns (status, error).
+
+        Status is "ready", "degraded" while storage is down but the offline
+        snapshot is being served, or "unavailable" with the error.
+        """
+        try:
+            self.cache.snapshot()
+        except Exception as e:
+            return "unavailable", str(e)
+        return ("degraded" if self.cache.degraded else "ready"), None
 
     def get_all_flags(self, environment='staging'):
-        return self.storage.get_all(environment)
+        return self.cache.get_all(environment)
+
+    def list_flags(self, environment='staging', enabled=None, prefix=None, after=None, limit=None, fields=None):
+        """Return one page of flags filtered and projected by the database.
+
+        Pages are ordered by name; the second value is the name to pass as
+        `after` for the next page, or None on the last page.
+        """
+        paginated = limit is not None or after is not None
+        if fields is not None and paginated and 'name' not in fields:
+            fields = list(fields) + ['name']
+
+        with timed('list', 'storage', environment):
+            flags = self.storage.get_all(
+                environment, enabled,
+                prefix=prefix, after=after,
+                limit=limit + 1 if limit is not None else None,
+                fields=fields
+            )
+        if limit is not None and len(flags) > limit:
+            flags = flags[:limit]
+            return flags, flags[-1]['name']
+        return flags, None
+
+    def iter_flags(self, environment='staging', enabled=None, prefix=None, fields=None):
+        """Yield flags straight from a database cursor, one batch in memory at a time."""
+        return self.storage.iter_all(
+            environment, enabled,
+            prefix=prefix, fields=fields,
+            batch_size=self.storage.batch_size
+        )
+
+    def get_flags_response(self, environment='staging'):
+        return self.cache.get_response(environment)
+
+    def get_snapshot_file(self):
+        return self.cache.get_snapshot_file()
+
+    def get_flags_as_of(self, environment='staging', version=None, timestamp=None):
+        """Return the flags of an environment as they were at a flag-set version or a time.
+
+        The second value is the version the flags correspond to. Returns
+        (None, None) when history does not reach back that far.
+        """
+        with timed('as_of', 'storage', environment):
+            flags, version = self.history.as_of(version, timestamp)
+        if flags is None:
+            return None, None
+        return [with_enabled(flag, environment) for flag in flags], version
+
+    def evaluate_flags(self, keys=None, environments=('staging',), contexts=None):
+        """Evaluate many flags in many environments from a single snapshot read.
+
+        `keys` may mix flag ids and names; all flags are evaluated when omitted.
+        Without `contexts` each result is the environment's on/off state; with
+        them, each environment maps to one result set per context, in order,
+        using the flags' compiled targeting rules.
+        Returns the results per environment and the keys that matched no flag.
+        """
+        snapshot, index, compiled = self.cache.view()
+        if keys is None:
+            flags = {flag['name']: flag for flag in snapshot if flag.get('name') is not None}
+            missing = []
+        else:
+            flags = {key: index[key] for key in keys if key in index}
+            missing = [key for key in keys if key not in index]
+        evaluators = [(key, compiled[flag['_id']].evaluate) for key, flag in flags.items()]
+
+        results = {}
+        for environment in environments:
+            with timed('evaluate', 'evaluate', environment):
+                if contexts is None:
+                    results[environment] = {key: evaluate(environment) for key, evaluate in evaluators}
+                else:
+                    results[environment] = [
+                        {key: evaluate(environment, context) for key, evaluate in evaluators}
+                        for context in contexts
+                    ]
+        return results, missing
+
+    def stream_changes(self, environment='staging', last_event_id=None, heartbeat=15.0):
+        """Yield (event_id, event_type, data) tuples for a flag change stream.
+
+        Starts with a full snapshot unless `last_event_id` can be resumed from
+        this worker's event log, then yields one event per changed flag. A
+        `heartbeat` event is yielded after `heartbeat` seconds of silence.
+        """
+        cursor = self.events.parse_id(last_event_id)
+        if cursor is None or self.events.events_after(cursor) is None:
+            cursor = self.events.last_sequence
+            yield self.events.format_id(cursor), 'snapshot', self.get_all_flags(environment)
+
+        last_sent = time.monotonic()
+        while True:
+            # Reloading an invalidated snapshot is what publishes its changes
+            self.cache.snapshot()
+            events = self.events.wait(cursor, self.cache.poll_interval)
+            if events is None:
+                cursor = self.events.last_sequence
+                yield self.events.format_id(cursor), 'snapshot', self.get_all_flags(environment)
+                last_sent = time.monotonic()
+                continue
+
+            for sequence, event_type, flag in events:
+                cursor = sequence
+                data = flag if event_type == 'delete' else with_enabled(flag, environment)
+                yield self.events.format_id(sequence), event_type, data
+                last_sent = time.monotonic()
+
+            if not events and time.monotonic() - last_sent >= heartbeat:
+                yield None, 'heartbeat', None
+                last_sent = time.monotonic()
 
     def create_flag(self, data):
-        self.storage.insert_one(data)
-        return data
+        if not is_valid_name(data.get('name')):
+            return None, NAME_ERROR
+        error = validate_targeting(data.get('targeting'), data.get('segments'))
+        if error:
+            return None, error
+        if self._over_quota(1):
+            return None, "Tenant flag quota exceeded"
+        # Versions are assigned by the server; a client-supplied one would break later writes
+        data['version'] = 0
+        with timed('create', 'storage'):
+            if self.storage.find_by_name(data['name']):
+                return None, "Feature flag name already exists"
+            try:
+                self.storage.insert_flag(data)
+            except DuplicateNameError:
+                return None, "Feature flag name already exists"
+        self._flags_changed([('create', data['_id'], data)])
+        return data, None
 
     def get_flag(self, flag_id):
-        query = self._build_id_query(flag_id)
-        flag = self.storage.find_one(query)
-        if flag:
-            flag['_id'] = str(flag['_id'])
-        return flag
+        with timed('get', 'storage'):
+            return self.storage.find_flag(flag_id)
+
+    def update_flag(self, flag_id, updates, expected_version=None):
+        """Update some fields of a flag.
 
-    def update_flag(self, flag_id, updates):
+        With write coalescing on, updates of the same flag within the window
+        are merged (later requests win per field) into one write, and every
+        request gets the resulting flag. Updates with an expected version are
+        applied on their own.
+        """
         if not updates:
             return None, "No fields to update"
-            
-        query = self._build_id_query(flag_id)
-        result = self.storage.update_one(query, {"$set": updates})
-        
-        if result.matched_count:
-            flag = self.storage.find_one(query)
-            if flag:
-                flag['_id'] = str(flag['_id'])
+        if 'name' in updates and not is_valid_name(updates['name']):
+            return None, NAME_ERROR
+        error = validate_targeting(updates.get('targeting'), updates.get('segments'))
+        if error:
+            return None, error
+
+        if self.coalescer is None or expected_version is not None:
+            return self._update(flag_id, updates, expected_version)
+        return self.coalescer.submit(
+            ('update', flag_id), {"received_at": time.time(), "updates": updates},
+            lambda requests: self._apply_updates(flag_id, requests)
+        )
+
+    def _update(self, flag_id, updates, expected_version):
+        try:
+            with timed('update', 'storage'):
+                flag = self.storage.update_flag(flag_id, updates, expected_version)
+        except DuplicateNameError:
+            return None, "Feature flag name already exists"
+        if flag:
+            self._flags_changed([('update', flag['_id'], flag)])
             return flag, None
-        return None, "Feature flag not found"
+        return None, self._write_miss_error(flag_id, expected_version)
 
     def delete_flag(self, flag_id):
-        query = self._build_id_query(flag_id)
-        result = self.storage.delete_one(query)
-        return result.deleted_count > 0
-
-    def toggle_flag(self, flag_id, environment):
-        query = self._build_id_query(flag_id)
-        flag = self.storage.find_one(query)
-        
+        with timed('delete', 'storage'):
+            deleted = self.storage.delete_flag(flag_id)
+        if deleted:
+            self._flags_changed([('delete', deleted['_id'], None)])
+        return bool(deleted)
+
+    def toggle_flag(self, flag_id, environment, expected_version=None):
+        """Flip a flag in one environment with a single atomic storage write.
+
+        With write coalescing on, toggles of the same flag and environment
+        within the window are written as their net effect: an odd number of
+        flips is one toggle, an even number writes nothing. Every request gets
+        the resulting flag. Toggles with an expected version are applied on
+        their own.
+        """
+        if self.coalescer is None or expected_version is not None:
+            return self._toggle(flag_id, environment, expected_version)
+        return self.coalescer.submit(
+            ('toggle', flag_id, environment), {"received_at": time.time()},
+            lambda requests: self._apply_toggles(flag_id, environment, requests)
+        )
+
+    def _toggle(self, flag_id, environment, expected_version):
+        with timed('toggle', 'storage', environment):
+            flag = self.storage.toggle_flag(flag_id, environment, expected_version)
         if flag:
-            current_status = flag.get('environments', {}).get(environment, False)
-            new_status = not current_status
-            
-            update_result = self.storage.update_one(
-                query, 
-                {"$set": {f"environments.{environment}": new_status}}
-            )
-            
-            if update_result.modified_count:
-                updated_flag = self.storage.find_one(query)
-                updated_flag['_id'] = str(updated_flag['_id'])
-                updated_flag['enabled'] = new_status
-                return updated_flag
-        return None
-
-    def _build_id_query(self, flag_id):
-        """Build a query for finding a flag by ID, handling both ObjectId and string formats."""
-        if ObjectId.is_valid(flag_id):
-            return {"_id": ObjectId(flag_id)}
-        return {"_id": flag_id}
+            self._flags_changed([('toggle', flag['_id'], flag)])
+            flag['enabled'] = flag.get('environments', {}).get(environment, False)
+            return flag, None
+        return None, self._write_miss_error(flag_id, expected_version)
+
+    def _apply_toggles(self, flag_id, environment, requests):
+        if len(requests) % 2:
+            result = self._toggle(flag_id, environment, None)
+        else:
+            flag = self.get_flag(flag_id)
+            if flag:
+                flag['enabled'] = flag.get('environments', {}).get(environment, False)
+                result = flag, None
+            else:
+                result = None, "Feature flag not found"
+        self._log_coalesced('toggle', flag_id, requests, written=len(requests) % 2 == 1, environment=environment)
+        return result
+
+    def _apply_updates(self, flag_id, requests):
+        merged = {}
+        for request in requests:
+            merged.update(request['updates'])
+        result = self._update(flag_id, merged, None)
+        self._log_coalesced('update', flag_id, [
+            {"received_at": request['received_at'], "fields": sorted(request['updates'])} for request in requests
+        ], written=True)
+        return result
+
+    def _log_coalesced(self, operation, flag_id, requests, written, **details):
+        """Keep an audit trail of the requests that were folded into one write."""
+        if len(requests) > 1:
+            logger.info({
+                "event": "flag_writes_coalesced",
+                "operation": operation,
+                "flag": flag_id,
+                **details,
+                "requests": requests,
+                "written": written
+            })
+
+    def bulk_write(self, operations, transaction=False):
+        """Apply many create/update/toggle/delete operations with one bulk write.
+
+        Returns one result per operation, in order. Flags referenced by id or
+        name are resolved with a single query first. Without `transaction`
+        operations are applied independently, so one failure does not stop the
+        others; with it they are all applied or none are.
+        """
+        if transaction and not self.storage.supports_transactions:
+            return None, "Transactions require a replica set"
+
+        keys = {op['id'] for op in operations if isinstance(op, dict) and isinstance(op.get('id'), str)}
+        existing = self.storage.find_flags(keys) if keys else {}
+
+        results = []
+        writes = []
+        pending = []
+        for index, operation in enumerate(operations):
+            write, outcome = self._bulk_request(operation, existing)
+            result = {"index": index, **outcome}
+            results.append(result)
+            if write is not None:
+                writes.append(write)
+                pending.append(result)
+
+        if not writes:
+            return results, None
+        if self._over_quota(sum(1 for write in writes if write[0] == 'create')):
+            return None, "Tenant flag quota exceeded"
+
+        with timed('bulk', 'storage'):
+            outcomes = self.storage.bulk_write(writes, transaction)
+        # A flag can change between the lookup above and the write, so the
+        # storage outcome, not the lookup, decides each result
+        failed = any(status != 'ok' for status, _ in outcomes)
+        for result, (status, value) in zip(pending, outcomes):
+            if status != 'ok':
+                result.update(status=status, error=value)
+            elif transaction and failed:
+                # Nothing was committed
+                result.update(status='aborted', error="Transaction aborted")
+        changes = self._bulk_changes(pending, outcomes)
+        if changes:
+            self._flags_changed(changes)
+        return results, None
+
+    def _bulk_changes(self, results, outcomes):
+        """History changes for the applied bulk operations, with the documents storage wrote."""
+        ops = {'created': 'create', 'updated': 'update', 'toggled': 'toggle', 'deleted': 'delete'}
+        return [
+            (ops[result['status']], result['_id'], flag)
+            for result, (_, flag) in zip(results, outcomes)
+            # A flag deleted by another writer right after the write has no document left to record
+            if result['status'] in ops and (flag is not None or result['status'] == 'deleted')
+        ]
+
+    def _bulk_request(self, operation, existing):
+        """Translate one bulk operation into a storage write and its provisional result."""
+        if not isinstance(operation, dict):
+            return None, {"status": "invalid", "error": "Operation must be an object"}
+        op = operation.get('op')
+
+        if op == 'create':
+            flag = operation.get('flag')
+            if not isinstance(flag, dict) or not flag.get('name') or not isinstance(flag['name'], str):
+                return None, {"status": "invalid", "error": "Name required"}
+            if not is_valid_name(flag['name']):
+                return None, {"status": "invalid", "error": NAME_ERROR}
+            error = validate_targeting(flag.get('targeting'), flag.get('segments'))
+            if error:
+                return None, {"status": "invalid", "error": error}
+            document = dict(flag, version=0)
+            document['_id'] = self.storage.new_id()
+            return ('create', document), {"status": "created", "_id": str(document['_id'])}
+
+        if op not in ('update', 'toggle', 'delete'):
+            return None, {"status": "invalid", "error": "op must be one of create, update, toggle, delete"}
+        doc = existing.get(operation.get('id'))
+        if doc is None:
+            return None, {"status": "not_found", "error": "Feature flag not found"}
+        expected_version = operation.get('version')
+        if not is_valid_version(expected_version):
+            return None, {"status": "invalid", "error": "version must be a non-negative integer"}
+        if expected_version is not None and doc.get('version', 0) != expected_version:
+            return None, {"status": "conflict", "error": "Version conflict"}
+        flag_id = str(doc['_id'])
+
+        if op == 'update':
+            fields = operation.get('fields')
+            if not isinstance(fields, dict) or not fields or any(key not in UPDATABLE_FIELDS for key in fields):
+                return None, {"status": "invalid", "error": f"fields must only contain {', '.join(UPDATABLE_FIELDS)}"}
+            if 'name' in fields and not is_valid_name(fields['name']):
+                return None, {"status": "invalid", "error": NAME_ERROR}
+            error = validate_targeting(fields.get('targeting'), fields.get('segments'))
+            if error:
+                return None, {"status": "invalid", "error": error}
+            return ('update', doc['_id'], expected_version, fields), {"status": "updated", "_id": flag_id}
+        if op == 'toggle':
+            environment = operation.get('environment', 'staging')
+            if not is_valid_environment(environment):
+                return None, {"status": "invalid", "error": "Invalid environment"}
+            return ('toggle', doc['_id'], expected_version, environment), {"status": "toggled", "_id": flag_id}
+        return ('delete', doc['_id'], expected_version), {"status": "deleted", "_id": flag_id}
+
+    def _over_quota(self, new_flags):
+        # Checked against this worker's snapshot, so concurrent creates on
+        # other workers can overshoot the quota by a few flags
+        return self.max_flags > 0 and new_flags > 0 and len(self.cache.snapshot()) + new_flags > self.max_flags
+
+    def _write_miss_error(self, flag_id, expected_version):
+        """Tell a missing flag apart from a stale expected version after a failed write."""
+        if expected_version is not None and self.storage.find_flag(flag_id):
+            return "Version conflict"
+        return "Feature flag not found"
+
+    def _flags_changed(self, changes):
+        """Bump the shared version counter, record the changes in history and drop this worker's snapshot."""
+        with timed('version_bump', 'storage'):
+            version = self.storage.bump_version()
+        if changes:
+            with timed('history', 'storage'):
+                self.history.record(version, changes)
+        self.cache.invalidate()
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from evaluation import compile_flag
+from flag_snapshot import SnapshotReader, encode_snapshot, write_snapshot
+from instrumentation import timed, record_cache
+
+logger = logging.getLogger(__name__)
+
+def with_enabled(flag, environment):
+    """Return a copy of a flag document with `enabled` set for an environment."""
+    flag = dict(flag)
+    flag['enabled'] = flag.get('environments', {}).get(environment, False)
+    return flag
+
+class FlagCache:
+    """Per-worker in-memory snapshot of all feature flags.
+
+    The snapshot is loaded lazily and dropped whenever it may be stale: on this
+    worker's own writes, on MongoDB change stream events (replica sets only) or,
+    as a fallback, when the flag-set version counter in storage moves.
+
+    When an event bus is attached, every reload is diffed against the previous
+    snapshot and the created, updated and deleted flags are published to it.
+
+    With a `snapshot_path` (default FLAGS_SNAPSHOT_PATH), every reload that sees a new flag-set version
+    is written to that file, and the file is served instead when storage is
+    unreachable; storage is retried every `retry_interval` seconds meanwhile.
+    """
+
+    def __init__(self, storage, events=None, snapshot_path=None):
+        self.storage = storage
+        self.events = events
+        self.enabled = os.environ.get('FLAGS_CACHE_ENABLED', 'true').lower() == 'true'
+        self.poll_interval = float(os.environ.get('FLAGS_CACHE_POLL_SECONDS', '1.0'))
+        self.use_change_stream = os.environ.get('MONGO_IS_REPLICA_SET', 'false').lower() == 'true' \
+            and storage.supports_change_stream
+        self.snapshot_path = snapshot_path if snapshot_path is not None else os.environ.get('FLAGS_SNAPSHOT_PATH')
+        self.watch_retry_interval = 30.0
+        self.retry_interval = 5.0
+        self.max_responses = 64
+
+        self._lock = threading.Lock()
+        self._flags = None
+        self._loaded = None
+        self._version = None
+        self._generation = 0
+        self._last_poll = 0.0
+        self._watching = False
+        self._watch_retry_at = 0.0
+        self._responses = {}
+        self._index = (None, {})
+        self._compiled = (None, {}, {})
+        self._snapshot_file = (None, None, None)
+        self._written_version = None
+        self.degraded = False
+
+    def get_all(self, environment='staging'):
+        if not self.enabled:
+            return self.storage.get_all(environment)
+        return [with_enabled(flag, environment) for flag in self.snapshot()]
+
+    def get_response(self, environment='staging'):
+        """Return the serialized flag list for an environment and its ETag.
+
+        Bodies are built once per snapshot and environment, so repeated polls
+        only pay for a dictionary lookup.
+        """
+        if not self.enabled:
+            with timed('get_flags', 'storage', environment):
+                flags = self.storage.get_all(environment)
+            with timed('get_flags', 'encode', environment):
+                return self._serialize(flags)
+
+        flags = self.snapshot()
+        cached = self._responses.get(environment)
+        hit = cached is not None and cached[0] is flags
+        record_cache('response', hit)
+        if hit:
+            return cached[1], cached[2]
+
+        with timed('get_flags', 'convert', environment):
+            converted = [with_enabled(flag, environment) for flag in flags]
+        with timed('get_flags', 'encode', environment):
+            body, etag = self._serialize(converted)
+        if len(self._responses) >= self.max_responses:
+            self._responses = {}
+        self._responses[environment] = (flags, body, etag)
+        return body, etag
+
+    def get_snapshot_file(self):
+        """Return the current snapshot in the binary snapshot format, and its ETag."""
+        flags = self.snapshot()
+        built_from, data, etag = self._snapshot_file
+        if built_from is not flags:
+            with timed('snapshot_file', 'encode'):
+                data = encode_snapshot(flags, self._version or 0)
+            etag = hashlib.sha1(data).hexdigest()
+            self._snapshot_file = (flags, data, etag)
+        return data, etag
+
+    def view(self):
+        """Return the flag documents, their index and their compiled forms, all from one snapshot.
+
+        Reading `index()` and `compiled()` separately can straddle a reload,
+        pairing an index entry with a compiled map that lacks it.
+        """
+        flags = self.snapshot()
+        return flags, self._index_of(flags), self._compiled_of(flags)
+
+    def index(self):
+        """Return a mapping of both flag ids and names to cached flag documents."""
+        return self._index_of(self.snapshot())
+
+    def _index_of(self, flags):
+        built_from, index = self._index
+        if built_from is not flags:
+            index = {}
+            for flag in flags:
+                if flag.get('name') is not None:
+                    index[flag['name']] = flag
+            # Ids take precedence over names that happen to look like ids
+            for flag in flags:
+                index[flag['_id']] = flag
+            self._index = (flags, index)
+        return index
+
+    def compiled(self):
+        """Return compiled flags by id for the current snapshot.
+
+        Flags whose documents did not change since the previous snapshot keep
+        their compiled form, so only changed flags are recompiled.
+        """
+        return self._compiled_of(self.snapshot())
+
+    def _compiled_of(self, flags):
+        built_from, sources, compiled = self._compiled
+        if built_from is not flags:
+            previous_sources, previous = sources, compiled
+            sources, compiled = {}, {}
+            with timed('evaluate', 'convert'):
+                for flag in flags:
+                    flag_id = flag['_id']
+                    if flag_id in previous and previous_sources[flag_id] == flag:
+                        compiled[flag_id] = previous[flag_id]
+                    else:
+                        compiled[flag_id] = compile_flag(flag)
+                    sources[flag_id] = flag
+            self._compiled = (flags, sources, compiled)
+        return compiled
+
+    def snapshot(self):
+        """Return the cached flag documents, reloading them if invalidated."""
+        self._ensure_watcher()
+        if self._flags is not None and not self._watching:
+            self._poll_version()
+
+        flags = self._flags
+        if flags is None:
+            with self._lock:
+                flags = self._flags
+                if flags is None:
+                    record_cache('snapshot', False)
+                    return self._reload()
+        record_cache('snapshot', True)
+        return flags
+
+    def invalidate(self):
+        self._generation += 1
+        self._flags = None
+        if self.events is not None:
+            # Streaming clients reload the snapshot to publish the change
+            self.events.notify()
+
+    def _reload(self):
+        generation = self._generation
+        # Read the version before the documents so a concurrent write is
+        # picked up again by the next poll rather than lost.
+        try:
+            with timed('snapshot', 'storage'):
+                version = self.storage.get_version()
+                flags = tuple(self.storage.find_all())
+        except Exception as e:
+            version, flags = self._load_offline(e)
+        else:
+            self.degraded = False
+            self._write_offline(flags, version)
+        if self.events is not None and self._loaded is not None:
+            self._publish_changes(self._loaded, flags)
+        self._loaded = flags
+        if generation == self._generation:
+            self._version = version
+            self._flags = flags
+            self._last_poll = time.monotonic()
+        return flags
+
+    def _poll_version(self):
+        now = time.monotonic()
+        if self.degraded:
+            if now - self._last_poll >= self.retry_interval:
+                self.invalidate()
+            return
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        try:
+            with timed('version_poll', 'storage'):
+                version = self.storage.get_version()
+            if version != self._version:
+                self.invalidate()
+        except Exception as e:
+            logger.error(f"Flag version poll failed: {e}")
+
+    def _load_offline(self, error):
+        """Fall back to the snapshot file when storage fails; re-raise without one."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            raise error
+        reader = SnapshotReader(self.snapshot_path)
+        try:
+            flags = tuple(reader.flags())
+        finally:
+            reader.close()
+        logger.error(f"Flag storage unavailable, serving snapshot version {reader.version}: {error}")
+        self.degraded = True
+        return reader.version, flags
+
+    def _write_offline(self, flags, version):
+        if not self.snapshot_path or version == self._written_version:
+            return
+        try:
+            data = write_snapshot(self.snapshot_path, flags, version)
+        except Exception as e:
+            # The offline copy is a fallback; failing to write it must not fail the read
+            logger.error(f"Writing flag snapshot failed: {e}")
+            return
+        self._written_version = version
+        self._snapshot_file = (flags, data, hashlib.sha1(data).hexdigest())
+
+    def _ensure_watcher(self):
+        if not self.use_change_stream or self._watching:
+            return
+        if time.monotonic() < self._watch_retry_at:
+            return
+        with self._lock:
+            if self._watching:
+                return
+            self._watching = True
+            thread = threading.Thread(target=self._watch_changes, name='flag-cache-watcher', daemon=True)
+            thread.start()
+
+    def _watch_changes(self):
+        try:
+            with self.storage.watch() as stream:
+                # Anything written before the stream opened may be missing
+                # from the current snapshot.
+                self.invalidate()
+                for _ in stream:
+                    self.invalidate()
+        except Exception as e:
+            logger.error(f"Flag change stream stopped, falling back to version polling: {e}")
+        finally:
+            self._watch_retry_at = time.monotonic() + self.watch_retry_interval
+            self._watching = False
+
+    def _publish_changes(self, previous, current):
+        previous = {flag['_id']: flag for flag in previous}
+        for flag in current:
+            old = previous.pop(flag['_id'], None)
+            if old is None:
+                self.events.publish('create', flag)
+            elif old != flag:
+                self.events.publish('update', flag)
+        for flag_id in previous:
+            self.events.publish('delete', {'_id': flag_id})
+
+    @staticmethod
+    def _serialize(flags):
+        body = json.dumps(flags, separators=(',', ':'), sort_keys=True, default=str).encode('utf-8')
+        return body, hashlib.sha1(body).hexdigest()
@@ -0,0 +1,60 @@
+import uuid
+import threading
+from collections import deque
+
+class FlagEventBus:
+    """Bounded in-memory log of flag changes that streaming clients wait on.
+
+    Event ids have the form "<epoch>-<sequence>". The epoch is random per
+    worker process, so an id issued by another worker (or before a restart)
+    is never mistaken for a position in this worker's log.
+    """
+
+    def __init__(self, max_events=1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=max_events)
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    @property
+    def last_sequence(self):
+        return self._sequence
+
+    def publish(self, event_type, flag):
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event_type, flag))
+            self._condition.notify_all()
+            return self._sequence
+
+    def notify(self):
+        """Wake up waiting clients without publishing anything."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait(self, after, timeout):
+        """Block until there are events newer than `after` or `timeout` expires."""
+        with self._condition:
+            if self._sequence <= after:
+                self._condition.wait(timeout)
+            return self.events_after(after)
+
+    def events_after(self, after):
+        """Return events newer than `after`, or None if some were already evicted."""
+        with self._condition:
+            oldest_missing = self._sequence - len(self._events)
+            if after < oldest_missing or after > self._sequence:
+                return None
+            return [event for event in self._events if event[0] > after]
+
+    def format_id(self, sequence):
+        return f"{self.epoch}-{sequence}"
+
+    def parse_id(self, event_id):
+        """Return the sequence encoded in an event id issued by this bus, else None."""
+        if not event_id:
+            return None
+        epoch, _, sequence = event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class FlagHistory:
+    """Versioned history of flag changes, kept as events plus checkpoints.
+
+    Every write records one event per changed flag, stamped with the global
+    flag-set version the write produced and the flag's document after the
+    change. Every `checkpoint_interval` versions the whole flag set is saved
+    as a checkpoint, so rebuilding a past version reads the nearest earlier
+    checkpoint and the events after it instead of replaying all history.
+
+    Saving a checkpoint is also what prunes history past its retention
+    period, so one is saved as well whenever the latest is more than half
+    that period old; stores that see few writes then still prune, and their
+    newest checkpoint stays within reach of the events after it.
+    """
+
+    def __init__(self, storage, checkpoint_interval=None):
+        self.storage = storage
+        self.checkpoint_interval = checkpoint_interval or int(os.environ.get('FLAGS_HISTORY_CHECKPOINT_INTERVAL', '100'))
+        # Time of the latest checkpoint this worker knows of, None until one is found
+        self._checkpoint_at = None
+
+    def record(self, version, changes):
+        """Record `changes`, (op, flag_id, flag) tuples, as the write that produced `version`.
+
+        History is best effort: the write has already happened, so a failure
+        here is logged rather than failing the request.
+        """
+        now = time.time()
+        try:
+            self.storage.append_history([
+                {"version": version, "flag_id": str(flag_id), "op": op, "flag": flag, "at": now}
+                for op, flag_id, flag in changes
+            ])
+            # Versions are global, so across all workers exactly one write lands on each multiple
+            if version % self.checkpoint_interval == 0 or self._checkpoint_due(now):
+                self.checkpoint()
+        except Exception as e:
+            logger.error(f"Recording flag history for version {version} failed: {e}")
+
+    def checkpoint(self):
+        """Save the current flag set, labelled with the version read before it."""
+        # Like the cache, read the version first: a write landing in between
+        # is then in the checkpoint and replayed again from its event, which
+        # is harmless because events carry whole documents.
+        version = self.storage.get_version()
+        flags = self.storage.find_all()
+        at = time.time()
+        self.storage.save_checkpoint(version, flags, at)
+        self._checkpoint_at = at
+        return version
+
+    def as_of(self, version=None, timestamp=None):
+        """Return the flags as they were at `version`, or at time `timestamp`, and that version.
+
+        Returns (None, None) when history does not reach back that far.
+        """
+        if timestamp is not None:
+            version = self.storage.history_version_at(timestamp)
+            if version is None:
+                return None, None
+        else:
+            version = min(version, self.storage.get_version())
+        checkpoint = self.storage.find_checkpoint(version)
+        if checkpoint is None:
+            return None, None
+
+        flags = {flag['_id']: flag for flag in checkpoint['flags']}
+        for event in self.storage.history_events(checkpoint['version'], version):
+            flag = event['flag']
+            if flag is None:
+                flags.pop(event['flag_id'], None)
+                continue
+            current = flags.get(event['flag_id'])
+            # Two workers can bump the shared version in the opposite order to
+            # their writes; the flag's own version says which write came last.
+            if current is None or (flag.get('version') or 0) >= (current.get('version') or 0):
+                flags[event['flag_id']] = flag
+        return sorted(flags.values(), key=lambda flag: str(flag.get('name'))), version
+
+    def _checkpoint_due(self, now):
+        """Whether there is no checkpoint yet, or the latest is half the retention period old."""
+        stale_after = self.storage.history_retention / 2
+        if self._checkpoint_at is None or now - self._checkpoint_at >= stale_after:
+            # Checkpoints can also come from other workers, so ask storage before saving one
+            latest = self.storage.find_checkpoint()
+            self._checkpoint_at = latest['at'] if latest else None
+        return self._checkpoint_at is None or now - self._checkpoint_at >= stale_after
@@ -0,0 +1,93 @@
+import os
+import json
+import mmap
+import struct
+import tempfile
+
+# Layout (all integers little-endian):
+#
+#   header   MAGIC | version u64 | flag count u32 | index offset u32
+#   records  one compact JSON document per flag, back to back
+#   index    per flag, sorted by key: key length u16 | key | offset u32 | length u32
+#
+# The key is the flag name (or its _id when it has none). Readers map the file
+# and only decode the records they are asked for.
+
+MAGIC = b'FFSNAP01'
+HEADER = struct.Struct('<8sQII')
+INDEX_ENTRY = struct.Struct('<II')
+KEY_LENGTH = struct.Struct('<H')
+
+def encode_snapshot(flags, version):
+    """Serialize flag documents and their flag-set version into snapshot bytes."""
+    records = []
+    offset = HEADER.size
+    for flag in sorted(flags, key=_key):
+        record = json.dumps(flag, separators=(',', ':'), sort_keys=True, default=str).encode('utf-8')
+        records.append((_key(flag).encode('utf-8'), offset, len(record), record))
+        offset += len(record)
+
+    index = bytearray()
+    for key, record_offset, length, _ in records:
+        if len(key) > 0xFFFF:
+            raise ValueError(f"Flag key of {len(key)} bytes is too long for a snapshot")
+        index += KEY_LENGTH.pack(len(key)) + key + INDEX_ENTRY.pack(record_offset, length)
+
+    header = HEADER.pack(MAGIC, version, len(records), offset)
+    return b''.join([header] + [record for *_, record in records] + [bytes(index)])
+
+def write_snapshot(path, flags, version):
+    """Atomically replace the snapshot file at `path`."""
+    data = encode_snapshot(flags, version)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.flags-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return data
+
+class SnapshotReader:
+    """Memory-mapped, read-only view of a snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, count, index_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{path} is not a flag snapshot")
+
+        self._index = {}
+        position = index_offset
+        for _ in range(count):
+            (key_length,) = KEY_LENGTH.unpack_from(self._map, position)
+            position += KEY_LENGTH.size
+            key = self._map[position:position + key_length].decode('utf-8')
+            position += key_length
+            self._index[key] = INDEX_ENTRY.unpack_from(self._map, position)
+            position += INDEX_ENTRY.size
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        """Return the flag stored under a name (or _id), or None."""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return json.loads(self._map[offset:offset + length])
+
+    def flags(self):
+        return [self.get(key) for key in self._index]
+
+    def close(self):
+        self._map.close()
+
+def _key(flag):
+    name = flag.get('name')
+    return name if isinstance(name, str) else str(flag['_id'])
@@ -0,0 +1,61 @@
+"""Gunicorn settings for serving the API in production.
+
+Run from the repository root with:
+
+    gunicorn --config api/gunicorn.conf.py 'app:create_app()'
+
+Every setting can be overridden with the environment variables below.
+"""
+import os
+import shutil
+import logging
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Workers are separate processes; the default follows the usual 2 x CPU + 1
+# rule but is capped so large nodes don't spawn dozens of MongoDB pools.
+workers = int(os.environ.get('GUNICORN_WORKERS', min((os.cpu_count() or 1) * 2 + 1, 8)))
+
+# "gthread" serves `threads` requests per worker, so a slow MongoDB call only
+# ties up one thread. "gevent" turns every request (and every pymongo socket)
+# into a greenlet, which suits thousands of idle /flags/stream subscribers.
+# Under gthread each subscriber holds a thread, so the API accepts at most
+# FLAGS_MAX_STREAMS of them per worker (half of `threads` by default).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+# Don't preload: MongoClient is not fork-safe, so each worker must import the
+# app (and connect) after it has been forked.
+preload_app = False
+
+# Requests are logged by the app itself
+accesslog = None
+
+
+def on_starting(server):
+    """Start every deployment with an empty Prometheus multiprocess directory."""
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        shutil.rmtree(multiproc_dir, ignore_errors=True)
+        os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """Connect to MongoDB and load the flags before the worker accepts requests."""
+    from routes import service
+    try:
+        service.warm_up()
+    except Exception as e:
+        # Keep the worker; the connection is retried lazily on the first request
+        logging.getLogger(__name__).error(f"Warm-up failed: {e}")
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
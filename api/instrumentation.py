@@ -0,0 +1,125 @@
+import os
+import re
+import time
+import random
+import logging
+import cProfile
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Most stages are cache lookups or single index hits, so resolve well below 1ms
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Environment names come from clients; anything else is labelled "other" to
+# keep the number of time series bounded.
+METRIC_ENVIRONMENTS = frozenset(
+    os.environ.get('FLAGS_METRIC_ENVIRONMENTS', 'development,staging,production').split(',')
+)
+
+STAGE_DURATION = Histogram(
+    'flags_stage_duration_seconds',
+    'Time spent in one stage (storage, convert, evaluate, encode) of a flags operation',
+    ['operation', 'stage', 'environment'],
+    buckets=STAGE_BUCKETS
+)
+CACHE_REQUESTS = Counter(
+    'flags_cache_requests_total',
+    'Lookups in the flag snapshot and serialized response caches',
+    ['cache', 'result']
+)
+POOL_CONNECTIONS = Gauge(
+    'flags_mongo_pool_connections',
+    'MongoDB pool connections that are open or checked out',
+    ['state'],
+    multiprocess_mode='livesum'
+)
+POOL_WAIT = Histogram(
+    'flags_mongo_pool_wait_seconds',
+    'Time spent waiting to check a connection out of the MongoDB pool',
+    buckets=STAGE_BUCKETS
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    'flags_mongo_pool_checkout_failures_total',
+    'MongoDB pool checkouts that failed',
+    ['reason']
+)
+
+_request_stages = ContextVar('flags_request_stages', default=None)
+
+def environment_label(environment):
+    if not environment:
+        return ''
+    return environment if environment in METRIC_ENVIRONMENTS else 'other'
+
+@contextmanager
+def timed(operation, stage, environment=None):
+    """Record how long the block took in the stage histogram and the current request's stages."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.labels(operation, stage, environment_label(environment)).observe(elapsed)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def start_request_stages():
+    _request_stages.set({})
+
+def request_stages():
+    """Return the time spent per stage in the current request, in milliseconds."""
+    stages = _request_stages.get() or {}
+    return {stage: round(elapsed * 1000, 3) for stage, elapsed in stages.items()}
+
+class SlowRequestProfiler:
+    """Profiles a sample of requests and keeps the profiles of slow ones.
+
+    Off unless FLAGS_PROFILE_SLOW_MS is set. A FLAGS_PROFILE_SAMPLE_RATE share
+    of requests runs under cProfile; the profile of any that took at least
+    FLAGS_PROFILE_SLOW_MS is written to FLAGS_PROFILE_DIR for pstats or snakeviz.
+    """
+
+    def __init__(self, threshold_ms=None, sample_rate=None, directory=None):
+        if threshold_ms is None and os.environ.get('FLAGS_PROFILE_SLOW_MS'):
+            threshold_ms = float(os.environ['FLAGS_PROFILE_SLOW_MS'])
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate if sample_rate is not None \
+            else float(os.environ.get('FLAGS_PROFILE_SAMPLE_RATE', '0.01'))
+        self.directory = directory or os.environ.get(
+            'FLAGS_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'flags-profiles')
+        )
+
+    def start(self):
+        """Start profiling this request if it is sampled; returns the profile or None."""
+        if self.threshold_ms is None or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profile
+
+    def finish(self, profile, duration_ms, label):
+        """Stop profiling; return the path of the dumped profile if the request was slow."""
+        profile.disable()
+        if duration_ms < self.threshold_ms:
+            return None
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_')[:80]
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{os.getpid()}-{name}-{int(duration_ms)}ms.prof")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.error(f"Writing profile {path} failed: {e}")
+            return None
+        return path
@@ -0,0 +1,115 @@
+import copy
+import time
+import threading
+from storage_backend import DocumentStorage, DuplicateNameError
+
+class MemoryStorage(DocumentStorage):
+    """Flags held in process memory, for tests, load tests and single-worker edge deployments.
+
+    Reads never take a lock: the flags live in an immutable state tuple that
+    writers replace wholesale, building the next state from a copy under a
+    lock and publishing it with a single assignment. Data belongs to one
+    process and is gone on restart, so run a single API worker with it.
+    """
+
+    def __init__(self, seed=True):
+        super().__init__()
+        self._write_lock = threading.Lock()
+        # (flags by _id, _id by name, version)
+        self._state = ({}, {}, 0)
+        self._history_lock = threading.Lock()
+        self._history = []
+        self._checkpoints = []
+        if seed:
+            self.seed()
+
+    def _open_tenant(self, tenant):
+        store = MemoryStorage(seed=False)
+        store.tenant = tenant
+        return store
+
+    def get_version(self):
+        return self._state[2]
+
+    def bump_version(self):
+        with self._write_lock:
+            by_id, by_name, version = self._state
+            self._state = (by_id, by_name, version + 1)
+            return version + 1
+
+    def append_history(self, events):
+        with self._history_lock:
+            self._history.extend(copy.deepcopy(events))
+
+    def history_events(self, after, until):
+        with self._history_lock:
+            events = [event for event in self._history if after < event['version'] <= until]
+        return copy.deepcopy(sorted(events, key=lambda event: event['version']))
+
+    def history_version_at(self, timestamp):
+        with self._history_lock:
+            return max((event['version'] for event in self._history if event['at'] <= timestamp), default=None)
+
+    def save_checkpoint(self, version, flags, at):
+        with self._history_lock:
+            if any(checkpoint['version'] == version for checkpoint in self._checkpoints):
+                return
+            self._checkpoints.append({'version': version, 'flags': copy.deepcopy(flags), 'at': at})
+            self._checkpoints.sort(key=lambda checkpoint: checkpoint['version'])
+            # Prune what this checkpoint supersedes, as the other backends do
+            cutoff = time.time() - self.history_retention
+            self._history = [event for event in self._history if event['at'] >= cutoff or event['version'] > version]
+            self._checkpoints = [checkpoint for checkpoint in self._checkpoints
+                                 if checkpoint['at'] >= cutoff or checkpoint['version'] >= version]
+
+    def find_checkpoint(self, version=None):
+        with self._history_lock:
+            candidates = [checkpoint for checkpoint in self._checkpoints
+                          if version is None or checkpoint['version'] <= version]
+            return copy.deepcopy(candidates[-1]) if candidates else None
+
+    def _documents(self):
+        return [copy.deepcopy(flag) for flag in self._state[0].values()]
+
+    def _lookup(self, key):
+        by_id, by_name, _ = self._state
+        flag = by_id.get(key) or by_id.get(by_name.get(key))
+        return copy.deepcopy(flag) if flag is not None else None
+
+    def _lookup_name(self, name):
+        by_id, by_name, _ = self._state
+        flag_id = by_name.get(name)
+        return copy.deepcopy(by_id[flag_id]) if flag_id is not None else None
+
+    def _begin(self):
+        self._write_lock.acquire()
+        by_id, by_name, _ = self._state
+        return {'by_id': dict(by_id), 'by_name': dict(by_name)}
+
+    def _get(self, txn, key):
+        flag = txn['by_id'].get(key) or txn['by_id'].get(txn['by_name'].get(key))
+        return copy.deepcopy(flag) if flag is not None else None
+
+    def _put(self, txn, flag):
+        by_id, by_name = txn['by_id'], txn['by_name']
+        name = flag.get('name')
+        if name is not None and by_name.get(name, flag['_id']) != flag['_id']:
+            raise DuplicateNameError(f"Flag name {name} already exists")
+        previous = by_id.get(flag['_id'])
+        if previous is not None and previous.get('name') is not None:
+            del by_name[previous['name']]
+        by_id[flag['_id']] = copy.deepcopy(flag)
+        if name is not None:
+            by_name[name] = flag['_id']
+
+    def _delete(self, txn, flag_id):
+        flag = txn['by_id'].pop(flag_id)
+        if flag.get('name') is not None:
+            del txn['by_name'][flag['name']]
+
+    def _commit(self, txn):
+        self._state = (txn['by_id'], txn['by_name'], self._state[2])
+        self._write_lock.release()
+
+    def _rollback(self, txn):
+        self._write_lock.release()
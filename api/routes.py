@@ -1,25 +1,301 @@
-from flask import Blueprint, request, jsonify
-from feature_flag_service import FeatureFlagService
+import os
+import json
+import math
+import base64
+import binascii
+import threading
+from datetime import datetime, timezone
+from flask import Blueprint, Response, g, request, jsonify, stream_with_context
+from feature_flag_service import is_valid_environment, is_valid_version
+from instrumentation import timed
+from tenants import DEFAULT_TENANT, is_valid_tenant
 
 flags_bp = Blueprint('flags', __name__)
-service = FeatureFlagService()
+# Set by app.create_app(): the default tenant's service and the registry of all tenants
+service = None
+tenants = None
+
+LISTING_PARAMS = ('enabled', 'prefix', 'cursor', 'limit', 'fields', 'stream')
+MAX_PAGE_SIZE = 1000
+MAX_BULK_OPERATIONS = 1000
+
+def _default_max_streams():
+    # A gthread subscriber holds one of the worker's threads for as long as it
+    # stays connected, so keep at least half of them for ordinary requests;
+    # gevent subscribers are greenlets and are only bounded by worker_connections
+    if os.environ.get('GUNICORN_WORKER_CLASS', 'gthread') != 'gthread':
+        return 0
+    return max(1, int(os.environ.get('GUNICORN_THREADS', '8')) // 2)
+
+# Most open /flags/stream connections per worker, 0 for no limit
+MAX_STREAMS = int(os.environ.get('FLAGS_MAX_STREAMS') or _default_max_streams())
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS) if MAX_STREAMS > 0 else None
+
+@flags_bp.before_request
+def resolve_tenant():
+    """Route the request to its tenant's flag service, named by X-Tenant, within the tenant's rate limit."""
+    if request.endpoint in ('flags.healthz', 'flags.ready'):
+        return None
+    tenant = request.headers.get('X-Tenant', DEFAULT_TENANT)
+    if not is_valid_tenant(tenant):
+        return jsonify({"error": "Invalid tenant"}), 400
+    # Checked before anything is built for the tenant, so unknown names cost nothing
+    if not tenants.exists(tenant):
+        return jsonify({"error": "Unknown tenant"}), 404
+    g.tenant = tenant
+    retry_after = tenants.throttle(tenant)
+    if retry_after:
+        response = jsonify({"error": "Rate limit exceeded"})
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response, 429
+    g.service = tenants.get(tenant)
+    return None
+
+@flags_bp.after_request
+def vary_by_tenant(response):
+    # Cached bodies and ETags are per tenant
+    if 'tenant' in g:
+        response.vary.add('X-Tenant')
+    return response
+
+@flags_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the worker is serving requests. Never touches storage."""
+    return jsonify({"status": "ok"}), 200
+
+@flags_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: the flag snapshot is loaded, so /flags can be answered."""
+    status, error = service.readiness()
+    if error:
+        return jsonify({"status": status, "error": error}), 503
+    return jsonify({"status": status}), 200
 
 @flags_bp.route('/flags', methods=['GET'])
 def get_flags():
     env = request.args.get('environment', 'staging')
-    return jsonify(service.get_all_flags(env)), 200
+    if 'as_of' in request.args:
+        return _flags_as_of(env)
+    if any(param in request.args for param in LISTING_PARAMS):
+        return _list_flags(env)
+
+    body, etag = g.service.get_flags_response(env)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def _flags_as_of(env):
+    """Serve the flags as they were at a flag-set version or an ISO 8601 time."""
+    if any(param in request.args for param in LISTING_PARAMS):
+        return jsonify({"error": "as_of cannot be combined with listing parameters"}), 400
+    if not is_valid_environment(env):
+        return jsonify({"error": "Invalid environment"}), 400
+
+    as_of = request.args['as_of']
+    version = timestamp = None
+    if as_of.isdigit():
+        version = int(as_of)
+    else:
+        try:
+            moment = datetime.fromisoformat(as_of.replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({"error": "as_of must be a version number or an ISO 8601 time"}), 400
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        timestamp = moment.timestamp()
+
+    flags, version = g.service.get_flags_as_of(env, version, timestamp)
+    if flags is None:
+        return jsonify({"error": "Flag history does not reach back that far"}), 404
+    response = jsonify(flags)
+    response.headers['X-Flags-Version'] = str(version)
+    return response, 200
+
+def _list_flags(env):
+    """Serve a filtered, projected, paginated or streamed listing straight from the database."""
+    options, error = _parse_listing_args(env)
+    if error:
+        return jsonify({"error": error}), 400
+
+    stream = request.args.get('stream')
+    if stream is not None and stream not in ('true', 'false'):
+        return jsonify({"error": "stream must be true or false"}), 400
+    if stream == 'true':
+        if options['limit'] is not None or options['after'] is not None:
+            return jsonify({"error": "stream cannot be combined with limit or cursor"}), 400
+        flags = g.service.iter_flags(env, options['enabled'], prefix=options['prefix'], fields=options['fields'])
+        return Response(stream_with_context(_stream_json_array(flags)), mimetype='application/json')
+
+    flags, next_after = g.service.list_flags(env, **options)
+    with timed('list', 'encode', env):
+        response = jsonify(flags)
+    if next_after is not None:
+        response.headers['X-Next-Cursor'] = _encode_cursor(next_after)
+    return response, 200
+
+def _parse_listing_args(env):
+    args = request.args
+    if not is_valid_environment(env):
+        return None, "Invalid environment"
+
+    enabled = args.get('enabled')
+    if enabled is not None and enabled not in ('true', 'false'):
+        return None, "enabled must be true or false"
+
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            return None, f"limit must be between 1 and {MAX_PAGE_SIZE}"
+        limit = int(limit)
+
+    fields = args.get('fields')
+    if fields is not None:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        if not fields or not all(_is_valid_field(field) for field in fields):
+            return None, "Invalid fields"
+
+    after = None
+    if args.get('cursor'):
+        after = _decode_cursor(args['cursor'])
+        if after is None:
+            return None, "Invalid cursor"
+
+    return {
+        "enabled": None if enabled is None else enabled == 'true',
+        "prefix": args.get('prefix') or None,
+        "after": after,
+        "limit": limit,
+        "fields": fields
+    }, None
+
+def _stream_json_array(items, chunk_size=100):
+    """Encode an iterable as a JSON array, yielding it in chunks of items."""
+    yield '['
+    chunk = []
+    for index, item in enumerate(items):
+        chunk.append((',' if index else '') + json.dumps(item, default=str))
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    yield ']'
+
+def _encode_cursor(name):
+    return base64.urlsafe_b64encode(name.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+def _is_valid_field(field):
+    return '.' not in field and not field.startswith('$')
+
+@flags_bp.route('/flags/snapshot', methods=['GET'])
+def get_snapshot():
+    """Download every flag as a binary snapshot file for offline use."""
+    data, etag = g.service.get_snapshot_file()
+    response = Response(data, mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Content-Disposition'] = 'attachment; filename=flags.snapshot'
+    return response.make_conditional(request)
+
+@flags_bp.route('/flags/stream', methods=['GET'])
+def stream_flags():
+    if stream_slots is not None and not stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open streams"})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    env = request.args.get('environment', 'staging')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    events = g.service.stream_changes(env, last_event_id)
+    headers = {
+        'Cache-Control': 'no-cache',
+        # Stop nginx from buffering the stream
+        'X-Accel-Buffering': 'no'
+    }
+    response = Response(stream_with_context(_format_sse(events)), mimetype='text/event-stream', headers=headers)
+    if stream_slots is not None:
+        # The server closes the response when the subscriber disconnects, whether or not it was read
+        response.call_on_close(stream_slots.release)
+    return response
+
+def _format_sse(events):
+    for event_id, event_type, data in events:
+        if event_type == 'heartbeat':
+            yield ": keep-alive\n\n"
+        else:
+            yield f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@flags_bp.route('/flags/evaluate', methods=['POST'])
+def evaluate_flags():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    keys = data.get('flags')
+    environments = data.get('environments') or [data.get('environment', 'staging')]
+    context = data.get('context')
+    contexts = data.get('contexts')
+
+    if keys is not None and not _is_string_list(keys):
+        return jsonify({"error": "flags must be a list of flag ids or names"}), 400
+    if not _is_string_list(environments):
+        return jsonify({"error": "environments must be a list of environment names"}), 400
+    if context is not None and contexts is not None:
+        return jsonify({"error": "Send either context or contexts"}), 400
+    if context is not None and not isinstance(context, dict):
+        return jsonify({"error": "context must be an object"}), 400
+    if contexts is not None and (not isinstance(contexts, list) or not all(isinstance(c, dict) for c in contexts)):
+        return jsonify({"error": "contexts must be a list of objects"}), 400
+
+    results, missing = g.service.evaluate_flags(keys, environments, [context] if context is not None else contexts)
+    if context is not None:
+        results = {environment: per_context[0] for environment, per_context in results.items()}
+    return jsonify({"results": results, "missing": missing}), 200
+
+def _is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+@flags_bp.route('/flags/bulk', methods=['POST'])
+def bulk_flags():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    operations = data.get('operations')
+    transaction = data.get('transaction', False)
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BULK_OPERATIONS} operations per request"}), 400
+    if not isinstance(transaction, bool):
+        return jsonify({"error": "transaction must be a boolean"}), 400
+
+    results, error = g.service.bulk_write(operations, transaction)
+    if error:
+        return jsonify({"error": error}), _error_status(error)
+    return jsonify({"results": results}), 200
 
 @flags_bp.route('/flags', methods=['POST'])
 def create_flag():
     data = request.get_json()
-    if not data.get('name'):
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    if not data.get('name') or not isinstance(data['name'], str):
         return jsonify({"error": "Name required"}), 400
-    flag = service.create_flag(data)
+    flag, error = g.service.create_flag(data)
+    if error:
+        return jsonify({"error": error}), _error_status(error)
     return jsonify(flag), 201
 
 @flags_bp.route('/flags/<id>', methods=['GET'])
 def get_flag(id):
-    flag = service.get_flag(id)
+    flag = g.service.get_flag(id)
     if flag:
         return jsonify(flag), 200
     return jsonify({"error": "Feature flag not found"}), 404
@@ -27,9 +303,17 @@ def get_flag(id):
 @flags_bp.route('/flags/<id>', methods=['PUT'])
 def update_flag(id):
     data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
     name = data.get('name')
     description = data.get('description')
     environments = data.get('environments')
+    targeting = data.get('targeting')
+    segments = data.get('segments')
+    version = data.get('version')
+
+    if not is_valid_version(version):
+        return jsonify({"error": "version must be a non-negative integer"}), 400
 
     update_fields = {}
     if name is not None:
@@ -38,17 +322,20 @@ def update_flag(id):
         update_fields['description'] = description
     if environments is not None:
         update_fields['environments'] = environments
+    if targeting is not None:
+        update_fields['targeting'] = targeting
+    if segments is not None:
+        update_fields['segments'] = segments
     
-    flag, error = service.update_flag(id, update_fields)
+    flag, error = g.service.update_flag(id, update_fields, version)
     if error:
-        status_code = 400 if error == "No fields to update" else 404
-        return jsonify({"error": error}), status_code
+        return jsonify({"error": error}), _error_status(error)
     
     return jsonify(flag), 200
 
 @flags_bp.route('/flags/<id>', methods=['DELETE'])
 def delete_flag(id):
-    success = service.delete_flag(id)
+    success = g.service.delete_flag(id)
     if success:
         return jsonify({"message": "Feature flag deleted"}), 204
     return jsonify({"error": "Feature flag not found"}), 404
@@ -56,10 +343,27 @@ def delete_flag(id):
 @flags_bp.route('/flags/<id>/toggle', methods=['POST'])
 def toggle_flag(id):
     data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
     environment = data.get('environment', 'staging')
+    version = data.get('version')
+
+    if not is_valid_environment(environment):
+        return jsonify({"error": "Invalid environment"}), 400
+    if not is_valid_version(version):
+        return jsonify({"error": "version must be a non-negative integer"}), 400
     
-    flag = service.toggle_flag(id, environment)
-    if flag:
-        return jsonify(flag), 200
-        
-    return jsonify({"error": "Feature flag not found"}), 404
\ No newline at end of file
+    flag, error = g.service.toggle_flag(id, environment, version)
+    if error:
+        return jsonify({"error": error}), _error_status(error)
+
+    return jsonify(flag), 200
+
+def _error_status(error):
+    if error == "Feature flag not found":
+        return 404
+    if error in ("Version conflict", "Feature flag name already exists"):
+        return 409
+    if error == "Tenant flag quota exceeded":
+        return 403
+    return 400
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+from storage_backend import DocumentStorage, DuplicateNameError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS flags (id TEXT PRIMARY KEY, name TEXT UNIQUE, doc TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS flag_history (version INTEGER NOT NULL, flag_id TEXT NOT NULL, op TEXT NOT NULL, doc TEXT, at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS flag_history_version ON flag_history (version)",
+    "CREATE INDEX IF NOT EXISTS flag_history_at ON flag_history (at)",
+    "CREATE TABLE IF NOT EXISTS flag_checkpoints (version INTEGER PRIMARY KEY, flags TEXT NOT NULL, at REAL NOT NULL)",
+)
+
+class SQLiteStorage(DocumentStorage):
+    """Flags in an embedded SQLite database file, one JSON document per row.
+
+    Every thread gets its own connection. The database runs in WAL mode, so
+    readers do not block the writer, and several API workers can share one
+    file: the version counter in the meta table keeps their caches in step.
+    Every other tenant gets a database file of its own next to this one.
+    """
+
+    def __init__(self, path, seed=True):
+        super().__init__()
+        if path in ('', ':memory:'):
+            # Each thread's connection would open a private, empty database of its own
+            raise ValueError("SQLite storage needs a database file; use the memory backend for an in-process store")
+        self.path = path
+        self.seed_demo_flags = seed
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def warm_up(self):
+        self._connection()
+
+    def _open_tenant(self, tenant):
+        root, extension = os.path.splitext(self.path)
+        store = SQLiteStorage(f"{root}.{tenant}{extension}", seed=False)
+        store.tenant = tenant
+        return store
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit; writes open their own transactions with BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    for statement in SCHEMA:
+                        connection.execute(statement)
+                    self._ready = True
+                    logger.info(f"SQLite flag storage ready at {self.path}")
+                    if self.seed_demo_flags:
+                        self.seed()
+        return connection
+
+    def get_version(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'flags_version'").fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO meta (key, value) VALUES ('flags_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+            (version,) = connection.execute("SELECT value FROM meta WHERE key = 'flags_version'").fetchone()
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return version
+
+    def append_history(self, events):
+        self._connection().executemany(
+            "INSERT INTO flag_history (version, flag_id, op, doc, at) VALUES (?, ?, ?, ?, ?)",
+            [(event['version'], event['flag_id'], event['op'], _dumps(event['flag']), event['at']) for event in events]
+        )
+
+    def history_events(self, after, until):
+        rows = self._connection().execute(
+            "SELECT version, flag_id, op, doc, at FROM flag_history WHERE version > ? AND version <= ? ORDER BY version",
+            (after, until)
+        )
+        return [
+            {'version': version, 'flag_id': flag_id, 'op': op, 'flag': json.loads(doc) if doc else None, 'at': at}
+            for version, flag_id, op, doc, at in rows
+        ]
+
+    def history_version_at(self, timestamp):
+        (version,) = self._connection().execute(
+            "SELECT MAX(version) FROM flag_history WHERE at <= ?", (timestamp,)
+        ).fetchone()
+        return version
+
+    def save_checkpoint(self, version, flags, at):
+        # Several workers may checkpoint the same version; the first one wins
+        connection = self._connection()
+        cutoff = time.time() - self.history_retention
+        connection.execute(
+            "INSERT OR IGNORE INTO flag_checkpoints (version, flags, at) VALUES (?, ?, ?)",
+            (version, _dumps(flags), at)
+        )
+        # Prune only what this checkpoint supersedes, so the newest checkpoint
+        # and the events after it are never lost however old they are
+        connection.execute("DELETE FROM flag_history WHERE at < ? AND version <= ?", (cutoff, version))
+        connection.execute("DELETE FROM flag_checkpoints WHERE at < ? AND version < ?", (cutoff, version))
+
+    def find_checkpoint(self, version=None):
+        connection = self._connection()
+        if version is None:
+            row = connection.execute("SELECT version, flags, at FROM flag_checkpoints ORDER BY version DESC LIMIT 1").fetchone()
+        else:
+            row = connection.execute(
+                "SELECT version, flags, at FROM flag_checkpoints WHERE version <= ? ORDER BY version DESC LIMIT 1",
+                (version,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'version': row[0], 'flags': json.loads(row[1]), 'at': row[2]}
+
+    def _documents(self):
+        rows = self._connection().execute("SELECT doc FROM flags ORDER BY name")
+        return [json.loads(doc) for (doc,) in rows]
+
+    def _lookup(self, key):
+        return self._get(self._connection(), key)
+
+    def _lookup_name(self, name):
+        row = self._connection().execute("SELECT doc FROM flags WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _begin(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        return connection
+
+    def _get(self, txn, key):
+        row = txn.execute("SELECT doc FROM flags WHERE id = ?", (key,)).fetchone() \
+            or txn.execute("SELECT doc FROM flags WHERE name = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, txn, flag):
+        name = flag.get('name')
+        try:
+            txn.execute(
+                "INSERT INTO flags (id, name, doc) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, doc = excluded.doc",
+                (flag['_id'], name if isinstance(name, str) else None, _dumps(flag))
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateNameError(f"Flag name {name} already exists") from e
+
+    def _delete(self, txn, flag_id):
+        txn.execute("DELETE FROM flags WHERE id = ?", (flag_id,))
+
+    def _commit(self, txn):
+        txn.execute("COMMIT")
+
+    def _rollback(self, txn):
+        txn.execute("ROLLBACK")
+
+def _dumps(document):
+    return json.dumps(document, separators=(',', ':')) if document is not None else None
@@ -1,127 +1,568 @@
 import os
-import uuid
+import re
 import logging
-from pymongo import MongoClient
+import time
+import threading
+from datetime import datetime, timezone
+from pymongo import monitoring, MongoClient, ReturnDocument, ReadPreference, ASCENDING, DESCENDING, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from bson.objectid import ObjectId
+from storage_backend import StorageBackend, DuplicateNameError, SEED_FLAGS, DEFAULT_TENANT
+from instrumentation import POOL_CONNECTIONS, POOL_WAIT, POOL_CHECKOUT_FAILURES
 
 logger = logging.getLogger(__name__)
 
-class FeatureFlagStorage:
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+# Environment variable -> MongoClient keyword argument
+POOL_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Feeds the MongoDB pool metrics; pass to MongoClient(event_listeners=...)."""
+
     def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        POOL_CONNECTIONS.labels('open').inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        POOL_CONNECTIONS.labels('open').dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_FAILURES.labels(str(event.reason)).inc()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        if started is not None:
+            POOL_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+        POOL_CONNECTIONS.labels('in_use').inc()
+
+    def connection_checked_in(self, event):
+        POOL_CONNECTIONS.labels('in_use').dec()
+
+class _WriteMissed(Exception):
+    """Rolls back a bulk transaction in which a write matched no flag."""
+
+class FeatureFlagStorage(StorageBackend):
+    """MongoDB storage backend.
+
+    All tenants share the collections: every document carries a `tenant`
+    field, which every query filters on and which is stripped from what is
+    returned. Tenant stores share the root store's client.
+    """
+
+    def __init__(self, tenant=DEFAULT_TENANT, parent=None):
+        super().__init__()
+        self.tenant = tenant
+        self._parent = parent
+        # The default tenant keeps the counter it had before tenants existed
+        self._version_key = "flags_version" if tenant == DEFAULT_TENANT else f"flags_version:{tenant}"
         self.client = None
         self.db = None
         self.collection = None
+        self.read_collection = None
+        self.meta = None
+        self.history = None
+        self.checkpoints = None
+        self._init_lock = threading.Lock()
+        self.is_replica_set = os.environ.get('MONGO_IS_REPLICA_SET', 'false').lower() == 'true'
+
+    @property
+    def supports_transactions(self):
+        return self.is_replica_set
+
+    @property
+    def supports_change_stream(self):
+        # Tenant caches poll their own version counter rather than each
+        # holding a change stream open on the shared collection
+        return self.is_replica_set and self._parent is None
+
+    def _open_tenant(self, tenant):
+        return FeatureFlagStorage(tenant, parent=self)
 
     def _get_collection(self):
         if self.collection is None:
-            self._initialize_mongo()
-            self._seed_database()
+            with self._init_lock:
+                if self.collection is None:
+                    if self._parent is not None:
+                        self._share_connection(self._parent)
+                    else:
+                        self._initialize_mongo()
+                        self._migrate_tenants()
+                        self._ensure_indexes()
+                        self._ensure_history_indexes()
         return self.collection
 
+    def _share_connection(self, parent):
+        parent._get_collection()
+        self.client = parent.client
+        self.db = parent.db
+        self.read_collection = parent.read_collection
+        self.meta = parent.meta
+        self.history = parent.history
+        self.checkpoints = parent.checkpoints
+        self.collection = parent.collection
+
+    def _get_read_collection(self):
+        """Collection for listings and lookups, honouring MONGO_READ_PREFERENCE."""
+        collection = self._get_collection()
+        return self.read_collection if self.read_collection is not None else collection
+
+    def _get_meta(self):
+        self._get_collection()
+        return self.meta
+
+    def _get_history(self):
+        self._get_collection()
+        return self.history
+
+    def _get_checkpoints(self):
+        self._get_collection()
+        return self.checkpoints
+
     def _initialize_mongo(self):
         try:
             user = os.environ.get('MONGO_INITDB_ROOT_USERNAME')
             pw = os.environ.get('MONGO_INITDB_ROOT_PASSWORD')
             host = os.environ.get('MONGO_HOST', 'localhost')
-            is_replica_set = os.environ.get('MONGO_IS_REPLICA_SET', 'false').lower() == 'true'
-            rs_params = "&replicaSet=mongo&authMechanism=SCRAM-SHA-256" if is_replica_set else ""
+            rs_params = "&replicaSet=mongo&authMechanism=SCRAM-SHA-256" if self.is_replica_set else ""
             uri = f"mongodb://{user}:{pw}@{host}:27017/?authSource=admin{rs_params}" if user and pw else 'mongodb://localhost:27017/'
-            self.client = MongoClient(uri, serverSelectionTimeoutMS=2000)
+            self.client = MongoClient(
+                uri, serverSelectionTimeoutMS=2000,
+                event_listeners=[PoolMetricsListener()],
+                **self._pool_options()
+            )
             self.client.admin.command('ping')
             self.db = self.client.feature_flags_db
-            self.collection = self.db.flags
+            collection = self.db.flags
+            read_preference = os.environ.get('MONGO_READ_PREFERENCE')
+            if read_preference:
+                self.read_collection = collection.with_options(read_preference=READ_PREFERENCES[read_preference])
+            self.meta = self.db.meta
+            self.history = self.db.flag_history
+            self.checkpoints = self.db.flag_checkpoints
+            self.collection = collection
             logger.info("MongoDB connection established successfully!")
         except Exception as e:
             logger.error(f"MongoDB connection failed: {e}")
             raise e
 
-    def _seed_database(self):
-        try:
-            if self.collection.count_documents({}) == 0:
-                logger.info("Seeding database with environment-based feature flags...")
-                flag_configs = [
-                    {
-                        "name": "new-dashboard",
-                        "description": "Ship the redesigned dashboard.",
-                        "environments": {
-                            "development": True,   
-                            "staging": True,       
-                            "production": False    
-                        }
-                    },
-                    {
-                        "name": "beta-checkout",
-                        "description": "New checkout flow for selected users.",
-                        "environments": {
-                            "development": True,   
-                            "staging": True,       
-                            "production": True     
-                        }
-                    },
-                    {
-                        "name": "recommendations",
-                        "description": "Product recommendations widget.",
-                        "environments": {
-                            "development": True,   
-                            "staging": False,      
-                            "production": False    
-                        }
-                    },
-                    {
-                        "name": "ab-test-home-hero",
-                        "description": "A/B test variant of the home hero section.",
-                        "environments": {
-                            "development": True,   
-                            "staging": True,       
-                            "production": True     
-                        }
-                    },
-                    {
-                        "name": "dark-mode",
-                        "description": "Enable dark theme toggle for all users.",
-                        "environments": {
-                            "development": True,  
-                            "staging": True,       
-                            "production": True     
-                        }
-                    },
-                    {
-                        "name": "limit-rate-api",
-                        "description": "Enable request rate limiting on APIs.",
-                        "environments": {
-                            "development": False,  
-                            "staging": True,       
-                            "production": True     
-                        }
-                    }
-                ]
-                
-                for flag_config in flag_configs:
-                    self.collection.insert_one(flag_config)
-                logger.info("Database seeding completed successfully!")
-        except Exception as e:
-            logger.error(f"Error during seeding: {e}")
+    @staticmethod
+    def _pool_options():
+        return {
+            option: int(os.environ[variable])
+            for variable, option in POOL_OPTIONS.items()
+            if os.environ.get(variable)
+        }
+
+    def warm_up(self):
+        """Connect and create indexes now instead of on the first request."""
+        self._get_collection()
+
+    def _migrate_tenants(self):
+        """Move documents written before tenants existed to the default tenant."""
+        for collection in (self.collection, self.history, self.checkpoints):
+            try:
+                result = collection.update_many({"tenant": {"$exists": False}}, {"$set": {"tenant": DEFAULT_TENANT}})
+                if result.modified_count:
+                    logger.info(f"Assigned {result.modified_count} {collection.name} documents to tenant {DEFAULT_TENANT}")
+            except Exception as e:
+                logger.error(f"Error migrating {collection.name} to tenants: {e}")
+        # Indexes replaced by their per-tenant versions
+        legacy_indexes = (
+            (self.collection, 'name_unique'), (self.history, 'version'), (self.checkpoints, 'version_unique'),
+            # TTL indexes, replaced by pruning on checkpoint
+            (self.history, 'at_ttl'), (self.checkpoints, 'at_ttl')
+        )
+        for collection, index in legacy_indexes:
+            try:
+                if index in collection.index_information():
+                    collection.drop_index(index)
+            except Exception as e:
+                logger.error(f"Error dropping index {collection.name}.{index}: {e}")
+
+    def _ensure_indexes(self):
+        indexes = [
+            # Names are unique per tenant; the index also serves name-ordered listings
+            ([("tenant", ASCENDING), ("name", ASCENDING)], {"name": "tenant_name_unique", "unique": True}),
+            # Wildcard index so per-environment lookups work for custom environments too
+            ([("environments.$**", ASCENDING)], {"name": "environments_wildcard"}),
+        ]
+        for keys, options in indexes:
+            try:
+                self.collection.create_index(keys, **options)
+            except Exception as e:
+                logger.error(f"Error creating index {options['name']}: {e}")
+
+    def _ensure_history_indexes(self):
+        # No TTL indexes: a TTL would expire a tenant's only checkpoint before
+        # the events after it, so save_checkpoint prunes history instead
+        indexes = [
+            (self.history, [("tenant", ASCENDING), ("version", ASCENDING)], {"name": "tenant_version"}),
+            (self.checkpoints, [("tenant", ASCENDING), ("version", ASCENDING)], {"name": "tenant_version_unique", "unique": True}),
+        ]
+        for collection, keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except Exception as e:
+                logger.error(f"Error creating index {collection.name}.{options['name']}: {e}")
+
+    def seed(self):
+        """Insert the demo flags if the collection is empty; run by the `flask seed` command."""
+        collection = self._get_collection()
+        if collection.count_documents({"tenant": self.tenant}) == 0:
+            logger.info("Seeding database with environment-based feature flags...")
+            collection.insert_many([{**flag, "tenant": self.tenant} for flag in SEED_FLAGS])
+            logger.info("Database seeding completed successfully!")
+
+    def iter_all(self, environment='staging', enabled=None, prefix=None, after=None, limit=None, fields=None, batch_size=None):
+        """Yield flags with an `enabled` field for the environment.
+
+        All filters are part of the MongoDB query: `enabled` uses the
+        environments index, `prefix` and `after` (the last name of the previous
+        page) use the name index, and `fields` becomes a projection. Results are
+        ordered by name whenever paginating. Documents are fetched from the
+        server `batch_size` at a time as the generator is consumed.
+        """
+        env_path = f"environments.{environment}"
+        query = {"tenant": self.tenant}
+        if enabled is True:
+            query[env_path] = True
+        elif enabled is False:
+            query[env_path] = {"$ne": True}
+
+        name_filter = {}
+        if prefix:
+            name_filter["$regex"] = f"^{re.escape(prefix)}"
+        if after is not None:
+            name_filter["$gt"] = after
+        if name_filter:
+            query["name"] = name_filter
+
+        projection = None
+        if fields is not None:
+            projection = {field: 1 for field in fields if field != 'enabled'}
+            if 'enabled' in fields and 'environments' not in fields:
+                projection[env_path] = 1
+
+        cursor = self._get_read_collection().find(query, projection)
+        if limit is not None or after is not None:
+            cursor = cursor.sort("name", ASCENDING)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
 
-    def get_all(self, environment='staging'):
-        flags = []
-        cursor = self._get_collection().find()
         for flag in cursor:
-            flag = flag.copy()
-            flag['_id'] = str(flag['_id'])
-            flag['enabled'] = flag.get('environments', {}).get(environment, False)
-            flags.append(flag)
+            self._stringify(flag)
+            if fields is None or 'enabled' in fields:
+                flag['enabled'] = flag.get('environments', {}).get(environment, False)
+            if fields is not None and 'environments' not in fields:
+                flag.pop('environments', None)
+            yield flag
+
+    def find_all(self):
+        # Always read snapshots from the primary: they are stamped with the
+        # version counter, which a lagging secondary could be behind.
+        flags = []
+        for flag in self._get_collection().find({"tenant": self.tenant}):
+            flags.append(self._stringify(flag))
         return flags
 
-    def insert_one(self, document):
-        result = self._get_collection().insert_one(document)
+    def get_version(self):
+        """Return the flag-set version counter, bumped on every write."""
+        meta = self._get_meta().find_one({"_id": self._version_key})
+        return meta['value'] if meta else 0
+
+    def bump_version(self):
+        meta = self._get_meta().find_one_and_update(
+            {"_id": self._version_key},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return meta['value']
+
+    def watch(self):
+        return self._get_collection().watch()
+
+    def new_id(self):
+        return ObjectId()
+
+    def find_flag(self, key):
+        return self._stringify(self._get_read_collection().find_one(self._flag_query(key)))
+
+    def find_by_name(self, name):
+        # Duplicate-name checks must see the latest writes
+        return self._stringify(self._get_collection().find_one({"tenant": self.tenant, "name": name}))
+
+    def find_flags(self, keys):
+        """Resolve many keys with a single query; ids are left as stored."""
+        if not keys:
+            return {}
+        docs = list(self._get_collection().find(
+            {"tenant": self.tenant, "$or": [self._build_id_query(key) for key in keys]},
+            {"name": 1, "version": 1}
+        ))
+        by_id = {str(doc['_id']): doc for doc in docs}
+        by_name = {doc.get('name'): doc for doc in docs}
+        found = {}
+        for key in keys:
+            doc = by_id.get(key) or (None if ObjectId.is_valid(key) else by_name.get(key))
+            if doc:
+                found[key] = doc
+        return found
+
+    def insert_flag(self, document):
+        try:
+            result = self._get_collection().insert_one({**document, "tenant": self.tenant})
+        except DuplicateKeyError as e:
+            raise DuplicateNameError(str(e)) from e
         document['_id'] = str(result.inserted_id)
-        return result
+        return document
+
+    def update_flag(self, key, fields, expected_version=None):
+        return self._find_one_and_update(key, {"$set": fields, "$inc": {"version": 1}}, expected_version)
+
+    def toggle_flag(self, key, environment, expected_version=None):
+        """Flip one environment with a single atomic round trip."""
+        return self._find_one_and_update(key, self._toggle_update(environment), expected_version)
+
+    def delete_flag(self, key):
+        return self._stringify(self._get_collection().find_one_and_delete(self._flag_query(key)))
+
+    def bulk_write(self, writes, transaction=False):
+        """Send many writes in one round trip, optionally as one transaction.
+
+        Unordered outside a transaction so a failing write doesn't stop the
+        rest. The affected flags are read back in one query: their documents
+        are the results, and when fewer flags matched than were written they
+        tell which writes missed. A transaction with a miss is rolled back.
+        """
+        requests = [self._bulk_request(write) for write in writes]
+        collection = self._get_collection()
+        errors = {}
+        try:
+            if not transaction:
+                counts = collection.bulk_write(requests, ordered=False).bulk_api_result
+            else:
+                with self.client.start_session() as session:
+                    session.with_transaction(lambda session: self._raise_if_missed(
+                        collection.bulk_write(requests, ordered=True, session=session).bulk_api_result, writes
+                    ))
+                counts = None
+        except BulkWriteError as e:
+            errors = {
+                write_error['index']: ('conflict' if write_error.get('code') == 11000 else 'error',
+                                       write_error.get('errmsg'))
+                for write_error in e.details.get('writeErrors', [])
+            }
+            counts = e.details
+        except _WriteMissed:
+            counts = {}
+
+        if transaction and counts is not None:
+            return self._rolled_back_results(writes, errors)
+        return self._applied_results(writes, errors, counts is None or self._all_matched(counts, writes, errors))
 
-    def find_one(self, query):
-        return self._get_collection().find_one(query)
+    def append_history(self, events):
+        self._get_history().insert_many(
+            [{**event, "tenant": self.tenant, "at": self._to_datetime(event['at'])} for event in events],
+            ordered=False
+        )
 
-    def update_one(self, query, update):
-        return self._get_collection().update_one(query, update)
+    def history_events(self, after, until):
+        cursor = self._get_history().find(
+            {"tenant": self.tenant, "version": {"$gt": after, "$lte": until}}, {"_id": 0, "tenant": 0}
+        ).sort("version", ASCENDING)
+        return [{**event, "at": self._to_timestamp(event['at'])} for event in cursor]
 
-    def delete_one(self, query):
-        return self._get_collection().delete_one(query)
\ No newline at end of file
+    def history_version_at(self, timestamp):
+        event = self._get_history().find_one(
+            {"tenant": self.tenant, "at": {"$lte": self._to_datetime(timestamp)}}, {"version": 1},
+            sort=[("version", DESCENDING)]
+        )
+        return event['version'] if event else None
+
+    def save_checkpoint(self, version, flags, at):
+        # Several workers may checkpoint the same version; the first one wins
+        self._get_checkpoints().update_one(
+            {"tenant": self.tenant, "version": version},
+            {"$setOnInsert": {"flags": flags, "at": self._to_datetime(at)}},
+            upsert=True
+        )
+        # Prune only what this checkpoint supersedes, so the newest checkpoint
+        # and the events after it are never lost however old they are
+        cutoff = self._to_datetime(time.time() - self.history_retention)
+        self._get_checkpoints().delete_many({"tenant": self.tenant, "version": {"$lt": version}, "at": {"$lt": cutoff}})
+        self._get_history().delete_many({"tenant": self.tenant, "version": {"$lte": version}, "at": {"$lt": cutoff}})
+
+    def find_checkpoint(self, version=None):
+        query = {"tenant": self.tenant}
+        if version is not None:
+            query["version"] = {"$lte": version}
+        checkpoint = self._get_checkpoints().find_one(query, {"_id": 0, "tenant": 0}, sort=[("version", DESCENDING)])
+        if checkpoint:
+            checkpoint['at'] = self._to_timestamp(checkpoint['at'])
+        return checkpoint
+
+    def _raise_if_missed(self, counts, writes):
+        if not self._all_matched(counts, writes, {}):
+            raise _WriteMissed()
+
+    @staticmethod
+    def _all_matched(counts, writes, errors):
+        """Whether every update, toggle and delete that raised no error matched a flag."""
+        ops = [write[0] for index, write in enumerate(writes) if index not in errors]
+        return counts.get('nMatched', 0) == sum(op in ('update', 'toggle') for op in ops) \
+            and counts.get('nRemoved', 0) == ops.count('delete')
+
+    def _read_back(self, writes):
+        ids = [write[1]['_id'] if write[0] == 'create' else write[1] for write in writes]
+        return {doc['_id']: doc for doc in self._get_collection().find({"_id": {"$in": ids}, "tenant": self.tenant})}
+
+    def _applied_results(self, writes, errors, all_matched):
+        current = self._read_back(writes) if not all_matched or any(write[0] != 'delete' for write in writes) else {}
+        results = []
+        for index, write in enumerate(writes):
+            if index in errors:
+                results.append(errors[index])
+                continue
+            op = write[0]
+            if op == 'create':
+                doc = current.get(write[1]['_id'], write[1])
+                results.append(('ok', self._stringify(dict(doc))))
+                continue
+            doc = current.get(write[1])
+            expected_version = write[2]
+            if op == 'delete':
+                # Gone is what was asked for, even if another writer got there first
+                missed = not all_matched and doc is not None
+                results.append(('conflict', "Version conflict") if missed else ('ok', None))
+            elif doc is None:
+                results.append(('not_found', "Feature flag not found"))
+            elif not all_matched and expected_version is not None and (doc.get('version') or 0) != expected_version + 1:
+                results.append(('conflict', "Version conflict"))
+            else:
+                results.append(('ok', self._stringify(dict(doc))))
+        return results
+
+    def _rolled_back_results(self, writes, errors):
+        """Results of a rolled back transaction: the writes that failed, and all others aborted."""
+        current = self._read_back(writes)
+        results = []
+        for index, write in enumerate(writes):
+            if index in errors:
+                results.append(errors[index])
+            elif write[0] != 'create' and write[1] not in current:
+                results.append(('not_found', "Feature flag not found"))
+            elif write[0] != 'create' and write[2] is not None and (current[write[1]].get('version') or 0) != write[2]:
+                results.append(('conflict', "Version conflict"))
+            else:
+                results.append(('aborted', "Transaction aborted"))
+        return results
+
+    def _find_one_and_update(self, key, update, expected_version):
+        """Apply an update atomically and return the updated document, or None."""
+        try:
+            flag = self._get_collection().find_one_and_update(
+                self._with_expected_version(self._flag_query(key), expected_version),
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError as e:
+            raise DuplicateNameError(str(e)) from e
+        return self._stringify(flag)
+
+    def _bulk_request(self, write):
+        op = write[0]
+        if op == 'create':
+            return InsertOne({**write[1], "tenant": self.tenant})
+        query = self._with_expected_version({"_id": write[1], "tenant": self.tenant}, write[2])
+        if op == 'update':
+            return UpdateOne(query, {"$set": write[3], "$inc": {"version": 1}})
+        if op == 'toggle':
+            return UpdateOne(query, self._toggle_update(write[3]))
+        return DeleteOne(query)
+
+    @staticmethod
+    def _toggle_update(environment):
+        path = f"environments.{environment}"
+        # Pipeline update so the negation is computed server-side; a missing
+        # environment counts as disabled and becomes enabled.
+        return [{"$set": {
+            path: {"$not": [f"${path}"]},
+            "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+        }}]
+
+    @staticmethod
+    def _with_expected_version(query, expected_version):
+        if expected_version is None:
+            return query
+        if expected_version == 0:
+            # Flags written before versioning have no version field yet
+            return {**query, "version": {"$in": [0, None]}}
+        return {**query, "version": expected_version}
+
+    def _flag_query(self, key):
+        return {**self._build_id_query(key), "tenant": self.tenant}
+
+    @staticmethod
+    def _build_id_query(flag_id):
+        """Build a query for finding a flag by ID, handling both ObjectId and string formats.
+
+        Anything that is not an ObjectId may also be a flag name; both `_id`
+        and the unique `name` index answer it in a single query.
+        """
+        if ObjectId.is_valid(flag_id):
+            return {"_id": ObjectId(flag_id)}
+        return {"$or": [{"_id": flag_id}, {"name": flag_id}]}
+
+    @staticmethod
+    def _to_datetime(timestamp):
+        # Stored as BSON dates so they read as dates in the shell
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+
+    @staticmethod
+    def _to_timestamp(value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    @staticmethod
+    def _stringify(flag):
+        if flag:
+            flag['_id'] = str(flag['_id'])
+            flag.pop('tenant', None)
+        return flag
@@ -0,0 +1,405 @@
+import os
+import uuid
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('mongo', 'memory', 'sqlite')
+DEFAULT_TENANT = 'default'
+
+SEED_FLAGS = [
+    {
+        "name": "new-dashboard",
+        "description": "Ship the redesigned dashboard.",
+        "environments": {"development": True, "staging": True, "production": False}
+    },
+    {
+        "name": "beta-checkout",
+        "description": "New checkout flow for selected users.",
+        "environments": {"development": True, "staging": True, "production": True}
+    },
+    {
+        "name": "recommendations",
+        "description": "Product recommendations widget.",
+        "environments": {"development": True, "staging": False, "production": False}
+    },
+    {
+        "name": "ab-test-home-hero",
+        "description": "A/B test variant of the home hero section.",
+        "environments": {"development": True, "staging": True, "production": True}
+    },
+    {
+        "name": "dark-mode",
+        "description": "Enable dark theme toggle for all users.",
+        "environments": {"development": True, "staging": True, "production": True}
+    },
+    {
+        "name": "limit-rate-api",
+        "description": "Enable request rate limiting on APIs.",
+        "environments": {"development": False, "staging": True, "production": True}
+    }
+]
+
+def create_storage(backend=None):
+    """Build the storage backend named by `backend` or FLAGS_STORAGE_BACKEND (default mongo)."""
+    backend = backend or os.environ.get('FLAGS_STORAGE_BACKEND', 'mongo')
+    if backend == 'mongo':
+        from storage import FeatureFlagStorage
+        return FeatureFlagStorage()
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        # Seeded by the `flask seed` command, like MongoDB
+        return SQLiteStorage(os.environ.get('FLAGS_SQLITE_PATH', 'feature_flags.db'), seed=False)
+    raise ValueError(f"Unknown storage backend {backend}, expected one of {', '.join(BACKENDS)}")
+
+class DuplicateNameError(Exception):
+    """A write would give two flags the same name."""
+
+class StorageBackend:
+    """Operations the service and cache need from a flag store.
+
+    Flags are plain dicts. Flags are looked up by key: an `_id` or, failing
+    that, a name. Returned flags belong to the caller and carry `_id` as a
+    string, except in `find_flags`, whose ids are passed back to `bulk_write`
+    untouched.
+
+    `bulk_write` takes tuples of:
+        ('create', document)                       document['_id'] from new_id()
+        ('update', _id, expected_version, fields)
+        ('toggle', _id, expected_version, environment)
+        ('delete', _id, expected_version)
+    and returns one (status, value) per write, in order. Applied writes are
+    ('ok', flag) with the flag as written, None for deletes. Failed ones
+    carry an error message with status 'conflict' (duplicate name or stale
+    expected version), 'not_found', 'error', or 'aborted' for writes not
+    attempted after a failure in a transaction.
+
+    History is kept as change events, dicts of `version`, `flag_id`, `op`,
+    `flag` (the document after the change, None once deleted) and `at`
+    (epoch seconds), plus checkpoints of every flag, dicts of `version`,
+    `flags` and `at`. Saving a checkpoint prunes the events and checkpoints
+    it supersedes that are older than FLAGS_HISTORY_RETENTION_DAYS; the
+    newest checkpoint and the events after it are always kept.
+
+    A store holds the flags of one tenant, DEFAULT_TENANT unless it came
+    from `for_tenant`; flags, version counter and history are all per tenant.
+    """
+
+    supports_transactions = False
+    supports_change_stream = False
+
+    def __init__(self):
+        self.batch_size = int(os.environ.get('FLAGS_CURSOR_BATCH_SIZE', '500'))
+        self.history_retention = float(os.environ.get('FLAGS_HISTORY_RETENTION_DAYS', '30')) * 86400
+        self.tenant = DEFAULT_TENANT
+        self._tenant_stores = {}
+        self._tenant_lock = threading.Lock()
+
+    def for_tenant(self, tenant):
+        """Return the store of another tenant, sharing this store's connection where it can.
+
+        Stores are kept for the life of the process; the API only asks for
+        provisioned tenants, which bounds them.
+        """
+        if tenant == self.tenant:
+            return self
+        with self._tenant_lock:
+            store = self._tenant_stores.get(tenant)
+            if store is None:
+                store = self._tenant_stores[tenant] = self._open_tenant(tenant)
+        return store
+
+    def _open_tenant(self, tenant):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Connect and prepare the store now instead of on the first request."""
+
+    def seed(self):
+        """Insert the demo flags if the store is empty."""
+        raise NotImplementedError
+
+    def get_all(self, environment='staging', enabled=None, prefix=None, after=None, limit=None, fields=None):
+        return list(self.iter_all(environment, enabled, prefix=prefix, after=after, limit=limit, fields=fields))
+
+    def iter_all(self, environment='staging', enabled=None, prefix=None, after=None, limit=None, fields=None, batch_size=None):
+        """Yield flags with an `enabled` field for the environment.
+
+        `enabled` keeps flags in that state, `prefix` and `after` (the last
+        name of the previous page) filter on name, and `fields` limits the keys
+        returned (plus `_id`). Results are ordered by name when paginating.
+        """
+        raise NotImplementedError
+
+    def find_all(self):
+        """Return every flag document as stored, without `enabled`."""
+        raise NotImplementedError
+
+    def get_version(self):
+        """Return the flag-set version counter, bumped on every write."""
+        raise NotImplementedError
+
+    def bump_version(self):
+        raise NotImplementedError
+
+    def watch(self):
+        raise NotImplementedError("This storage backend has no change stream")
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def find_flag(self, key):
+        raise NotImplementedError
+
+    def find_by_name(self, name):
+        raise NotImplementedError
+
+    def find_flags(self, keys):
+        """Map each key that exists to its flag's `_id`, `name` and `version`."""
+        raise NotImplementedError
+
+    def insert_flag(self, document):
+        """Store a new flag and set its `_id`; raises DuplicateNameError."""
+        raise NotImplementedError
+
+    def update_flag(self, key, fields, expected_version=None):
+        """Set top-level fields and bump the flag's version; returns the flag or None."""
+        raise NotImplementedError
+
+    def toggle_flag(self, key, environment, expected_version=None):
+        """Flip one environment (missing counts as off); returns the flag or None."""
+        raise NotImplementedError
+
+    def delete_flag(self, key):
+        """Delete a flag; returns the deleted flag or None."""
+        raise NotImplementedError
+
+    def bulk_write(self, writes, transaction=False):
+        raise NotImplementedError
+
+    def append_history(self, events):
+        raise NotImplementedError
+
+    def history_events(self, after, until):
+        """Return the events with `after` < version <= `until`, oldest first."""
+        raise NotImplementedError
+
+    def history_version_at(self, timestamp):
+        """Return the version of the last event at or before `timestamp`, or None."""
+        raise NotImplementedError
+
+    def save_checkpoint(self, version, flags, at):
+        raise NotImplementedError
+
+    def find_checkpoint(self, version=None):
+        """Return the latest checkpoint at or before `version` (or the latest of all), or None."""
+        raise NotImplementedError
+
+class DocumentStorage(StorageBackend):
+    """Flag operations for stores that keep whole documents by id.
+
+    Subclasses provide reads (`_documents`, `_lookup`, `_lookup_name`) and a
+    write transaction (`_begin`, `_get`, `_put`, `_delete`, `_commit`,
+    `_rollback`); everything documents can do is implemented here once.
+    Documents returned by the primitives belong to the caller.
+    """
+
+    supports_transactions = True
+
+    def seed(self, flags=SEED_FLAGS):
+        """Insert the demo flags if the store is empty."""
+        if next(iter(self._documents()), None) is not None:
+            return
+        self.bulk_write([('create', {**flag, '_id': self.new_id()}) for flag in flags])
+        logger.info("Database seeding completed successfully!")
+
+    def iter_all(self, environment='staging', enabled=None, prefix=None, after=None, limit=None, fields=None, batch_size=None):
+        flags = self._documents()
+        if limit is not None or after is not None:
+            flags = sorted(flags, key=_name_order)
+        count = 0
+        for flag in flags:
+            if limit is not None and count >= limit:
+                return
+            if not _matches(flag, environment, enabled, prefix, after):
+                continue
+            count += 1
+            yield _project(flag, environment, fields)
+
+    def find_all(self):
+        return list(self._documents())
+
+    def find_flag(self, key):
+        return self._lookup(key)
+
+    def find_by_name(self, name):
+        return self._lookup_name(name)
+
+    def find_flags(self, keys):
+        found = {}
+        for key in keys:
+            flag = self._lookup(key)
+            if flag is not None:
+                found[key] = {field: flag[field] for field in ('_id', 'name', 'version') if field in flag}
+        return found
+
+    def insert_flag(self, document):
+        document['_id'] = self.new_id()
+        self._write(lambda txn: self._create(txn, document))
+        return document
+
+    def update_flag(self, key, fields, expected_version=None):
+        return self._write(lambda txn: self._update(txn, key, expected_version, fields))
+
+    def toggle_flag(self, key, environment, expected_version=None):
+        return self._write(lambda txn: self._toggle(txn, key, expected_version, environment))
+
+    def delete_flag(self, key):
+        return self._write(lambda txn: self._remove(txn, key, None))
+
+    def bulk_write(self, writes, transaction=False):
+        """Apply all writes in one store transaction.
+
+        Without `transaction` a failing write is skipped and the rest are
+        still committed; with it the first failure rolls everything back.
+        """
+        results = []
+        txn = self._begin()
+        try:
+            for write in writes:
+                try:
+                    flag = self._apply(txn, write)
+                except DuplicateNameError as e:
+                    result = ('conflict', str(e))
+                except (TypeError, ValueError) as e:
+                    result = ('error', str(e))
+                else:
+                    result = ('ok', flag if write[0] != 'delete' else None) if flag is not None \
+                        else self._write_miss(txn, write)
+                results.append(result)
+                if result[0] != 'ok' and transaction:
+                    self._rollback(txn)
+                    return results + [('aborted', "Transaction aborted")] * (len(writes) - len(results))
+        except BaseException:
+            self._rollback(txn)
+            raise
+        self._commit(txn)
+        return results
+
+    def _write(self, change):
+        txn = self._begin()
+        try:
+            result = change(txn)
+        except BaseException:
+            self._rollback(txn)
+            raise
+        self._commit(txn)
+        return result
+
+    def _apply(self, txn, write):
+        op = write[0]
+        if op == 'create':
+            return self._create(txn, write[1])
+        if op == 'update':
+            return self._update(txn, *write[1:])
+        if op == 'toggle':
+            return self._toggle(txn, *write[1:])
+        if op == 'delete':
+            return self._remove(txn, *write[1:])
+        raise ValueError(f"Unknown write {op}")
+
+    def _write_miss(self, txn, write):
+        """Tell why an update, toggle or delete matched nothing."""
+        if self._get(txn, write[1]) is None:
+            return ('not_found', "Feature flag not found")
+        return ('conflict', "Version conflict")
+
+    def _create(self, txn, document):
+        self._put(txn, dict(document))
+        return document
+
+    def _update(self, txn, key, expected_version, fields):
+        flag = self._get(txn, key)
+        if flag is None or not _version_matches(flag, expected_version):
+            return None
+        flag.update(fields)
+        flag['version'] = (flag.get('version') or 0) + 1
+        self._put(txn, flag)
+        return flag
+
+    def _toggle(self, txn, key, expected_version, environment):
+        flag = self._get(txn, key)
+        if flag is None or not _version_matches(flag, expected_version):
+            return None
+        environments = dict(flag.get('environments') or {})
+        environments[environment] = not environments.get(environment)
+        flag['environments'] = environments
+        flag['version'] = (flag.get('version') or 0) + 1
+        self._put(txn, flag)
+        return flag
+
+    def _remove(self, txn, key, expected_version):
+        flag = self._get(txn, key)
+        if flag is None or not _version_matches(flag, expected_version):
+            return None
+        self._delete(txn, flag['_id'])
+        return flag
+
+    def _documents(self):
+        raise NotImplementedError
+
+    def _lookup(self, key):
+        raise NotImplementedError
+
+    def _lookup_name(self, name):
+        raise NotImplementedError
+
+    def _begin(self):
+        raise NotImplementedError
+
+    def _get(self, txn, key):
+        raise NotImplementedError
+
+    def _put(self, txn, flag):
+        """Insert or replace a flag by `_id`; raises DuplicateNameError."""
+        raise NotImplementedError
+
+    def _delete(self, txn, flag_id):
+        raise NotImplementedError
+
+    def _commit(self, txn):
+        raise NotImplementedError
+
+    def _rollback(self, txn):
+        raise NotImplementedError
+
+def _name_order(flag):
+    # Flags without a name sort first, as MongoDB orders missing values
+    name = flag.get('name')
+    return (name is not None, str(name) if name is not None else '')
+
+def _matches(flag, environment, enabled, prefix, after):
+    if enabled is not None and (flag.get('environments', {}).get(environment) is True) != enabled:
+        return False
+    name = flag.get('name')
+    if prefix and not (isinstance(name, str) and name.startswith(prefix)):
+        return False
+    if after is not None and not (isinstance(name, str) and name > after):
+        return False
+    return True
+
+def _project(flag, environment, fields):
+    enabled = flag.get('environments', {}).get(environment, False)
+    if fields is not None:
+        flag = {key: value for key, value in flag.items() if key == '_id' or key in fields}
+    if fields is None or 'enabled' in fields:
+        flag['enabled'] = enabled
+    return flag
+
+def _version_matches(flag, expected_version):
+    # Flags written before versioning have no version field and count as 0
+    return expected_version is None or (flag.get('version') or 0) == expected_version
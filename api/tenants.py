@@ -0,0 +1,109 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from storage_backend import DEFAULT_TENANT
+from feature_flag_service import FeatureFlagService
+
+TENANT_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,62}$')
+
+def is_valid_tenant(tenant):
+    # Tenant names end up in storage keys and SQLite file names
+    return isinstance(tenant, str) and TENANT_PATTERN.match(tenant) is not None
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Spend a token; returns 0 if one was available, else the seconds until one is."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class TenantRegistry:
+    """Flag services per tenant, each with its own storage scope, cache partition and rate limit.
+
+    Only the default tenant and the `tenants` provisioned for the deployment
+    (FLAGS_TENANTS) exist; requests cannot create tenants, and with them
+    stores, files or cache partitions, by naming new ones.
+
+    Services are built on first use from `default.storage.for_tenant()` and
+    kept in an LRU of at most `cache_size` tenants; the least recently used
+    tenant's partition is dropped and reloaded from storage on its next
+    request. A plain LRU, so requests cycling through more tenants than that
+    evict the hot ones too; size the cache for the provisioned tenants. The
+    default tenant's service is never evicted.
+
+    With a `rate_limit`, each tenant may make that many requests per second
+    per worker, in bursts of up to `rate_burst`.
+    """
+
+    def __init__(self, default, cache_size=None, rate_limit=None, rate_burst=None, tenants=None):
+        self.default = default
+        if tenants is None:
+            tenants = [name.strip() for name in os.environ.get('FLAGS_TENANTS', '').split(',') if name.strip()]
+        invalid = [name for name in tenants if not is_valid_tenant(name)]
+        if invalid:
+            raise ValueError(f"Invalid tenant names: {', '.join(map(str, invalid))}")
+        self.provisioned = frozenset(tenants)
+        self.cache_size = cache_size or int(os.environ.get('FLAGS_TENANT_CACHE_SIZE', '256'))
+        self.rate_limit = rate_limit if rate_limit is not None else float(os.environ.get('FLAGS_TENANT_RATE_LIMIT', '0'))
+        self.rate_burst = rate_burst or float(os.environ.get('FLAGS_TENANT_RATE_BURST', '0')) or max(1.0, 2 * self.rate_limit)
+        self._lock = threading.Lock()
+        self._services = OrderedDict()
+        self._buckets = OrderedDict()
+
+    def exists(self, tenant):
+        """Whether a tenant is the default one or has been provisioned."""
+        return tenant == DEFAULT_TENANT or tenant in self.provisioned
+
+    def get(self, tenant):
+        """Return the flag service of a provisioned tenant, creating its partition if needed."""
+        if tenant == DEFAULT_TENANT:
+            return self.default
+        if tenant not in self.provisioned:
+            raise KeyError(f"Unknown tenant {tenant}")
+        with self._lock:
+            service = self._services.get(tenant)
+            if service is not None:
+                self._services.move_to_end(tenant)
+                return service
+        # Build outside the lock; opening a tenant's store may touch disk
+        service = FeatureFlagService(self.default.storage.for_tenant(tenant), self._snapshot_path(tenant))
+        with self._lock:
+            service = self._services.setdefault(tenant, service)
+            self._services.move_to_end(tenant)
+            while len(self._services) > self.cache_size:
+                self._services.popitem(last=False)
+        return service
+
+    def _snapshot_path(self, tenant):
+        # A tenant must never fall back to another tenant's offline snapshot
+        path = self.default.cache.snapshot_path
+        return f"{path}.{tenant}" if path else ''
+
+    def throttle(self, tenant):
+        """Count a request; returns 0 if it may proceed, else the seconds to wait."""
+        if self.rate_limit <= 0:
+            return 0
+        with self._lock:
+            bucket = self._buckets.get(tenant)
+            if bucket is None:
+                bucket = self._buckets[tenant] = TokenBucket(self.rate_limit, self.rate_burst)
+                # A forgotten bucket starts full again, so this only ever errs on the lenient side
+                while len(self._buckets) > 4 * self.cache_size:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(tenant)
+            return bucket.take()
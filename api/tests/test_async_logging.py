@@ -0,0 +1,56 @@
+import io
+import json
+import queue
+import logging
+import unittest
+from pythonjsonlogger import jsonlogger
+from async_logging import BatchingLogWriter, DroppingQueueHandler, configure_async_logging
+
+class TestAsyncLogging(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = logging.getLogger(f"test-async-logging-{self.id()}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.formatter = jsonlogger.JsonFormatter("%(levelname)s %(message)s", rename_fields={"exc_info": "traceback"})
+
+    def lines(self):
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_records_are_written_by_the_background_thread(self):
+        writer = configure_async_logging([self.logger], self.formatter, self.stream, queue_size=100, batch_size=10)
+        for i in range(25):
+            self.logger.info({"event": "api_request", "n": i})
+        writer.stop()
+
+        self.assertFalse(writer.is_alive())
+        self.assertEqual([line['n'] for line in self.lines()], list(range(25)))
+
+    def test_exceptions_are_rendered_on_the_writer(self):
+        writer = configure_async_logging([self.logger], self.formatter, self.stream)
+        try:
+            raise ValueError("boom")
+        except ValueError as e:
+            self.logger.error({"event": "unhandled_exception"}, exc_info=e)
+        writer.stop()
+
+        (line,) = self.lines()
+        self.assertIn("ValueError: boom", line['traceback'])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        self.logger.addHandler(handler)
+        for i in range(5):
+            self.logger.info({"n": i})
+        self.assertEqual(handler.dropped, 3)
+
+        writer = BatchingLogWriter(handler, self.formatter, self.stream)
+        writer.start()
+        writer.stop()
+
+        lines = self.lines()
+        self.assertEqual([line.get('n') for line in lines[:2]], [0, 1])
+        self.assertEqual((lines[2]['event'], lines[2]['count']), ("log_records_dropped", 3))
+
+if __name__ == '__main__':
+    unittest.main()
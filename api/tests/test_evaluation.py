@@ -0,0 +1,109 @@
+import unittest
+from api.evaluation import compile_flag, validate_targeting, bucket, BUCKETS
+
+class TestCompiledFlag(unittest.TestCase):
+    def test_environment_state_without_context(self):
+        flag = compile_flag({'name': 'f', 'environments': {'staging': True, 'production': False}})
+        self.assertTrue(flag.evaluate('staging'))
+        self.assertFalse(flag.evaluate('production'))
+        self.assertFalse(flag.evaluate('development'))
+
+    def test_disabled_environment_ignores_targeting(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': False},
+            'targeting': {'production': {'rules': [{'attribute': 'country', 'operator': 'in', 'values': ['IL']}]}}
+        })
+        self.assertFalse(flag.evaluate('production', {'country': 'IL'}))
+
+    def test_rules_match_all_by_default(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': True},
+            'targeting': {'production': {'rules': [
+                {'attribute': 'country', 'operator': 'in', 'values': ['IL', 'US']},
+                {'attribute': 'age', 'operator': 'gte', 'values': [18]}
+            ]}}
+        })
+        self.assertTrue(flag.evaluate('production', {'country': 'IL', 'age': 30}))
+        self.assertFalse(flag.evaluate('production', {'country': 'IL', 'age': 12}))
+        self.assertFalse(flag.evaluate('production', {'country': 'FR', 'age': 30}))
+        self.assertFalse(flag.evaluate('production', {}))
+
+    def test_rules_match_any(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': True},
+            'targeting': {'production': {'match': 'any', 'rules': [
+                {'attribute': 'email', 'operator': 'ends_with', 'values': ['@example.com']},
+                {'attribute': 'user_id', 'operator': 'in_segment', 'values': ['beta']}
+            ]}},
+            'segments': {'beta': ['u1', 'u2']}
+        })
+        self.assertTrue(flag.evaluate('production', {'email': 'a@example.com'}))
+        self.assertTrue(flag.evaluate('production', {'user_id': 'u2'}))
+        self.assertFalse(flag.evaluate('production', {'user_id': 'u3', 'email': 'a@other.com'}))
+
+    def test_unhashable_context_values_do_not_match(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': True},
+            'targeting': {'production': {'rules': [{'attribute': 'country', 'operator': 'in', 'values': ['IL']}]}}
+        })
+        self.assertFalse(flag.evaluate('production', {'country': ['IL']}))
+
+    def test_percentage_rollout_is_stable_and_proportional(self):
+        flag = compile_flag({
+            'name': 'gradual',
+            'environments': {'production': True},
+            'targeting': {'production': {'rollout': {'percentage': 25, 'key': 'user_id'}}}
+        })
+        users = [{'user_id': f'user-{i}'} for i in range(4000)]
+        enabled = [flag.evaluate('production', user) for user in users]
+        self.assertAlmostEqual(sum(enabled) / len(users), 0.25, delta=0.03)
+        self.assertEqual(enabled, [flag.evaluate('production', user) for user in users])
+        self.assertFalse(flag.evaluate('production', {}))
+
+    def test_full_rollout_needs_no_key(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': True},
+            'targeting': {'production': {'rollout': {'percentage': 100}}}
+        })
+        self.assertTrue(flag.evaluate('production', {}))
+
+    def test_invalid_stored_targeting_fails_closed(self):
+        flag = compile_flag({
+            'name': 'f',
+            'environments': {'production': True},
+            'targeting': {'production': {'rules': [{'operator': 'in'}]}}
+        })
+        self.assertFalse(flag.evaluate('production', {'country': 'IL'}))
+        self.assertTrue(flag.evaluate('production'))
+
+    def test_bucket_range(self):
+        self.assertTrue(0 <= bucket('f', 'user') < BUCKETS)
+        self.assertEqual(bucket('f', 'user'), bucket('f', 'user'))
+
+
+class TestValidateTargeting(unittest.TestCase):
+    def test_valid(self):
+        self.assertIsNone(validate_targeting(
+            {'production': {'rules': [{'attribute': 'plan', 'operator': 'equals', 'values': ['pro']}],
+                            'rollout': {'percentage': 12.5, 'key': 'user_id'}}},
+            {'beta': ['u1']}
+        ))
+        self.assertIsNone(validate_targeting(None))
+
+    def test_invalid(self):
+        cases = [
+            ({'production': {'rules': [{'attribute': 'a', 'operator': 'regex', 'values': ['x']}]}}, None),
+            ({'production': {'rules': [{'attribute': 'a', 'operator': 'gt', 'values': ['x']}]}}, None),
+            ({'production': {'rules': [{'attribute': 'a', 'operator': 'in', 'values': []}]}}, None),
+            ({'production': {'rollout': {'percentage': 120}}}, None),
+            ({'production': {'match': 'some'}}, None),
+            ({'production': {'unknown': True}}, None),
+            (None, {'beta': 'u1'}),
+        ]
+        for targeting, segments in cases:
+            self.assertIsNotNone(validate_targeting(targeting, segments), (targeting, segments))
@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from api.flag_cache import FlagCache
+from api.flag_events import FlagEventBus
+
+class TestFlagCache(unittest.TestCase):
+    def setUp(self):
+        self.mock_storage = MagicMock()
+        self.mock_storage.get_version.return_value = 1
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': True, 'production': False}}
+        ]
+        self.cache = FlagCache(self.mock_storage)
+        self.cache.use_change_stream = False
+
+    def test_get_all_computes_enabled_per_environment(self):
+        self.assertTrue(self.cache.get_all('staging')[0]['enabled'])
+        self.assertFalse(self.cache.get_all('production')[0]['enabled'])
+        self.assertFalse(self.cache.get_all('development')[0]['enabled'])
+        self.mock_storage.find_all.assert_called_once()
+
+    def test_get_all_does_not_leak_enabled_into_snapshot(self):
+        self.cache.get_all('staging')
+        self.assertNotIn('enabled', self.cache.snapshot()[0])
+
+    def test_invalidate_forces_reload(self):
+        self.cache.get_all('staging')
+        self.cache.invalidate()
+        self.cache.get_all('staging')
+        self.assertEqual(self.mock_storage.find_all.call_count, 2)
+
+    def test_version_poll_detects_external_writes(self):
+        self.cache.poll_interval = 0
+        self.cache.get_all('staging')
+        self.cache.get_all('staging')
+        self.assertEqual(self.mock_storage.find_all.call_count, 1)
+
+        self.mock_storage.get_version.return_value = 2
+        self.cache.get_all('staging')
+        self.assertEqual(self.mock_storage.find_all.call_count, 2)
+
+    def test_version_not_polled_within_interval(self):
+        self.cache.poll_interval = 60
+        self.cache.get_all('staging')
+        self.mock_storage.get_version.return_value = 2
+        self.cache.get_all('staging')
+        self.assertEqual(self.mock_storage.find_all.call_count, 1)
+
+    def test_get_response_reuses_serialized_body(self):
+        body, etag = self.cache.get_response('staging')
+        self.assertEqual(json.loads(body)[0]['enabled'], True)
+        self.assertIs(self.cache.get_response('staging')[0], body)
+
+    def test_get_response_rebuilt_after_invalidate(self):
+        _, etag = self.cache.get_response('staging')
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': False}}
+        ]
+        self.cache.invalidate()
+        self.assertNotEqual(self.cache.get_response('staging')[1], etag)
+
+    def test_disabled_cache_reads_through(self):
+        self.cache.enabled = False
+        self.mock_storage.get_all.return_value = [{'name': 'f1', 'enabled': True}]
+        self.assertEqual(self.cache.get_all('staging'), [{'name': 'f1', 'enabled': True}])
+        self.mock_storage.find_all.assert_not_called()
+
+    def test_change_stream_invalidates(self):
+        stream = MagicMock()
+        stream.__enter__.return_value = iter([{'operationType': 'update'}])
+        self.mock_storage.watch.return_value = stream
+        self.cache.get_all('staging')
+
+        self.cache._watching = True
+        self.cache._watch_changes()
+
+        self.assertIsNone(self.cache._flags)
+        self.assertFalse(self.cache._watching)
+
+    def test_reload_publishes_changes(self):
+        self.cache.events = FlagEventBus()
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': True}},
+            {'_id': '2', 'name': 'f2', 'environments': {}}
+        ]
+        self.cache.snapshot()
+        self.assertEqual(self.cache.events.events_after(0), [])
+
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': False}},
+            {'_id': '3', 'name': 'f3', 'environments': {}}
+        ]
+        self.cache.invalidate()
+        self.cache.snapshot()
+
+        events = [(event_type, flag['_id']) for _, event_type, flag in self.cache.events.events_after(0)]
+        self.assertEqual(events, [('update', '1'), ('create', '3'), ('delete', '2')])
+
+    def test_compiled_flags_reused_until_document_changes(self):
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': True}},
+            {'_id': '2', 'name': 'f2', 'environments': {}}
+        ]
+        first = self.cache.compiled()
+        self.assertIs(self.cache.compiled(), first)
+
+        self.mock_storage.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': True}},
+            {'_id': '2', 'name': 'f2', 'environments': {'staging': True}}
+        ]
+        self.cache.invalidate()
+        second = self.cache.compiled()
+        self.assertIs(second['1'], first['1'])
+        self.assertIsNot(second['2'], first['2'])
+        self.assertTrue(second['2'].evaluate('staging'))
+
+    def test_falls_back_to_snapshot_file_when_storage_fails(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache.snapshot_path = os.path.join(directory, 'flags.snapshot')
+        self.cache.snapshot()
+        self.assertTrue(os.path.exists(self.cache.snapshot_path))
+
+        fresh = FlagCache(self.mock_storage)
+        fresh.use_change_stream = False
+        fresh.snapshot_path = self.cache.snapshot_path
+        self.mock_storage.find_all.side_effect = Exception('connection refused')
+        self.assertTrue(fresh.get_all('staging')[0]['enabled'])
+        self.assertTrue(fresh.degraded)
+
+        # Storage is retried once it is back
+        self.mock_storage.find_all.side_effect = None
+        fresh.retry_interval = 0
+        fresh.snapshot()
+        fresh.snapshot()
+        self.assertFalse(fresh.degraded)
+
+    def test_snapshot_file_failure_does_not_fail_reads(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache.snapshot_path = os.path.join(directory, 'flags.snapshot')
+        self.mock_storage.find_all.return_value = [{'_id': '1', 'name': 'x' * 70000, 'environments': {}}]
+
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(len(self.cache.get_all('staging')), 1)
+        self.assertFalse(os.path.exists(self.cache.snapshot_path))
+
+    def test_storage_errors_raise_without_snapshot_file(self):
+        self.mock_storage.find_all.side_effect = Exception('connection refused')
+        with self.assertRaises(Exception):
+            self.cache.snapshot()
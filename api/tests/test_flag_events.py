@@ -0,0 +1,31 @@
+import unittest
+from api.flag_events import FlagEventBus
+
+class TestFlagEventBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = FlagEventBus(max_events=3)
+
+    def test_events_after(self):
+        self.bus.publish('create', {'_id': '1'})
+        self.bus.publish('update', {'_id': '1'})
+        events = self.bus.events_after(1)
+        self.assertEqual(events, [(2, 'update', {'_id': '1'})])
+        self.assertEqual(self.bus.events_after(2), [])
+
+    def test_events_after_evicted_returns_none(self):
+        for i in range(5):
+            self.bus.publish('update', {'_id': str(i)})
+        self.assertIsNone(self.bus.events_after(1))
+        self.assertEqual(len(self.bus.events_after(2)), 3)
+
+    def test_wait_times_out_without_events(self):
+        self.assertEqual(self.bus.wait(0, timeout=0.01), [])
+
+    def test_id_round_trip(self):
+        event_id = self.bus.format_id(7)
+        self.assertEqual(self.bus.parse_id(event_id), 7)
+
+    def test_foreign_ids_rejected(self):
+        self.assertIsNone(self.bus.parse_id('deadbeef-7'))
+        self.assertIsNone(self.bus.parse_id(f'{self.bus.epoch}-x'))
+        self.assertIsNone(self.bus.parse_id(None))
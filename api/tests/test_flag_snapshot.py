@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from api.flag_snapshot import SnapshotReader, encode_snapshot, write_snapshot
+
+class TestFlagSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'flags.snapshot')
+        self.flags = [
+            {'_id': '2', 'name': 'beta', 'environments': {'staging': True}},
+            {'_id': '1', 'name': 'alpha', 'environments': {'production': False}, 'version': 3},
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        write_snapshot(self.path, self.flags, 42)
+        reader = SnapshotReader(self.path)
+        try:
+            self.assertEqual(reader.version, 42)
+            self.assertEqual(len(reader), 2)
+            self.assertEqual(reader.get('alpha'), self.flags[1])
+            self.assertIsNone(reader.get('missing'))
+            self.assertEqual([flag['name'] for flag in reader.flags()], ['alpha', 'beta'])
+        finally:
+            reader.close()
+
+    def test_encoding_is_deterministic(self):
+        self.assertEqual(encode_snapshot(self.flags, 1), encode_snapshot(list(reversed(self.flags)), 1))
+
+    def test_rejects_keys_too_long_for_the_index(self):
+        with self.assertRaises(ValueError):
+            encode_snapshot([{'_id': '1', 'name': 'x' * 70000}], 1)
+
+    def test_rejects_other_files(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 64)
+        with self.assertRaises(ValueError):
+            SnapshotReader(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from prometheus_client import REGISTRY
+from instrumentation import (
+    SlowRequestProfiler, environment_label, record_cache, request_stages, start_request_stages, timed
+)
+from storage import PoolMetricsListener
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+class TestStageTiming(unittest.TestCase):
+    def test_timed_observes_histogram_and_request_stages(self):
+        labels = dict(operation='get_flags', stage='encode', environment='production')
+        before = sample('flags_stage_duration_seconds_count', **labels)
+        start_request_stages()
+
+        with timed('get_flags', 'encode', 'production'):
+            pass
+        with timed('get_flags', 'encode', 'production'):
+            pass
+
+        self.assertEqual(sample('flags_stage_duration_seconds_count', **labels), before + 2)
+        self.assertEqual(list(request_stages()), ['encode'])
+
+    def test_timed_records_when_block_raises(self):
+        labels = dict(operation='toggle', stage='storage', environment='')
+        before = sample('flags_stage_duration_seconds_count', **labels)
+        with self.assertRaises(RuntimeError):
+            with timed('toggle', 'storage'):
+                raise RuntimeError()
+        self.assertEqual(sample('flags_stage_duration_seconds_count', **labels), before + 1)
+
+    def test_unknown_environments_share_a_label(self):
+        self.assertEqual(environment_label('staging'), 'staging')
+        self.assertEqual(environment_label('pr-1234'), 'other')
+
+    def test_cache_counter(self):
+        before = sample('flags_cache_requests_total', cache='response', result='miss')
+        record_cache('response', False)
+        self.assertEqual(sample('flags_cache_requests_total', cache='response', result='miss'), before + 1)
+
+class TestPoolMetricsListener(unittest.TestCase):
+    def test_tracks_open_and_checked_out_connections(self):
+        listener = PoolMetricsListener()
+        open_before = sample('flags_mongo_pool_connections', state='open')
+        in_use_before = sample('flags_mongo_pool_connections', state='in_use')
+        waits_before = sample('flags_mongo_pool_wait_seconds_count')
+        event = MagicMock()
+
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        self.assertEqual(sample('flags_mongo_pool_connections', state='in_use'), in_use_before + 1)
+        self.assertEqual(sample('flags_mongo_pool_wait_seconds_count'), waits_before + 1)
+
+        listener.connection_checked_in(event)
+        listener.connection_closed(event)
+        self.assertEqual(sample('flags_mongo_pool_connections', state='open'), open_before)
+        self.assertEqual(sample('flags_mongo_pool_connections', state='in_use'), in_use_before)
+
+class TestSlowRequestProfiler(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_disabled_without_threshold(self):
+        self.assertIsNone(SlowRequestProfiler(sample_rate=1.0, directory=self.directory).start())
+
+    def test_dumps_only_slow_requests(self):
+        profiler = SlowRequestProfiler(threshold_ms=50, sample_rate=1.0, directory=self.directory)
+
+        self.assertIsNone(profiler.finish(profiler.start(), 10, "GET /flags"))
+        path = profiler.finish(profiler.start(), 75, "GET /flags")
+
+        self.assertTrue(os.path.isfile(path))
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+        self.assertIn("GET_flags", path)
+
+if __name__ == '__main__':
+    unittest.main()
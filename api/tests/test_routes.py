@@ -3,17 +3,29 @@ Unit tests for Flask routes.
 Uses module-level patching to prevent FeatureFlagStorage from attempting MongoDB connections.
 """
 import sys
+import time
+import json
+import logging
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 
-mock_storage_instance = MagicMock()
+mock_storage_instance = MagicMock(history_retention=30 * 86400)
 
 storage_patcher = patch('storage.FeatureFlagStorage', return_value=mock_storage_instance)
 storage_patcher.start()
 
-from api.app import app
+from api.app import create_app, logger as app_logger
 from api import routes
 
+app = create_app()
+from routes import service, tenants
+
+
+def _insert(document):
+    document['_id'] = 'new-id'
+    return document
+
 
 class TestFeatureFlagsAPI(unittest.TestCase):
     """Test the Flask routes with mocked storage layer."""
@@ -22,6 +34,13 @@ class TestFeatureFlagsAPI(unittest.TestCase):
     def setUpClass(cls):
         """Set up test fixtures once for all tests."""
         app.config['TESTING'] = True
+        # Keep request logs out of the test output
+        cls.log_level = app_logger.level
+        app_logger.setLevel(logging.CRITICAL)
+
+    @classmethod
+    def tearDownClass(cls):
+        app_logger.setLevel(cls.log_level)
 
     def setUp(self):
         """Set up test client and reset mock before each test."""
@@ -29,34 +48,412 @@ class TestFeatureFlagsAPI(unittest.TestCase):
         # Reset the mock storage state before each test
         mock_storage_instance.reset_mock()
         # Reset side_effect if set by previous tests
-        mock_storage_instance.find_one.side_effect = None
+        mock_storage_instance.find_flag.side_effect = None
+        mock_storage_instance.insert_flag.side_effect = _insert
+        # A fresh checkpoint, so writes only record their history events
+        mock_storage_instance.find_checkpoint.return_value = {"version": 0, "flags": [], "at": time.time()}
+        # Drop any flag snapshot cached by a previous test
+        service.cache.invalidate()
 
     def test_get_flags_success(self):
         """Verify GET /flags returns 200 and data."""
-        mock_storage_instance.get_all.return_value = [{"_id": "1", "name": "test", "enabled": True}]
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "test", "environments": {"staging": True}}]
         
         response = self.client.get('/flags?environment=staging')
         
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json[0]['name'], "test")
+        self.assertTrue(response.json[0]['enabled'])
 
     def test_get_flags_default_environment(self):
         """Verify GET /flags uses 'staging' as default environment."""
-        mock_storage_instance.get_all.return_value = []
+        mock_storage_instance.find_all.return_value = [
+            {"_id": "1", "name": "test", "environments": {"staging": True, "production": False}}
+        ]
         
         response = self.client.get('/flags')
         
         self.assertEqual(response.status_code, 200)
-        mock_storage_instance.get_all.assert_called_with('staging')
+        self.assertTrue(response.json[0]['enabled'])
+
+    def test_get_flags_served_from_cache(self):
+        """Verify repeated GET /flags calls hit storage only once."""
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "test", "environments": {}}]
+        
+        self.client.get('/flags?environment=staging')
+        self.client.get('/flags?environment=production')
+        
+        mock_storage_instance.find_all.assert_called_once()
+
+    def test_get_flags_enabled_filter(self):
+        """Verify GET /flags?enabled=true is answered by a filtered storage query."""
+        mock_storage_instance.get_all.return_value = [{"_id": "1", "name": "test", "enabled": True}]
+        
+        response = self.client.get('/flags?environment=production&enabled=true')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[0]['name'], "test")
+        self.assertEqual(mock_storage_instance.get_all.call_args[0], ('production', True))
+        mock_storage_instance.find_all.assert_not_called()
+
+    def test_get_flags_paginated(self):
+        """Verify GET /flags?limit= returns a cursor that resumes after the last name."""
+        mock_storage_instance.get_all.return_value = [
+            {"_id": "1", "name": "a"}, {"_id": "2", "name": "b"}, {"_id": "3", "name": "c"}
+        ]
+        
+        first = self.client.get('/flags?limit=2&fields=name,enabled&prefix=a')
+        cursor = first.headers['X-Next-Cursor']
+        self.client.get(f'/flags?limit=2&cursor={cursor}')
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([flag['name'] for flag in first.json], ["a", "b"])
+        first_kwargs = mock_storage_instance.get_all.call_args_list[0][1]
+        self.assertEqual(first_kwargs['prefix'], "a")
+        self.assertEqual(first_kwargs['fields'], ["name", "enabled"])
+        self.assertEqual(mock_storage_instance.get_all.call_args[1]['after'], "b")
+
+    def test_get_flags_streamed(self):
+        """Verify GET /flags?stream=true encodes the cursor incrementally as a JSON array."""
+        mock_storage_instance.iter_all.return_value = iter(
+            [{"_id": str(i), "name": f"f{i}", "enabled": False} for i in range(250)]
+        )
+        
+        response = self.client.get('/flags?stream=true&prefix=f')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json), 250)
+        self.assertEqual(response.json[249]['name'], "f249")
+        kwargs = mock_storage_instance.iter_all.call_args[1]
+        self.assertEqual(kwargs['prefix'], "f")
+        self.assertIsNotNone(kwargs['batch_size'])
+
+    def test_get_flags_streamed_empty(self):
+        """Verify an empty streamed listing is still a valid JSON array."""
+        mock_storage_instance.iter_all.return_value = iter([])
+        
+        response = self.client.get('/flags?stream=true')
+        
+        self.assertEqual(response.json, [])
+
+    def test_healthz_does_not_touch_storage(self):
+        """Verify GET /healthz answers without reading storage."""
+        response = self.client.get('/healthz')
+
+        self.assertEqual(response.status_code, 200)
+        mock_storage_instance.find_all.assert_not_called()
+
+    def test_ready_loads_snapshot(self):
+        """Verify GET /ready loads the flag snapshot and reports 503 while storage is unreachable."""
+        mock_storage_instance.find_all.return_value = []
+        self.assertEqual(self.client.get('/ready').json, {"status": "ready"})
+
+        service.cache.invalidate()
+        mock_storage_instance.get_version.side_effect = ConnectionError("connection refused")
+        try:
+            response = self.client.get('/ready')
+        finally:
+            mock_storage_instance.get_version.side_effect = None
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json['status'], "unavailable")
+
+    def test_tenant_header_selects_tenant_store(self):
+        """Verify X-Tenant requests are served from that tenant's store and partition."""
+        tenant_storage = mock_storage_instance.for_tenant.return_value
+        tenant_storage.find_all.return_value = [{"_id": "9", "name": "acme-flag", "environments": {}}]
+        tenant_storage.get_version.return_value = 0
+
+        with patch.object(tenants, 'provisioned', frozenset({'acme'})):
+            response = self.client.get('/flags', headers={"X-Tenant": "acme"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json[0]['name'], "acme-flag")
+        self.assertIn('X-Tenant', response.headers['Vary'])
+        mock_storage_instance.for_tenant.assert_called_with('acme')
+        mock_storage_instance.find_all.assert_not_called()
+
+    def test_invalid_tenant(self):
+        """Verify malformed tenant names are rejected."""
+        response = self.client.get('/flags', headers={"X-Tenant": "../acme"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_tenant(self):
+        """Verify requests for tenants that were not provisioned get 404 without opening any storage."""
+        for tenant in ('t0', 't1'):
+            response = self.client.get('/flags', headers={"X-Tenant": tenant})
+            
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json, {"error": "Unknown tenant"})
+        mock_storage_instance.for_tenant.assert_not_called()
+        self.assertNotIn('t0', tenants._services)
+
+    def test_tenant_rate_limit(self):
+        """Verify a tenant over its request rate gets 429 while other tenants are unaffected."""
+        mock_storage_instance.find_all.return_value = []
+        tenants.rate_limit, tenants.rate_burst = 0.01, 1
+        try:
+            with patch.object(tenants, 'provisioned', frozenset({'noisy'})):
+                self.assertEqual(self.client.get('/flags', headers={"X-Tenant": "noisy"}).status_code, 200)
+                response = self.client.get('/flags', headers={"X-Tenant": "noisy"})
+                other = self.client.get('/flags')
+        finally:
+            tenants.rate_limit = 0
+            tenants._buckets.clear()
+
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        self.assertEqual(other.status_code, 200)
+
+    def test_seed_command(self):
+        """Verify `flask seed` prepares storage and inserts the demo flags."""
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "dark-mode"}]
+
+        result = app.test_cli_runner().invoke(args=['seed'])
+
+        self.assertEqual(result.exit_code, 0)
+        mock_storage_instance.warm_up.assert_called_once()
+        mock_storage_instance.seed.assert_called_once()
+        self.assertIn("1 flags", result.output)
+
+    def test_get_flags_as_of_version(self):
+        """Verify GET /flags?as_of=<version> rebuilds the flags from a checkpoint and later events."""
+        mock_storage_instance.get_version.return_value = 9
+        mock_storage_instance.find_checkpoint.return_value = {
+            "version": 5, "at": 0.0,
+            "flags": [{"_id": "1", "name": "f1", "environments": {"production": False}}]
+        }
+        mock_storage_instance.history_events.return_value = [
+            {"version": 6, "flag_id": "1", "op": "toggle", "at": 0.0,
+             "flag": {"_id": "1", "name": "f1", "environments": {"production": True}, "version": 1}}
+        ]
+
+        response = self.client.get('/flags?environment=production&as_of=7')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Flags-Version'], '7')
+        self.assertTrue(response.json[0]['enabled'])
+        mock_storage_instance.find_checkpoint.assert_called_with(7)
+        mock_storage_instance.history_events.assert_called_with(5, 7)
+
+    def test_get_flags_as_of_time(self):
+        """Verify as_of accepts an ISO 8601 time and 404s when history does not reach it."""
+        mock_storage_instance.history_version_at.return_value = None
+
+        response = self.client.get('/flags?as_of=2024-03-01T14:02:00Z')
+
+        self.assertEqual(response.status_code, 404)
+        mock_storage_instance.history_version_at.assert_called_with(1709301720.0)
+
+    def test_get_flags_as_of_invalid(self):
+        """Verify as_of rejects values that are neither versions nor times, and listing parameters."""
+        self.assertEqual(self.client.get('/flags?as_of=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/flags?as_of=3&limit=10').status_code, 400)
+
+    def test_get_flags_stream_rejects_pagination(self):
+        """Verify stream=true cannot be combined with limit."""
+        response = self.client.get('/flags?stream=true&limit=10')
+        
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_flags_invalid_listing_params(self):
+        """Verify GET /flags rejects bad limits, cursors and fields."""
+        for query in ('limit=0', 'limit=abc', 'cursor=%%%', 'fields=$where'):
+            response = self.client.get(f'/flags?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_get_flags_invalid_enabled_filter(self):
+        """Verify GET /flags returns 400 for an enabled filter that is not a boolean."""
+        response = self.client.get('/flags?enabled=yes')
+        
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_flags_etag_not_modified(self):
+        """Verify GET /flags answers a matching If-None-Match with an empty 304."""
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "test", "environments": {}}]
+        
+        first = self.client.get('/flags')
+        etag = first.headers['ETag']
+        second = self.client.get('/flags', headers={'If-None-Match': etag})
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+
+    def test_get_snapshot_file(self):
+        """Verify GET /flags/snapshot returns a readable binary snapshot with an ETag."""
+        mock_storage_instance.get_version.return_value = 7
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "test", "environments": {}}]
+        
+        response = self.client.get('/flags/snapshot')
+        again = self.client.get('/flags/snapshot', headers={'If-None-Match': response.headers['ETag']})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/octet-stream')
+        self.assertTrue(response.data.startswith(b'FFSNAP01'))
+        self.assertEqual(again.status_code, 304)
+
+    def test_get_flags_etag_per_environment(self):
+        """Verify environments with different flag states get different ETags."""
+        mock_storage_instance.find_all.return_value = [
+            {"_id": "1", "name": "test", "environments": {"staging": True}}
+        ]
+        
+        staging = self.client.get('/flags?environment=staging')
+        production = self.client.get('/flags?environment=production',
+                                     headers={'If-None-Match': staging.headers['ETag']})
+        
+        self.assertEqual(production.status_code, 200)
+        self.assertNotEqual(staging.headers['ETag'], production.headers['ETag'])
+
+    def test_write_invalidates_cache(self):
+        """Verify a successful write forces the next GET /flags to reload."""
+        mock_storage_instance.find_all.return_value = []
+        mock_storage_instance.delete_flag.return_value = {"_id": "123"}
+        
+        self.client.get('/flags')
+        self.client.delete('/flags/123')
+        self.client.get('/flags')
+        
+        self.assertEqual(mock_storage_instance.find_all.call_count, 2)
+        mock_storage_instance.bump_version.assert_called_once()
+
+    def test_stream_flags_starts_with_snapshot(self):
+        """Verify GET /flags/stream opens an event stream with a snapshot event."""
+        mock_storage_instance.find_all.return_value = [{"_id": "1", "name": "test", "environments": {}}]
+        
+        response = self.client.get('/flags/stream?environment=production', buffered=False)
+        first_event = next(response.response)
+        response.close()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertIn(b'event: snapshot', first_event)
+        self.assertIn(b'"name": "test"', first_event)
+
+    def test_stream_flags_subscriber_limit(self):
+        """Verify GET /flags/stream answers 503 once the worker's stream slots are taken, until one closes."""
+        import routes as flat_routes
+        mock_storage_instance.find_all.return_value = []
+        
+        with patch.object(flat_routes, 'stream_slots', threading.BoundedSemaphore(1)):
+            first = self.client.get('/flags/stream', buffered=False)
+            rejected = self.client.get('/flags/stream', buffered=False)
+            first.close()
+            reopened = self.client.get('/flags/stream', buffered=False)
+            reopened.close()
+        
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(rejected.status_code, 503)
+        self.assertEqual(rejected.headers['Retry-After'], '5')
+        self.assertEqual(reopened.status_code, 200)
+
+    def test_evaluate_flags_success(self):
+        """Verify POST /flags/evaluate resolves ids and names across environments in one read."""
+        mock_storage_instance.find_all.return_value = [
+            {"_id": "1", "name": "dark-mode", "environments": {"staging": True, "production": False}},
+            {"_id": "2", "name": "beta", "environments": {"production": True}}
+        ]
+        
+        response = self.client.post('/flags/evaluate', json={
+            "flags": ["dark-mode", "2", "unknown"],
+            "environments": ["staging", "production"]
+        })
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['results'], {
+            "staging": {"dark-mode": True, "2": False},
+            "production": {"dark-mode": False, "2": True}
+        })
+        self.assertEqual(response.json['missing'], ["unknown"])
+        mock_storage_instance.find_all.assert_called_once()
+        mock_storage_instance.find_flag.assert_not_called()
+
+    def test_evaluate_flags_with_contexts(self):
+        """Verify POST /flags/evaluate applies targeting rules per context."""
+        mock_storage_instance.find_all.return_value = [{
+            "_id": "1", "name": "pro-feature", "environments": {"production": True},
+            "targeting": {"production": {"rules": [{"attribute": "plan", "operator": "equals", "values": ["pro"]}]}}
+        }]
+        
+        many = self.client.post('/flags/evaluate', json={
+            "environments": ["production"],
+            "contexts": [{"plan": "pro"}, {"plan": "free"}]
+        })
+        single = self.client.post('/flags/evaluate', json={
+            "environment": "production", "context": {"plan": "pro"}
+        })
+        
+        self.assertEqual(many.json['results'], {"production": [{"pro-feature": True}, {"pro-feature": False}]})
+        self.assertEqual(single.json['results'], {"production": {"pro-feature": True}})
+
+    def test_create_flag_invalid_targeting(self):
+        """Verify POST /flags returns 400 for malformed targeting rules."""
+        response = self.client.post('/flags', json={
+            "name": "f", "targeting": {"production": {"rollout": {"percentage": 150}}}
+        })
+        
+        self.assertEqual(response.status_code, 400)
+        mock_storage_instance.insert_flag.assert_not_called()
+
+    def test_evaluate_flags_invalid_body(self):
+        """Verify POST /flags/evaluate returns 400 for malformed flag lists."""
+        response = self.client.post('/flags/evaluate', json={"flags": "dark-mode"})
+        
+        self.assertEqual(response.status_code, 400)
+
+    def test_write_routes_reject_non_object_bodies(self):
+        """Verify JSON bodies that are not objects get a 400 with an error message instead of a 500."""
+        requests = [
+            ('post', '/flags/evaluate'), ('post', '/flags/bulk'), ('post', '/flags'),
+            ('put', '/flags/123'), ('post', '/flags/123/toggle')
+        ]
+        for method, path in requests:
+            for body in (["dark-mode"], "dark-mode", None):
+                response = getattr(self.client, method)(path, data=json.dumps(body), content_type='application/json')
+                
+                self.assertEqual(response.status_code, 400, (method, path, body))
+                self.assertEqual(response.json, {"error": "Request body must be a JSON object"})
+
+    def test_bulk_flags_success(self):
+        """Verify POST /flags/bulk returns one result per operation."""
+        mock_storage_instance.supports_transactions = False
+        mock_storage_instance.find_flags.return_value = {"dark-mode": {"_id": "1", "name": "dark-mode"}}
+        mock_storage_instance.bulk_write.return_value = [('ok', {"_id": "1", "name": "dark-mode"})]
+        
+        response = self.client.post('/flags/bulk', json={"operations": [
+            {"op": "toggle", "id": "dark-mode", "environment": "production"},
+            {"op": "toggle", "id": "unknown", "environment": "production"}
+        ]})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.json['results']], ["toggled", "not_found"])
+        mock_storage_instance.bulk_write.assert_called_once()
+
+    def test_bulk_flags_invalid_body(self):
+        """Verify POST /flags/bulk validates the operations list."""
+        self.assertEqual(self.client.post('/flags/bulk', json={"operations": []}).status_code, 400)
+        self.assertEqual(self.client.post('/flags/bulk', json={"operations": [{}] * 1001}).status_code, 400)
+        mock_storage_instance.bulk_write.assert_not_called()
 
     def test_create_flag_success(self):
         """Verify POST /flags creates a flag and returns 201."""
         flag_data = {"name": "new-flag", "description": "Test flag"}
+        mock_storage_instance.find_by_name.return_value = None
         
         response = self.client.post('/flags', json=flag_data)
         
         self.assertEqual(response.status_code, 201)
-        mock_storage_instance.insert_one.assert_called_once()
+        mock_storage_instance.insert_flag.assert_called_once()
+
+    def test_create_flag_duplicate_name(self):
+        """Verify POST /flags returns 409 if a flag with the same name exists."""
+        mock_storage_instance.find_by_name.return_value = {"_id": "1", "name": "new-flag"}
+        
+        response = self.client.post('/flags', json={"name": "new-flag"})
+        
+        self.assertEqual(response.status_code, 409)
+        mock_storage_instance.insert_flag.assert_not_called()
 
     def test_create_flag_missing_name(self):
         """Verify POST /flags returns 400 if name is missing."""
@@ -67,7 +464,7 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_get_single_flag_success(self):
         """Verify GET /flags/<id> returns flag data."""
-        mock_storage_instance.find_one.return_value = {"_id": "123", "name": "test-flag"}
+        mock_storage_instance.find_flag.return_value = {"_id": "123", "name": "test-flag"}
         
         response = self.client.get('/flags/123')
         
@@ -76,7 +473,7 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_get_single_flag_not_found(self):
         """Verify GET /flags/<id> returns 404 for non-existent flags."""
-        mock_storage_instance.find_one.return_value = None
+        mock_storage_instance.find_flag.return_value = None
         
         response = self.client.get('/flags/nonexistent')
         
@@ -84,8 +481,7 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_update_flag_success(self):
         """Verify PUT /flags/<id> updates and returns the flag."""
-        mock_storage_instance.update_one.return_value = MagicMock(matched_count=1)
-        mock_storage_instance.find_one.return_value = {"_id": "123", "name": "updated"}
+        mock_storage_instance.update_flag.return_value = {"_id": "123", "name": "updated"}
         
         response = self.client.put('/flags/123', json={"name": "updated"})
         
@@ -100,15 +496,30 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_update_flag_not_found(self):
         """Verify PUT /flags/<id> returns 404 for non-existent flags."""
-        mock_storage_instance.update_one.return_value = MagicMock(matched_count=0)
+        mock_storage_instance.update_flag.return_value = None
         
         response = self.client.put('/flags/nonexistent', json={"name": "test"})
         
         self.assertEqual(response.status_code, 404)
 
+    def test_update_flag_version_conflict(self):
+        """Verify PUT /flags/<id> returns 409 when the expected version is stale."""
+        mock_storage_instance.update_flag.return_value = None
+        mock_storage_instance.find_flag.return_value = {"_id": "123", "version": 3}
+        
+        response = self.client.put('/flags/123', json={"name": "test", "version": 2})
+        
+        self.assertEqual(response.status_code, 409)
+
+    def test_update_flag_invalid_version(self):
+        """Verify PUT /flags/<id> returns 400 for a non-integer version."""
+        response = self.client.put('/flags/123', json={"name": "test", "version": "2"})
+        
+        self.assertEqual(response.status_code, 400)
+
     def test_delete_flag_success(self):
         """Verify DELETE /flags/<id> returns 204 on success."""
-        mock_storage_instance.delete_one.return_value = MagicMock(deleted_count=1)
+        mock_storage_instance.delete_flag.return_value = {"_id": "123", "name": "dark-mode"}
         
         response = self.client.delete('/flags/123')
         
@@ -116,7 +527,7 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_delete_flag_not_found(self):
         """Verify DELETE /flags/<id> returns 404 for non-existent IDs."""
-        mock_storage_instance.delete_one.return_value = MagicMock(deleted_count=0)
+        mock_storage_instance.delete_flag.return_value = None
         
         response = self.client.delete('/flags/nonexistent-id')
         
@@ -124,24 +535,49 @@ class TestFeatureFlagsAPI(unittest.TestCase):
 
     def test_toggle_flag_success(self):
         """Verify POST /flags/<id>/toggle toggles the flag."""
-        mock_storage_instance.find_one.side_effect = [
-            {"_id": "123", "environments": {"production": False}},  # Initial state
-            {"_id": "123", "environments": {"production": True}}     # After toggle
-        ]
-        mock_storage_instance.update_one.return_value = MagicMock(modified_count=1)
+        mock_storage_instance.toggle_flag.return_value = {"_id": "123", "environments": {"production": True}}
         
         response = self.client.post('/flags/123/toggle', json={"environment": "production"})
         
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['enabled'])
 
     def test_toggle_flag_not_found(self):
         """Verify POST /flags/<id>/toggle returns 404 for non-existent flags."""
-        mock_storage_instance.find_one.return_value = None
+        mock_storage_instance.toggle_flag.return_value = None
         
         response = self.client.post('/flags/nonexistent/toggle', json={"environment": "staging"})
         
         self.assertEqual(response.status_code, 404)
 
+    def test_toggle_flag_invalid_environment(self):
+        """Verify POST /flags/<id>/toggle rejects environment names that are not plain field names."""
+        response = self.client.post('/flags/123/toggle', json={"environment": "$where"})
+        
+        self.assertEqual(response.status_code, 400)
+        mock_storage_instance.toggle_flag.assert_not_called()
+
+    def test_toggle_flag_invalid_version(self):
+        """Verify POST /flags/<id>/toggle returns 400 for a non-integer version."""
+        response = self.client.post('/flags/123/toggle', json={"environment": "staging", "version": "abc"})
+        
+        self.assertEqual(response.status_code, 400)
+        mock_storage_instance.toggle_flag.assert_not_called()
+
+    def test_unknown_route_returns_404(self):
+        """Verify HTTP errors raised by Flask keep their status instead of becoming 500s."""
+        self.assertEqual(self.client.get('/no-such-route').status_code, 404)
+        self.assertEqual(self.client.patch('/flags').status_code, 405)
+
+    def test_unhandled_exception_returns_500(self):
+        """Verify unexpected errors are logged and answered with a JSON 500."""
+        mock_storage_instance.find_flag.side_effect = RuntimeError("boom")
+
+        response = self.client.get('/flags/123')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json['error'], "Internal Server Error")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
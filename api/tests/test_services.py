@@ -1,67 +1,466 @@
+import time
+import threading
 import unittest
-from unittest.mock import patch, MagicMock
-from api.feature_flag_service import FeatureFlagService
+from unittest.mock import MagicMock, patch
+from api.feature_flag_service import FeatureFlagService, MAX_NAME_LENGTH, NAME_ERROR
+from storage_backend import DuplicateNameError
 
 class TestFeatureFlagService(unittest.TestCase):
-    @patch('api.feature_flag_service.FeatureFlagStorage')
-    def setUp(self, MockStorage):
-        self.mock_storage_instance = MockStorage.return_value
-        self.service = FeatureFlagService()
-        # Ensure the service uses the mock instance
-        self.service.storage = self.mock_storage_instance
+    def setUp(self):
+        self.mock_storage_instance = MagicMock(history_retention=30 * 86400)
+        # A fresh checkpoint, so writes only record their history events
+        self.mock_storage_instance.find_checkpoint.return_value = {'version': 0, 'flags': [], 'at': time.time()}
+        self.service = FeatureFlagService(self.mock_storage_instance)
+
+    def test_warm_up_connects_and_loads_snapshot(self):
+        self.mock_storage_instance.find_all.return_value = []
+        self.service.warm_up()
+        self.mock_storage_instance.warm_up.assert_called_once()
+        self.mock_storage_instance.find_all.assert_called_once()
 
     def test_get_all_flags(self):
+        self.mock_storage_instance.find_all.return_value = [{'name': 'flag1', 'environments': {'staging': True}}]
+        result = self.service.get_all_flags('staging')
+        self.assertEqual(result, [{'name': 'flag1', 'environments': {'staging': True}, 'enabled': True}])
+        self.mock_storage_instance.find_all.assert_called_once()
+
+    def test_get_all_flags_cache_disabled(self):
+        self.service.cache.enabled = False
         self.mock_storage_instance.get_all.return_value = [{'name': 'flag1'}]
         result = self.service.get_all_flags('staging')
         self.assertEqual(result, [{'name': 'flag1'}])
         self.mock_storage_instance.get_all.assert_called_with('staging')
 
+    def test_stream_changes_snapshot_then_delta(self):
+        self.mock_storage_instance.find_all.return_value = [{'_id': '1', 'environments': {'staging': False}}]
+        stream = self.service.stream_changes('staging')
+
+        event_id, event_type, data = next(stream)
+        self.assertEqual(event_type, 'snapshot')
+        self.assertFalse(data[0]['enabled'])
+
+        self.mock_storage_instance.find_all.return_value = [{'_id': '1', 'environments': {'staging': True}}]
+        self.service.cache.invalidate()
+        next_id, event_type, data = next(stream)
+        self.assertEqual(event_type, 'update')
+        self.assertTrue(data['enabled'])
+        self.assertNotEqual(next_id, event_id)
+
+    def test_stream_changes_resumes_from_last_event_id(self):
+        self.mock_storage_instance.find_all.return_value = [{'_id': '1', 'environments': {}}]
+        self.service.cache.snapshot()
+        self.service.events.publish('delete', {'_id': '2'})
+
+        stream = self.service.stream_changes('staging', self.service.events.format_id(0))
+        _, event_type, data = next(stream)
+        self.assertEqual(event_type, 'delete')
+        self.assertEqual(data, {'_id': '2'})
+
+    def test_evaluate_flags_all_by_default(self):
+        self.mock_storage_instance.find_all.return_value = [
+            {'_id': '1', 'name': 'f1', 'environments': {'staging': True}},
+            {'_id': '2', 'name': 'f2', 'environments': {}}
+        ]
+        results, missing = self.service.evaluate_flags(None, ['staging'])
+        self.assertEqual(results, {'staging': {'f1': True, 'f2': False}})
+        self.assertEqual(missing, [])
+
     def test_create_flag(self):
         data = {'name': 'new_flag'}
-        self.mock_storage_instance.insert_one.return_value = 'some_result'
-        result = self.service.create_flag(data)
+        self.mock_storage_instance.find_by_name.return_value = None
+        self.mock_storage_instance.insert_flag.side_effect = lambda doc: doc.update(_id='1') or doc
+        result, error = self.service.create_flag(data)
+        self.assertIsNone(error)
         self.assertEqual(result, data)
-        self.mock_storage_instance.insert_one.assert_called_with(data)
+        self.mock_storage_instance.insert_flag.assert_called_with(data)
+        self.mock_storage_instance.bump_version.assert_called_once()
+
+    def test_create_flag_duplicate_name(self):
+        self.mock_storage_instance.find_by_name.return_value = {'_id': '1', 'name': 'new_flag'}
+        result, error = self.service.create_flag({'name': 'new_flag'})
+        self.assertIsNone(result)
+        self.assertEqual(error, "Feature flag name already exists")
+        self.mock_storage_instance.insert_flag.assert_not_called()
+
+    def test_create_flag_duplicate_key_race(self):
+        self.mock_storage_instance.find_by_name.return_value = None
+        self.mock_storage_instance.insert_flag.side_effect = DuplicateNameError('dup')
+        result, error = self.service.create_flag({'name': 'new_flag'})
+        self.assertEqual(error, "Feature flag name already exists")
+        self.mock_storage_instance.bump_version.assert_not_called()
+
+    def test_list_flags_filtered_uses_storage_query(self):
+        self.mock_storage_instance.get_all.return_value = [{'name': 'f1', 'enabled': True}]
+        flags, next_after = self.service.list_flags('production', enabled=True)
+        self.assertEqual(flags, [{'name': 'f1', 'enabled': True}])
+        self.assertIsNone(next_after)
+        self.mock_storage_instance.get_all.assert_called_with(
+            'production', True, prefix=None, after=None, limit=None, fields=None
+        )
+        self.mock_storage_instance.find_all.assert_not_called()
+
+    def test_list_flags_pagination(self):
+        self.mock_storage_instance.get_all.return_value = [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}]
+        flags, next_after = self.service.list_flags('staging', limit=2, fields=['enabled'])
+        self.assertEqual(flags, [{'name': 'a'}, {'name': 'b'}])
+        self.assertEqual(next_after, 'b')
+        kwargs = self.mock_storage_instance.get_all.call_args[1]
+        self.assertEqual(kwargs['limit'], 3)
+        self.assertEqual(kwargs['fields'], ['enabled', 'name'])
 
     def test_get_flag_found(self):
-        self.mock_storage_instance.find_one.return_value = {'_id': '123', 'name': 'flag1'}
+        self.mock_storage_instance.find_flag.return_value = {'_id': '123', 'name': 'flag1'}
         result = self.service.get_flag('123')
         self.assertEqual(result['name'], 'flag1')
         self.assertEqual(result['_id'], '123')
 
     def test_get_flag_not_found(self):
-        self.mock_storage_instance.find_one.return_value = None
+        self.mock_storage_instance.find_flag.return_value = None
         result = self.service.get_flag('unknown')
         self.assertIsNone(result)
 
     def test_update_flag_success(self):
-        self.mock_storage_instance.update_one.return_value = MagicMock(matched_count=1)
-        self.mock_storage_instance.find_one.return_value = {'_id': '123', 'name': 'updated'}
+        self.mock_storage_instance.update_flag.return_value = {'_id': '123', 'name': 'updated', 'version': 2}
         
         flag, error = self.service.update_flag('123', {'name': 'updated'})
         self.assertIsNone(error)
         self.assertEqual(flag['name'], 'updated')
+        self.mock_storage_instance.update_flag.assert_called_with('123', {'name': 'updated'}, None)
+        self.mock_storage_instance.find_flag.assert_not_called()
+        self.mock_storage_instance.bump_version.assert_called_once()
+
+    def test_update_flag_version_conflict(self):
+        self.mock_storage_instance.update_flag.return_value = None
+        self.mock_storage_instance.find_flag.return_value = {'_id': '123', 'version': 5}
+
+        flag, error = self.service.update_flag('123', {'name': 'updated'}, expected_version=4)
+        self.assertIsNone(flag)
+        self.assertEqual(error, "Version conflict")
+        self.mock_storage_instance.update_flag.assert_called_with('123', {'name': 'updated'}, 4)
+
+    def test_update_flag_duplicate_name(self):
+        self.mock_storage_instance.update_flag.side_effect = DuplicateNameError('dup')
+
+        flag, error = self.service.update_flag('123', {'name': 'taken'})
+        self.assertEqual(error, "Feature flag name already exists")
+        self.mock_storage_instance.bump_version.assert_not_called()
+
+    def test_update_flag_not_found(self):
+        self.mock_storage_instance.update_flag.return_value = None
+
+        flag, error = self.service.update_flag('123', {'name': 'updated'})
+        self.assertEqual(error, "Feature flag not found")
+        self.mock_storage_instance.find_flag.assert_not_called()
 
     def test_update_flag_no_fields(self):
         flag, error = self.service.update_flag('123', {})
         self.assertEqual(error, "No fields to update")
 
     def test_delete_flag(self):
-        self.mock_storage_instance.delete_one.return_value = MagicMock(deleted_count=1)
+        self.mock_storage_instance.delete_flag.return_value = {'_id': '123'}
         success = self.service.delete_flag('123')
         self.assertTrue(success)
+        self.mock_storage_instance.bump_version.assert_called_once()
 
     def test_toggle_flag(self):
-        # Setup initial state: enabled=False
-        self.mock_storage_instance.find_one.side_effect = [
-            {'_id': '123', 'environments': {'staging': False}}, # First find (check existence)
-            {'_id': '123', 'enabled': True, 'environments': {'staging': True}} # Second find (return updated)
-        ]
-        self.mock_storage_instance.update_one.return_value = MagicMock(modified_count=1)
+        self.mock_storage_instance.toggle_flag.return_value = {
+            '_id': '123', 'environments': {'staging': True}, 'version': 1
+        }
 
-        result = self.service.toggle_flag('123', 'staging')
+        result, error = self.service.toggle_flag('123', 'staging')
+        self.assertIsNone(error)
         self.assertTrue(result['enabled'])
-        
-        # Verify update was called with negation of current status
-        args = self.mock_storage_instance.update_one.call_args
-        self.assertEqual(args[0][1]['$set']['environments.staging'], True)
+
+        # Single atomic storage write, no read first
+        self.mock_storage_instance.toggle_flag.assert_called_once_with('123', 'staging', None)
+        self.mock_storage_instance.find_flag.assert_not_called()
+
+    def test_toggle_flag_not_found(self):
+        self.mock_storage_instance.toggle_flag.return_value = None
+
+        result, error = self.service.toggle_flag('123', 'staging')
+        self.assertIsNone(result)
+        self.assertEqual(error, "Feature flag not found")
+
+    def test_bulk_write_single_round_trip(self):
+        self.mock_storage_instance.supports_transactions = False
+        self.mock_storage_instance.new_id.return_value = 'new-id'
+        self.mock_storage_instance.find_flags.return_value = {
+            'dark-mode': {'_id': 'id-1', 'name': 'dark-mode', 'version': 2},
+            'id-1': {'_id': 'id-1', 'name': 'dark-mode', 'version': 2},
+            'legacy': {'_id': 'legacy', 'name': 'beta'}
+        }
+        self.mock_storage_instance.bulk_write.side_effect = lambda writes, transaction: [('ok', None)] * len(writes)
+
+        results, error = self.service.bulk_write([
+            {'op': 'create', 'flag': {'name': 'new-flag'}},
+            {'op': 'toggle', 'id': 'dark-mode', 'environment': 'production'},
+            {'op': 'update', 'id': 'id-1', 'fields': {'description': 'x'}, 'version': 2},
+            {'op': 'delete', 'id': 'legacy'},
+            {'op': 'delete', 'id': 'missing'},
+            {'op': 'rename', 'id': 'beta'}
+        ])
+
+        self.assertIsNone(error)
+        self.assertEqual([r['status'] for r in results],
+                         ['created', 'toggled', 'updated', 'deleted', 'not_found', 'invalid'])
+        self.assertEqual(results[0]['_id'], 'new-id')
+        self.mock_storage_instance.find_flags.assert_called_once()
+        writes = self.mock_storage_instance.bulk_write.call_args[0][0]
+        self.assertEqual(writes[1:], [
+            ('toggle', 'id-1', None, 'production'),
+            ('update', 'id-1', 2, {'description': 'x'}),
+            ('delete', 'legacy', None)
+        ])
+        self.assertEqual(writes[0][0], 'create')
+        self.mock_storage_instance.bump_version.assert_called_once()
+
+    def test_bulk_write_reports_write_errors(self):
+        self.mock_storage_instance.supports_transactions = False
+        self.mock_storage_instance.bulk_write.return_value = [('ok', None), ('conflict', 'duplicate key')]
+
+        results, _ = self.service.bulk_write([
+            {'op': 'create', 'flag': {'name': 'a'}},
+            {'op': 'create', 'flag': {'name': 'b'}}
+        ])
+
+        self.assertEqual(results[0]['status'], 'created')
+        self.assertEqual(results[1]['status'], 'conflict')
+        self.mock_storage_instance.find_flags.assert_not_called()
+
+    def test_bulk_write_transaction_requires_replica_set(self):
+        self.mock_storage_instance.supports_transactions = False
+        results, error = self.service.bulk_write([{'op': 'delete', 'id': 'x'}], transaction=True)
+        self.assertIsNone(results)
+        self.assertEqual(error, "Transactions require a replica set")
+
+    def test_bulk_write_aborted_transaction(self):
+        self.mock_storage_instance.supports_transactions = True
+        self.mock_storage_instance.bulk_write.return_value = [('error', 'bad'), ('aborted', "Transaction aborted")]
+
+        results, _ = self.service.bulk_write([
+            {'op': 'create', 'flag': {'name': 'a'}},
+            {'op': 'create', 'flag': {'name': 'b'}}
+        ], transaction=True)
+
+        self.assertEqual([r['status'] for r in results], ['error', 'aborted'])
+        self.mock_storage_instance.bump_version.assert_not_called()
+
+    def test_bulk_write_results_come_from_storage(self):
+        from memory_storage import MemoryStorage
+        storage = MemoryStorage(seed=False)
+        service = FeatureFlagService(storage)
+        service.create_flag({'name': 'f1', 'environments': {}})
+        service.create_flag({'name': 'f2', 'environments': {}})
+        find_flags = storage.find_flags
+
+        def concurrent_writes(keys):
+            # Another writer changes f1 and deletes f2 after the lookup
+            found = find_flags(keys)
+            storage.update_flag('f1', {'description': 'theirs'})
+            storage.delete_flag('f2')
+            return found
+
+        with patch.object(storage, 'find_flags', side_effect=concurrent_writes):
+            results, _ = service.bulk_write([
+                {'op': 'update', 'id': 'f1', 'fields': {'description': 'mine'}, 'version': 0},
+                {'op': 'toggle', 'id': 'f2', 'environment': 'staging'}
+            ])
+
+        self.assertEqual([(r['status'], r['error']) for r in results],
+                         [('conflict', "Version conflict"), ('not_found', "Feature flag not found")])
+        self.assertEqual(storage.find_flag('f1')['description'], 'theirs')
+        self.assertEqual(storage.get_version(), 2)
+        self.assertEqual(storage.history_events(2, 3), [])
+
+class TestFeatureFlagServiceWithMemoryStorage(unittest.TestCase):
+    def test_writes_are_visible_to_cached_reads(self):
+        from memory_storage import MemoryStorage
+        service = FeatureFlagService(MemoryStorage(seed=False))
+        service.cache.use_change_stream = False
+
+        flag, _ = service.create_flag({'name': 'f1', 'environments': {}})
+        self.assertFalse(service.get_all_flags('staging')[0]['enabled'])
+        service.toggle_flag('f1', 'staging')
+        self.assertTrue(service.get_all_flags('staging')[0]['enabled'])
+        self.assertEqual(service.get_flag(flag['_id'])['version'], 1)
+
+    def test_flag_quota(self):
+        from memory_storage import MemoryStorage
+        service = FeatureFlagService(MemoryStorage(seed=False))
+        service.max_flags = 2
+        service.create_flag({'name': 'f1', 'environments': {}})
+
+        results, error = service.bulk_write([
+            {'op': 'create', 'flag': {'name': 'f2'}},
+            {'op': 'create', 'flag': {'name': 'f3'}}
+        ])
+        self.assertEqual(error, "Tenant flag quota exceeded")
+        self.assertEqual(service.create_flag({'name': 'f2', 'environments': {}})[1], None)
+        self.assertEqual(service.create_flag({'name': 'f3', 'environments': {}}), (None, "Tenant flag quota exceeded"))
+
+    def test_client_version_is_ignored_on_create(self):
+        from memory_storage import MemoryStorage
+        service = FeatureFlagService(MemoryStorage(seed=False))
+        flag, _ = service.create_flag({'name': 'v', 'version': 'abc', 'environments': {}})
+        self.assertEqual(flag['version'], 0)
+        service.bulk_write([{'op': 'create', 'flag': {'name': 'w', 'version': 7}}])
+        self.assertEqual(service.get_flag('w')['version'], 0)
+
+        # Later writes count up from the server-assigned version
+        self.assertEqual(service.toggle_flag('v', 'staging', 0)[0]['version'], 1)
+        self.assertEqual(service.update_flag('w', {'description': 'd'}, 0)[0]['version'], 1)
+
+    def test_flag_names_are_bounded(self):
+        from memory_storage import MemoryStorage
+        service = FeatureFlagService(MemoryStorage(seed=False))
+        long_name = 'x' * 70000
+
+        self.assertEqual(service.create_flag({'name': long_name, 'environments': {}})[1], NAME_ERROR)
+        flag, error = service.create_flag({'name': 'x' * MAX_NAME_LENGTH, 'environments': {}})
+        self.assertIsNone(error)
+        self.assertEqual(service.update_flag(flag['_id'], {'name': long_name}), (None, NAME_ERROR))
+        results, _ = service.bulk_write([
+            {'op': 'create', 'flag': {'name': long_name}},
+            {'op': 'update', 'id': flag['_id'], 'fields': {'name': long_name}}
+        ])
+        self.assertEqual([result['status'] for result in results], ['invalid', 'invalid'])
+        self.assertTrue(service.get_snapshot_file()[0])
+
+    def test_evaluate_reads_one_snapshot(self):
+        from memory_storage import MemoryStorage
+        service = FeatureFlagService(MemoryStorage(seed=False))
+        service.create_flag({'name': 'f1', 'environments': {'staging': True}})
+        service.create_flag({'name': 'f2', 'environments': {}})
+        index_of = service.cache._index_of
+
+        def delete_after_indexing(flags):
+            index = index_of(flags)
+            service.delete_flag('f1')
+            return index
+
+        with patch.object(service.cache, '_index_of', side_effect=delete_after_indexing):
+            results, missing = service.evaluate_flags(['f1', 'f2'])
+
+        self.assertEqual(results, {'staging': {'f1': True, 'f2': False}})
+        self.assertEqual(missing, [])
+
+class TestWriteCoalescing(unittest.TestCase):
+    def setUp(self):
+        from memory_storage import MemoryStorage
+        from write_coalescer import WriteCoalescer
+        self.storage = MemoryStorage(seed=False)
+        self.service = FeatureFlagService(self.storage)
+        self.service.cache.use_change_stream = False
+        self.service.coalescer = WriteCoalescer(0.2)
+        self.flag, _ = self.service.create_flag({'name': 'f1', 'environments': {}})
+
+    def burst(self, call, count):
+        results = [None] * count
+        def run(index):
+            results[index] = call()
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_toggle_burst_is_one_write(self):
+        version = self.storage.get_version()
+        results = self.burst(lambda: self.service.toggle_flag('f1', 'staging'), 3)
+
+        self.assertTrue(all(flag['enabled'] for flag, error in results))
+        self.assertEqual(self.service.get_flag('f1')['version'], 1)
+        self.assertEqual(self.storage.get_version(), version + 1)
+
+    def test_even_toggle_burst_writes_nothing(self):
+        version = self.storage.get_version()
+        results = self.burst(lambda: self.service.toggle_flag('f1', 'staging'), 4)
+
+        self.assertEqual([flag['enabled'] for flag, error in results], [False] * 4)
+        self.assertEqual(self.service.get_flag('f1').get('version', 0), 0)
+        self.assertEqual(self.storage.get_version(), version)
+
+    def test_update_burst_is_merged(self):
+        updates = iter([{'description': 'a'}, {'segments': {}}])
+        results = self.burst(lambda: self.service.update_flag('f1', next(updates)), 2)
+
+        flag = self.service.get_flag('f1')
+        self.assertEqual((flag['description'], flag['segments'], flag['version']), ('a', {}, 1))
+        self.assertEqual([error for _, error in results], [None, None])
+
+    def test_expected_version_is_not_coalesced(self):
+        self.service.coalescer = MagicMock()
+        flag, error = self.service.toggle_flag('f1', 'staging', expected_version=0)
+
+        self.assertTrue(flag['enabled'])
+        self.service.coalescer.submit.assert_not_called()
+
+class TestFlagHistory(unittest.TestCase):
+    def setUp(self):
+        from memory_storage import MemoryStorage
+        self.storage = MemoryStorage(seed=False)
+        self.service = FeatureFlagService(self.storage)
+        self.service.cache.use_change_stream = False
+        self.service.history.checkpoint_interval = 3
+
+    def test_as_of_rebuilds_past_versions(self):
+        flag, _ = self.service.create_flag({'name': 'f1', 'environments': {}})    # version 1
+        self.service.toggle_flag('f1', 'production')                               # 2
+        self.service.create_flag({'name': 'f2', 'environments': {}})               # 3, checkpoint
+        self.service.toggle_flag('f1', 'production')                               # 4
+        self.service.delete_flag('f2')                                             # 5
+
+        def state(version):
+            flags, resolved = self.service.get_flags_as_of('production', version=version)
+            self.assertEqual(resolved, min(version, 5))
+            return [(flag['name'], flag['enabled']) for flag in flags]
+
+        self.assertEqual(state(1), [('f1', False)])
+        self.assertEqual(state(2), [('f1', True)])
+        self.assertEqual(state(4), [('f1', False), ('f2', False)])
+        self.assertEqual(state(5), [('f1', False)])
+        self.assertEqual(state(99), [('f1', False)])
+        self.assertEqual(self.storage.find_checkpoint()['version'], 3)
+        self.assertEqual(self.service.get_flags_as_of('production', version=0), (None, None))
+
+    def test_as_of_survives_history_expiry(self):
+        self.storage.history_retention = 60
+        self.service.history.checkpoint_interval = 100
+        self.service.create_flag({'name': 'f1', 'environments': {}})           # 1, first checkpoint
+        self.service.toggle_flag('f1', 'production')                           # 2
+        later = time.time() + 3600
+        with patch('time.time', return_value=later):
+            # The only checkpoint is past retention, so this write saves a new one
+            self.service.toggle_flag('f1', 'production')                       # 3
+            self.service.toggle_flag('f1', 'production')                       # 4
+
+        flags, version = self.service.get_flags_as_of('production', version=4)
+        self.assertEqual((version, [(flag['name'], flag['enabled']) for flag in flags]), (4, [('f1', True)]))
+        self.assertEqual(self.storage.find_checkpoint()['version'], 3)
+        self.assertEqual(self.service.get_flags_as_of('production', version=2), (None, None))
+
+    def test_as_of_time(self):
+        self.service.create_flag({'name': 'f1', 'environments': {'staging': True}})
+        moment = time.time()
+        time.sleep(0.01)
+        self.service.toggle_flag('f1', 'staging')
+
+        flags, version = self.service.get_flags_as_of('staging', timestamp=moment)
+        self.assertEqual((version, flags[0]['enabled']), (1, True))
+        self.assertEqual(self.service.get_flags_as_of('staging', timestamp=moment - 60), (None, None))
+
+    def test_bulk_writes_are_recorded(self):
+        self.service.create_flag({'name': 'f1', 'environments': {}})
+        # History records the written documents without reading every flag
+        with patch.object(self.storage, 'find_all', wraps=self.storage.find_all) as find_all:
+            self.service.bulk_write([
+                {'op': 'toggle', 'id': 'f1', 'environment': 'staging'},
+                {'op': 'create', 'flag': {'name': 'f2'}}
+            ])
+        find_all.assert_not_called()
+
+        events = self.storage.history_events(1, 2)
+        self.assertEqual([(event['op'], event['flag']['name']) for event in events], [('toggle', 'f1'), ('create', 'f2')])
+        self.assertTrue(events[0]['flag']['environments']['staging'])
@@ -0,0 +1,77 @@
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(API_DIR)
+COMPOSE_FILES = ('docker-compose.yaml', 'docker-compose.local.yaml')
+
+# Cold start of one worker: importing the app and building it. Measured at
+# about 0.25s; the budget leaves room for slow CI runners.
+STARTUP_BUDGET_SECONDS = 2.0
+
+STARTUP_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+import routes
+service_at_import = routes.service
+app.create_app()
+built = time.perf_counter()
+print(json.dumps({
+    "import_s": imported - started,
+    "total_s": built - started,
+    "service_at_import": service_at_import is not None,
+    "pymongo": "pymongo" in sys.modules,
+}))
+"""
+
+class TestStartup(unittest.TestCase):
+    def run_startup(self, backend):
+        env = dict(os.environ, PYTHONPATH=API_DIR, FLAGS_STORAGE_BACKEND=backend)
+        env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            env=env, capture_output=True, text=True, timeout=60, check=True
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_startup_within_budget(self):
+        timings = self.run_startup('memory')
+        self.assertLess(timings['total_s'], STARTUP_BUDGET_SECONDS)
+
+    def test_import_has_no_side_effects(self):
+        timings = self.run_startup('memory')
+        self.assertFalse(timings['service_at_import'])
+        # The MongoDB driver is only loaded by the mongo backend
+        self.assertFalse(timings['pymongo'])
+
+class TestComposeEntrypoint(unittest.TestCase):
+    def test_seed_runs_with_multiprocess_metrics(self):
+        """The seed step of the compose entrypoint runs before Gunicorn has created PROMETHEUS_MULTIPROC_DIR."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = dict(
+            os.environ, PYTHONPATH=API_DIR, FLAGS_STORAGE_BACKEND='memory',
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, 'prometheus-multiproc')
+        )
+        for compose_file in COMPOSE_FILES:
+            with open(os.path.join(REPO_DIR, compose_file)) as file:
+                entrypoint = json.loads(re.search(r'entrypoint: (\[.*\])', file.read()).group(1))
+            # Compose turns $$ into $; stop before the server starts
+            command = entrypoint[-1].replace('$$', '$').split(' && exec ')[0]
+            result = subprocess.run(
+                entrypoint[:-1] + [command], cwd=REPO_DIR,
+                env=env, capture_output=True, text=True, timeout=60
+            )
+            self.assertEqual(result.returncode, 0, f"{compose_file}: {result.stderr}")
+            self.assertIn("Flag storage ready", result.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
 import unittest
+import os
 from unittest.mock import MagicMock, patch
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument, ReadPreference, InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from api.storage import FeatureFlagStorage
+from storage_backend import DuplicateNameError
 
 class TestFeatureFlagStorage(unittest.TestCase):
     @patch('api.storage.MongoClient')
@@ -17,7 +23,7 @@ class TestFeatureFlagStorage(unittest.TestCase):
         self.storage.collection = self.mock_collection
 
     def test_insert_and_find(self):
-        """Verify that insert_one interacts correctly with the mocked collection."""
+        """Verify that insert_flag interacts correctly with the mocked collection."""
         flag = {"name": "test-flag", "environments": {"dev": True}}
         
         # Setup mock for insert_one
@@ -26,12 +32,27 @@ class TestFeatureFlagStorage(unittest.TestCase):
         self.storage.collection.insert_one.return_value = mock_result
         
         # Execute
-        result = self.storage.insert_one(flag)
+        result = self.storage.insert_flag(flag)
         
         # Verify
-        self.storage.collection.insert_one.assert_called_with(flag)
+        self.storage.collection.insert_one.assert_called_with({"name": "test-flag", "environments": {"dev": True}, "tenant": "default"})
+        self.assertNotIn('tenant', flag)
         self.assertEqual(flag['_id'], 'mock-id-123')
 
+    def test_insert_duplicate_name(self):
+        """Verify a unique index violation surfaces as DuplicateNameError."""
+        self.storage.collection.insert_one.side_effect = DuplicateKeyError('dup')
+        
+        with self.assertRaises(DuplicateNameError):
+            self.storage.insert_flag({"name": "test-flag"})
+
+    def test_build_id_query_accepts_names(self):
+        """Verify keys that are not ObjectIds also match flag names."""
+        self.assertEqual(self.storage._build_id_query('dark-mode'),
+                         {'$or': [{'_id': 'dark-mode'}, {'name': 'dark-mode'}]})
+        object_id = '65a1f0c2e4b0a1b2c3d4e5f6'
+        self.assertEqual(self.storage._build_id_query(object_id), {'_id': ObjectId(object_id)})
+
     def test_get_all_logic(self):
         """Ensure get_all retrieves from collection and filters by environment."""
         # Setup mock data associated with the cursor
@@ -47,4 +68,289 @@ class TestFeatureFlagStorage(unittest.TestCase):
         # Verify
         self.assertEqual(len(found), 2)
         self.assertTrue(found[0]['enabled'])
-        self.assertFalse(found[1]['enabled'])
\ No newline at end of file
+        self.assertFalse(found[1]['enabled'])
+
+    def test_find_all_stringifies_ids(self):
+        """Ensure find_all returns raw documents with string ids."""
+        self.storage.collection.find.return_value = [{"_id": 1, "name": "f1"}]
+        
+        found = self.storage.find_all()
+        
+        self.assertEqual(found, [{"_id": "1", "name": "f1"}])
+        self.assertNotIn('enabled', found[0])
+
+    def test_version_counter(self):
+        """Ensure the flag-set version is read from and bumped in the meta collection."""
+        self.storage.meta = MagicMock()
+        self.storage.meta.find_one.return_value = None
+        self.assertEqual(self.storage.get_version(), 0)
+        
+        self.storage.meta.find_one_and_update.return_value = {"_id": "flags_version", "value": 3}
+        self.assertEqual(self.storage.bump_version(), 3)
+        args = self.storage.meta.find_one_and_update.call_args
+        self.assertEqual(args[0][1], {"$inc": {"value": 1}})
+        self.assertTrue(args[1]['upsert'])
+
+    def test_update_flag_returns_post_image(self):
+        """Ensure update_flag sets fields, bumps the version and returns the document after the update."""
+        self.storage.collection.find_one_and_update.return_value = {"_id": ObjectId("65a1f0c2e4b0a1b2c3d4e5f6"), "version": 2}
+        
+        result = self.storage.update_flag("dark-mode", {"description": "x"}, expected_version=1)
+        
+        self.assertEqual(result, {"_id": "65a1f0c2e4b0a1b2c3d4e5f6", "version": 2})
+        args, kwargs = self.storage.collection.find_one_and_update.call_args
+        self.assertEqual(args[0], {"$or": [{"_id": "dark-mode"}, {"name": "dark-mode"}], "tenant": "default", "version": 1})
+        self.assertEqual(args[1], {"$set": {"description": "x"}, "$inc": {"version": 1}})
+        self.assertEqual(kwargs['return_document'], ReturnDocument.AFTER)
+
+    def test_toggle_flag_negates_server_side(self):
+        """Ensure toggle_flag is one pipeline update negating the stored value."""
+        self.storage.collection.find_one_and_update.return_value = None
+        
+        self.assertIsNone(self.storage.toggle_flag("dark-mode", "staging", expected_version=0))
+        
+        query, pipeline = self.storage.collection.find_one_and_update.call_args[0]
+        self.assertEqual(query['version'], {'$in': [0, None]})
+        self.assertEqual(pipeline[0]['$set']['environments.staging'], {'$not': ['$environments.staging']})
+        self.storage.collection.update_one.assert_not_called()
+
+    def test_get_all_enabled_filter_pushed_down(self):
+        """Ensure get_all filters by environment state in the MongoDB query."""
+        self.storage.collection.find.return_value = []
+        
+        self.storage.get_all(environment='production', enabled=True)
+        
+        self.storage.collection.find.assert_called_with({"tenant": "default", "environments.production": True}, None)
+
+    def test_get_all_paginated_projection(self):
+        """Ensure prefix, cursor, limit and projection are pushed into the MongoDB query."""
+        cursor = self.storage.collection.find.return_value
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = [{"_id": "id1", "name": "beta-x", "environments": {"dev": True}}]
+        
+        found = self.storage.get_all('dev', prefix='beta-', after='beta-a', limit=10, fields=['name', 'enabled'])
+        
+        query, projection = self.storage.collection.find.call_args[0]
+        self.assertEqual(query, {"tenant": "default", "name": {"$regex": "^beta\\-", "$gt": "beta-a"}})
+        self.assertEqual(projection, {"name": 1, "environments.dev": 1})
+        cursor.sort.assert_called_with("name", 1)
+        cursor.limit.assert_called_with(10)
+        self.assertEqual(found, [{"_id": "id1", "name": "beta-x", "enabled": True}])
+
+    def test_ensure_indexes(self):
+        """Ensure a unique name index and an environments wildcard index are created."""
+        self.storage._ensure_indexes()
+        
+        calls = self.storage.collection.create_index.call_args_list
+        self.assertEqual(calls[0][0][0], [("tenant", 1), ("name", 1)])
+        self.assertTrue(calls[0][1]['unique'])
+        self.assertEqual(calls[1][0][0], [("environments.$**", 1)])
+
+    def test_find_by_name(self):
+        """Ensure find_by_name queries the name field."""
+        self.storage.find_by_name("dark-mode")
+        
+        self.storage.collection.find_one.assert_called_with({"tenant": "default", "name": "dark-mode"})
+
+    def test_iter_all_uses_batch_size(self):
+        """Ensure iter_all streams documents from a cursor with the requested batch size."""
+        cursor = self.storage.collection.find.return_value
+        cursor.batch_size.return_value = iter([{"_id": "id1", "environments": {}}])
+        
+        found = self.storage.iter_all('dev', batch_size=200)
+        
+        self.storage.collection.find.assert_not_called()
+        self.assertEqual(list(found), [{"_id": "id1", "environments": {}, "enabled": False}])
+        cursor.batch_size.assert_called_with(200)
+
+    @patch.dict(os.environ, {"MONGO_MAX_POOL_SIZE": "50", "MONGO_MIN_POOL_SIZE": "5",
+                             "MONGO_READ_PREFERENCE": "secondaryPreferred"})
+    @patch('api.storage.MongoClient')
+    def test_pool_options_and_read_preference(self, mock_client):
+        """Ensure pool settings reach MongoClient and listings use the read preference."""
+        storage = FeatureFlagStorage()
+        storage._initialize_mongo()
+        
+        kwargs = mock_client.call_args[1]
+        self.assertEqual(kwargs['maxPoolSize'], 50)
+        self.assertEqual(kwargs['minPoolSize'], 5)
+        self.assertNotIn('waitQueueTimeoutMS', kwargs)
+        self.assertEqual([type(l).__name__ for l in kwargs['event_listeners']], ['PoolMetricsListener'])
+        collection = mock_client.return_value.feature_flags_db.flags
+        self.assertEqual(collection.with_options.call_args[1]['read_preference'], ReadPreference.SECONDARY_PREFERRED)
+        self.assertIs(storage._get_read_collection(), collection.with_options.return_value)
+
+    def test_bulk_write_unordered(self):
+        """Ensure bulk_write sends all writes as pymongo requests in one unordered bulk write."""
+        object_id, other_id = ObjectId(), ObjectId()
+        self.storage.collection.bulk_write.return_value.bulk_api_result = {"nMatched": 2, "nRemoved": 1}
+        self.storage.collection.find.return_value = [
+            {"_id": object_id, "name": "new-flag", "tenant": "default"},
+            {"_id": other_id, "name": "old-flag", "version": 4, "tenant": "default"}
+        ]
+        
+        results = self.storage.bulk_write([
+            ('create', {"_id": object_id, "name": "new-flag"}),
+            ('toggle', other_id, 2, 'production'),
+            ('update', other_id, None, {"description": "x"}),
+            ('delete', 'legacy', None)
+        ])
+        
+        self.assertEqual(results, [
+            ('ok', {"_id": str(object_id), "name": "new-flag"}),
+            ('ok', {"_id": str(other_id), "name": "old-flag", "version": 4}),
+            ('ok', {"_id": str(other_id), "name": "old-flag", "version": 4}),
+            ('ok', None)
+        ])
+        self.storage.collection.find.assert_called_once_with(
+            {"_id": {"$in": [object_id, other_id, other_id, 'legacy']}, "tenant": "default"})
+        requests, kwargs = self.storage.collection.bulk_write.call_args
+        self.assertEqual([type(r) for r in requests[0]], [InsertOne, UpdateOne, UpdateOne, DeleteOne])
+        self.assertFalse(kwargs['ordered'])
+
+    def test_bulk_write_reports_write_errors(self):
+        """Ensure duplicate keys in a bulk write are reported as conflicts by index."""
+        self.storage.collection.bulk_write.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'},
+                            {'index': 2, 'code': 2, 'errmsg': 'bad'}],
+            'nRemoved': 1
+        })
+        
+        results = self.storage.bulk_write([('delete', 'a', None)] * 3)
+        
+        self.assertEqual(results, [('ok', None), ('conflict', 'duplicate key'), ('error', 'bad')])
+        self.storage.collection.find.assert_not_called()
+
+    def test_bulk_write_reports_missed_writes(self):
+        """Ensure writes that matched nothing are told apart by reading the flags back."""
+        self.storage.collection.bulk_write.return_value.bulk_api_result = {"nMatched": 1, "nRemoved": 0}
+        self.storage.collection.find.return_value = [
+            {"_id": "a", "version": 3, "tenant": "default"},
+            {"_id": "b", "version": 5, "tenant": "default"},
+            {"_id": "c", "version": 1, "tenant": "default"}
+        ]
+        
+        results = self.storage.bulk_write([
+            ('update', 'a', 2, {"description": "x"}),
+            ('update', 'b', 2, {"description": "x"}),
+            ('toggle', 'gone', None, 'staging'),
+            ('delete', 'c', 0)
+        ])
+        
+        self.assertEqual([status for status, _ in results], ['ok', 'conflict', 'not_found', 'conflict'])
+
+    def test_bulk_transaction_with_missed_write_rolls_back(self):
+        """Ensure a transaction is aborted when one of its writes matched nothing."""
+        self.storage.client = MagicMock()
+        session = self.storage.client.start_session.return_value.__enter__.return_value
+        session.with_transaction.side_effect = lambda callback: callback(session)
+        self.storage.collection.bulk_write.return_value.bulk_api_result = {"nMatched": 1, "nRemoved": 0}
+        self.storage.collection.find.return_value = [{"_id": "a", "version": 2}, {"_id": "b", "version": 7}]
+        
+        results = self.storage.bulk_write([
+            ('update', 'a', 2, {"description": "x"}),
+            ('update', 'b', 2, {"description": "x"})
+        ], transaction=True)
+        
+        self.assertEqual([status for status, _ in results], ['aborted', 'conflict'])
+
+    def test_find_flags_resolves_ids_and_names(self):
+        """Ensure find_flags resolves ids and names with one query."""
+        object_id = ObjectId()
+        self.storage.collection.find.return_value = [
+            {"_id": object_id, "name": "dark-mode", "version": 2},
+            {"_id": "legacy", "name": "beta"}
+        ]
+        
+        found = self.storage.find_flags({str(object_id), "beta", "missing"})
+        
+        self.assertEqual(set(found), {str(object_id), "beta"})
+        self.assertIs(found["beta"]["_id"], "legacy")
+        self.storage.collection.find.assert_called_once()
+
+    def test_seed_uses_insert_many(self):
+        """Ensure seeding an empty collection inserts all flags in one call."""
+        self.storage.collection.count_documents.return_value = 0
+        
+        self.storage.seed()
+        
+        self.storage.collection.insert_many.assert_called_once()
+        self.storage.collection.insert_one.assert_not_called()
+
+    def test_delete_returns_deleted_flag(self):
+        """Ensure delete_flag removes and returns the document in one round trip."""
+        object_id = ObjectId()
+        self.storage.collection.find_one_and_delete.return_value = {"_id": object_id, "name": "legacy"}
+        
+        deleted = self.storage.delete_flag(str(object_id))
+        
+        self.storage.collection.find_one_and_delete.assert_called_with({"_id": object_id, "tenant": "default"})
+        self.assertEqual(deleted['_id'], str(object_id))
+
+    def test_history_stores_dates(self):
+        """Ensure history events are stored with BSON dates and come back as timestamps."""
+        self.storage.history = MagicMock()
+        self.storage.append_history([{"version": 3, "flag_id": "1", "op": "delete", "flag": None, "at": 1700000000.0}])
+        
+        (event,) = self.storage.history.insert_many.call_args[0][0]
+        self.assertEqual(event['at'], datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc))
+        
+        self.storage.history.find.return_value.sort.return_value = [dict(event, at=event['at'].replace(tzinfo=None))]
+        self.assertEqual(self.storage.history_events(2, 3)[0]['at'], 1700000000.0)
+        self.storage.history.find.assert_called_with({"tenant": "default", "version": {"$gt": 2, "$lte": 3}}, {"_id": 0, "tenant": 0})
+
+    def test_tenant_store_shares_connection(self):
+        """Ensure a tenant's store reuses the client and scopes queries and the version counter."""
+        acme = self.storage.for_tenant('acme')
+        self.assertIs(self.storage.for_tenant('acme'), acme)
+        self.assertIs(self.storage.for_tenant('default'), self.storage)
+        self.storage.meta = MagicMock()
+        self.storage.meta.find_one.return_value = {"value": 7}
+        
+        self.assertEqual(acme.get_version(), 7)
+        self.storage.meta.find_one.assert_called_with({"_id": "flags_version:acme"})
+        self.assertIs(acme.collection, self.mock_collection)
+        self.assertFalse(acme.supports_change_stream)
+        
+        self.mock_collection.find.return_value = [{"_id": "1", "name": "f1", "tenant": "acme"}]
+        self.assertEqual(acme.find_all(), [{"_id": "1", "name": "f1"}])
+        self.mock_collection.find.assert_called_with({"tenant": "acme"})
+
+    def test_migrate_tenants(self):
+        """Ensure documents from before tenants move to the default tenant and old indexes go."""
+        self.storage.db = self.mock_db
+        self.storage.history = MagicMock()
+        self.storage.checkpoints = MagicMock()
+        self.mock_collection.index_information.return_value = {"_id_": {}, "name_unique": {}}
+        
+        self.storage._migrate_tenants()
+        
+        self.mock_collection.update_many.assert_called_with({"tenant": {"$exists": False}}, {"$set": {"tenant": "default"}})
+        self.storage.history.update_many.assert_called_once()
+        self.mock_collection.drop_index.assert_called_with("name_unique")
+
+    def test_history_indexes_do_not_expire(self):
+        """Ensure history has no TTL indexes, which would expire a tenant's only checkpoint before its later events."""
+        self.storage.history = MagicMock()
+        self.storage.checkpoints = MagicMock()
+        
+        self.storage._ensure_history_indexes()
+        
+        for collection in (self.storage.history, self.storage.checkpoints):
+            for call in collection.create_index.call_args_list:
+                self.assertNotIn('expireAfterSeconds', call[1])
+        self.assertTrue(self.storage.checkpoints.create_index.call_args_list[0][1]['unique'])
+
+    def test_save_checkpoint_prunes_superseded_history(self):
+        """Ensure a checkpoint prunes only expired checkpoints and events older than itself."""
+        self.storage.history = MagicMock()
+        self.storage.checkpoints = MagicMock()
+        
+        self.storage.save_checkpoint(5, [], 1700000000.0)
+        
+        self.storage.checkpoints.update_one.assert_called_once()
+        checkpoints_query = self.storage.checkpoints.delete_many.call_args[0][0]
+        history_query = self.storage.history.delete_many.call_args[0][0]
+        self.assertEqual((checkpoints_query['tenant'], checkpoints_query['version']), ("default", {"$lt": 5}))
+        self.assertEqual((history_query['tenant'], history_query['version']), ("default", {"$lte": 5}))
+        self.assertIn("$lt", history_query['at'])
@@ -0,0 +1,197 @@
+import os
+import shutil
+import time
+import tempfile
+import unittest
+from unittest.mock import patch
+from memory_storage import MemoryStorage
+from sqlite_storage import SQLiteStorage
+from storage_backend import DuplicateNameError, SEED_FLAGS, create_storage
+
+class StorageBackendContract:
+    """Behaviour every document storage backend must share; mixed into one TestCase per backend."""
+
+    def create_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.create_storage()
+        self.flag = self.storage.insert_flag({"name": "new-search", "environments": {"staging": True}})
+
+    def test_seeds_demo_flags(self):
+        names = {flag['name'] for flag in self.storage.find_all()}
+        self.assertTrue({flag['name'] for flag in SEED_FLAGS} <= names)
+
+    def test_find_by_id_and_name(self):
+        self.assertEqual(self.storage.find_flag(self.flag['_id'])['name'], "new-search")
+        self.assertEqual(self.storage.find_flag("new-search")['_id'], self.flag['_id'])
+        self.assertEqual(self.storage.find_by_name("new-search")['_id'], self.flag['_id'])
+        self.assertIsNone(self.storage.find_flag("missing"))
+
+    def test_returned_flags_are_copies(self):
+        self.storage.find_flag("new-search")['environments']['staging'] = False
+        self.assertTrue(self.storage.find_flag("new-search")['environments']['staging'])
+
+    def test_duplicate_names_rejected(self):
+        with self.assertRaises(DuplicateNameError):
+            self.storage.insert_flag({"name": "new-search"})
+        with self.assertRaises(DuplicateNameError):
+            self.storage.update_flag("new-dashboard", {"name": "new-search"})
+        self.assertEqual(self.storage.find_flag("new-dashboard")['name'], "new-dashboard")
+
+    def test_update_bumps_version_and_checks_expected_version(self):
+        updated = self.storage.update_flag("new-search", {"description": "x"}, expected_version=0)
+        self.assertEqual((updated['description'], updated['version']), ("x", 1))
+        self.assertIsNone(self.storage.update_flag("new-search", {"description": "y"}, expected_version=0))
+        self.assertIsNone(self.storage.update_flag("missing", {"description": "y"}))
+
+    def test_rename_frees_old_name(self):
+        self.storage.update_flag("new-search", {"name": "search-v3"})
+        self.assertIsNone(self.storage.find_by_name("new-search"))
+        self.storage.insert_flag({"name": "new-search"})
+
+    def test_toggle(self):
+        toggled = self.storage.toggle_flag("new-search", "production")
+        self.assertTrue(toggled['environments']['production'])
+        toggled = self.storage.toggle_flag("new-search", "staging")
+        self.assertEqual(toggled['environments'], {"staging": False, "production": True})
+        self.assertEqual(toggled['version'], 2)
+
+    def test_delete(self):
+        self.assertEqual(self.storage.delete_flag("new-search")['_id'], self.flag['_id'])
+        self.assertIsNone(self.storage.delete_flag("new-search"))
+        self.assertIsNone(self.storage.find_by_name("new-search"))
+
+    def test_listing_filters_and_pagination(self):
+        enabled = self.storage.get_all('production', enabled=True, fields=['name'])
+        self.assertEqual(sorted(flag['name'] for flag in enabled),
+                         ["ab-test-home-hero", "beta-checkout", "dark-mode", "limit-rate-api"])
+        self.assertEqual(set(enabled[0]), {'_id', 'name'})
+
+        page = self.storage.get_all('staging', prefix='new-', limit=1)
+        self.assertEqual([(flag['name'], flag['enabled']) for flag in page], [("new-dashboard", True)])
+        page = self.storage.get_all('staging', after='limit-rate-api', limit=2)
+        self.assertEqual([flag['name'] for flag in page], ["new-dashboard", "new-search"])
+
+    def test_version_counter(self):
+        self.assertEqual(self.storage.get_version(), 0)
+        self.assertEqual(self.storage.bump_version(), 1)
+        self.assertEqual(self.storage.get_version(), 1)
+
+    def test_history_events_and_checkpoints(self):
+        flag = {"_id": "1", "name": "f1", "environments": {"staging": True}}
+        self.storage.append_history([
+            {"version": 2, "flag_id": "1", "op": "update", "flag": flag, "at": 200.0},
+            {"version": 1, "flag_id": "1", "op": "create", "flag": flag, "at": 100.0},
+            {"version": 3, "flag_id": "1", "op": "delete", "flag": None, "at": 300.0},
+        ])
+        self.assertEqual([event['version'] for event in self.storage.history_events(1, 3)], [2, 3])
+        self.assertIsNone(self.storage.history_events(2, 3)[0]['flag'])
+        self.assertEqual(self.storage.history_version_at(250.0), 2)
+        self.assertIsNone(self.storage.history_version_at(50.0))
+
+        now = time.time()
+        self.storage.save_checkpoint(1, [flag], now)
+        self.storage.save_checkpoint(1, [], now)
+        self.storage.save_checkpoint(3, [], now)
+        self.assertEqual(self.storage.find_checkpoint(2)['flags'], [flag])
+        self.assertEqual(self.storage.find_checkpoint()['version'], 3)
+        self.assertIsNone(self.storage.find_checkpoint(0))
+
+    def test_pruning_keeps_newest_checkpoint(self):
+        flag = {"_id": "1", "name": "f1", "environments": {}}
+        self.storage.history_retention = 60
+        expired = time.time() - 3600
+        self.storage.save_checkpoint(1, [], expired)
+        self.storage.append_history([{"version": 2, "flag_id": "1", "op": "create", "flag": flag, "at": expired}])
+        self.storage.save_checkpoint(2, [flag], expired)
+        self.storage.append_history([{"version": 3, "flag_id": "1", "op": "delete", "flag": None, "at": expired}])
+        self.storage.save_checkpoint(2, [flag], time.time())
+
+        # Older history goes, but the latest state can still be rebuilt
+        self.assertIsNone(self.storage.find_checkpoint(1))
+        self.assertEqual(self.storage.find_checkpoint()['version'], 2)
+        self.assertEqual([event['version'] for event in self.storage.history_events(0, 3)], [3])
+
+    def test_tenants_are_isolated(self):
+        acme = self.storage.for_tenant('acme')
+        self.assertIs(self.storage.for_tenant('acme'), acme)
+        self.assertEqual(acme.find_all(), [])
+
+        acme.insert_flag({"name": "new-search"})
+        acme.bump_version()
+        self.assertEqual(len(acme.find_all()), 1)
+        self.assertEqual(self.storage.find_by_name("new-search")['_id'], self.flag['_id'])
+        self.assertEqual(self.storage.get_version(), 0)
+
+    def test_bulk_write_applies_independent_writes(self):
+        found = self.storage.find_flags({"new-search", "missing"})
+        self.assertEqual(set(found), {"new-search"})
+        flag_id = found["new-search"]['_id']
+
+        results = self.storage.bulk_write([
+            ('create', {"_id": self.storage.new_id(), "name": "beta-checkout"}),
+            ('toggle', flag_id, 0, 'production'),
+            ('create', {"_id": self.storage.new_id(), "name": "search-v2"}),
+            ('delete', 'recommendations', None),
+            ('update', flag_id, 0, {"description": "stale"}),
+            ('delete', 'missing', None)
+        ])
+
+        self.assertEqual([status for status, _ in results], ['conflict', 'ok', 'ok', 'ok', 'conflict', 'not_found'])
+        self.assertTrue(results[1][1]['environments']['production'])
+        self.assertEqual(results[2][1]['name'], "search-v2")
+        self.assertIsNone(results[3][1])
+        self.assertTrue(self.storage.find_flag(flag_id)['environments']['production'])
+        self.assertIsNotNone(self.storage.find_by_name("search-v2"))
+        self.assertIsNone(self.storage.find_by_name("recommendations"))
+
+    def test_bulk_write_transaction_is_all_or_nothing(self):
+        results = self.storage.bulk_write([
+            ('create', {"_id": self.storage.new_id(), "name": "search-v2"}),
+            ('create', {"_id": self.storage.new_id(), "name": "new-search"}),
+            ('delete', 'recommendations', None)
+        ], transaction=True)
+
+        self.assertEqual([status for status, _ in results], ['ok', 'conflict', 'aborted'])
+        self.assertIsNotNone(self.storage.find_by_name("recommendations"))
+        self.assertIsNone(self.storage.find_by_name("search-v2"))
+
+class TestMemoryStorage(StorageBackendContract, unittest.TestCase):
+    def create_storage(self):
+        return MemoryStorage()
+
+class TestSQLiteStorage(StorageBackendContract, unittest.TestCase):
+    def create_storage(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'flags.db')
+        return SQLiteStorage(self.path)
+
+    def test_data_shared_across_instances(self):
+        other = SQLiteStorage(self.path)
+        self.assertEqual(other.find_by_name("new-search")['_id'], self.flag['_id'])
+        other.bump_version()
+        self.assertEqual(self.storage.get_version(), 1)
+
+    def test_rejects_in_memory_database(self):
+        # Every thread's connection would get a separate, empty database
+        for path in (':memory:', ''):
+            with self.assertRaises(ValueError):
+                SQLiteStorage(path)
+
+    def test_tenant_gets_own_file(self):
+        self.storage.for_tenant('acme').warm_up()
+        self.assertTrue(os.path.exists(os.path.join(os.path.dirname(self.path), 'flags.acme.db')))
+
+class TestCreateStorage(unittest.TestCase):
+    @patch.dict(os.environ, {"FLAGS_STORAGE_BACKEND": "memory"})
+    def test_backend_from_environment(self):
+        self.assertIsInstance(create_storage(), MemoryStorage)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_storage('redis')
+
+if __name__ == '__main__':
+    unittest.main()
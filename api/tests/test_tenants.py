@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from memory_storage import MemoryStorage
+from feature_flag_service import FeatureFlagService
+from tenants import TenantRegistry, TokenBucket, is_valid_tenant
+
+class TestTenantRegistry(unittest.TestCase):
+    def setUp(self):
+        self.default = FeatureFlagService(MemoryStorage(seed=False))
+        self.tenants = TenantRegistry(self.default, cache_size=2, rate_limit=0, tenants=['acme', 'globex', 'initech'])
+
+    def test_default_tenant(self):
+        self.assertIs(self.tenants.get('default'), self.default)
+
+    def test_partitions_are_isolated(self):
+        acme = self.tenants.get('acme')
+        self.assertIs(self.tenants.get('acme'), acme)
+        acme.create_flag({'name': 'f1', 'environments': {}})
+
+        self.assertEqual([flag['name'] for flag in acme.get_all_flags()], ['f1'])
+        self.assertEqual(self.default.get_all_flags(), [])
+        self.assertEqual(self.tenants.get('globex').get_all_flags(), [])
+
+    def test_least_recently_used_partition_evicted(self):
+        acme = self.tenants.get('acme')
+        globex = self.tenants.get('globex')
+        self.tenants.get('acme')
+        self.tenants.get('initech')
+
+        self.assertIs(self.tenants.get('acme'), acme)
+        self.assertIsNot(self.tenants.get('globex'), globex)
+        # The data outlives the partition
+        globex.create_flag({'name': 'f1', 'environments': {}})
+        self.assertEqual(len(self.tenants.get('globex').get_all_flags()), 1)
+
+    def test_offline_snapshots_are_per_tenant(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with patch.dict(os.environ, {'FLAGS_SNAPSHOT_PATH': os.path.join(directory, 'flags.snapshot')}):
+            default = FeatureFlagService(MemoryStorage(seed=False))
+        tenants = TenantRegistry(default, rate_limit=0, tenants=['acme'])
+        default.create_flag({'name': 'public', 'environments': {}})
+        acme = tenants.get('acme')
+        acme.create_flag({'name': 'acme-secret', 'environments': {}})
+        default.get_all_flags()
+        acme.get_all_flags()
+
+        for service in (default, acme):
+            service.storage.find_all = service.storage.get_version = lambda: 1 / 0
+            service.cache.invalidate()
+        with self.assertLogs('flag_cache', 'ERROR'):
+            self.assertEqual([flag['name'] for flag in default.get_all_flags()], ['public'])
+            self.assertEqual([flag['name'] for flag in acme.get_all_flags()], ['acme-secret'])
+        self.assertTrue(default.cache.degraded and acme.cache.degraded)
+
+    def test_only_provisioned_tenants_exist(self):
+        self.assertTrue(self.tenants.exists('default'))
+        self.assertTrue(self.tenants.exists('acme'))
+        self.assertFalse(self.tenants.exists('t0'))
+        with self.assertRaises(KeyError):
+            self.tenants.get('t0')
+
+    def test_tenants_from_environment(self):
+        with patch.dict(os.environ, {'FLAGS_TENANTS': 'acme, globex'}):
+            self.assertEqual(TenantRegistry(self.default).provisioned, {'acme', 'globex'})
+        with patch.dict(os.environ, {'FLAGS_TENANTS': 'acme,../etc'}), self.assertRaises(ValueError):
+            TenantRegistry(self.default)
+
+    def test_throttle_per_tenant(self):
+        tenants = TenantRegistry(self.default, rate_limit=1, rate_burst=2)
+        self.assertEqual([tenants.throttle('acme') for _ in range(2)], [0, 0])
+        self.assertGreater(tenants.throttle('acme'), 0)
+        self.assertEqual(tenants.throttle('globex'), 0)
+
+class TestTokenBucket(unittest.TestCase):
+    @patch('tenants.time.monotonic')
+    def test_refills_at_rate(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate=2, burst=1)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 0.5)
+
+        monotonic.return_value = 100.5
+        self.assertEqual(bucket.take(), 0)
+
+    def test_valid_tenant_names(self):
+        self.assertTrue(is_valid_tenant('team-a_1'))
+        for name in ('', 'Team', '-a', 'a/b', 'a.b', 'x' * 64, None):
+            self.assertFalse(is_valid_tenant(name))
+
+if __name__ == '__main__':
+    unittest.main()
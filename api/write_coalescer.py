@@ -0,0 +1,49 @@
+import time
+import threading
+
+class _Batch:
+    def __init__(self):
+        self.requests = []
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class WriteCoalescer:
+    """Merges writes to the same key that arrive within `window` seconds.
+
+    The first request for a key opens a batch and waits out the window;
+    requests arriving meanwhile join it and block. The opener then applies
+    the whole batch with one call and every request in it gets that call's
+    result (or exception), so a burst of clicks turns into one storage write.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def submit(self, key, request, apply):
+        """Add `request` to the batch for `key`; returns `apply(requests)` for the whole batch."""
+        with self._lock:
+            batch = self._batches.get(key)
+            opener = batch is None
+            if opener:
+                batch = self._batches[key] = _Batch()
+            batch.requests.append(request)
+
+        if opener:
+            time.sleep(self.window)
+            with self._lock:
+                del self._batches[key]
+            try:
+                batch.result = apply(batch.requests)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
@@ -0,0 +1,421 @@
+"""Load test and benchmark the flags API.
+
+Each scenario loads `--flags` generated flags into a fresh store, drives a
+weighted mix of requests from `--concurrency` client threads for
+`--duration` seconds and reports per-operation latency percentiles,
+throughput and memory use as JSON.
+
+Run from the repository root:
+
+    # API layer only: in-process Flask app on the in-memory backend
+    python benchmarks/bench.py --flags 10,1000,100000 --concurrency 1,8,32
+
+    # Real HTTP through Gunicorn, workers sharing an SQLite database
+    python benchmarks/bench.py --mode gunicorn --workers 4 --flags 1000 --concurrency 16
+
+    # Exit with status 1 if p95 latency or throughput regressed by more than 20%
+    python benchmarks/bench.py --output current.json --baseline baseline.json --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(REPO_ROOT, 'api')
+sys.path.insert(0, API_DIR)
+# Writing a JSON access log line per request would be measured along with the
+# API; set FLAGS_ACCESS_LOG_SAMPLE_RATE to benchmark with logging on. Gunicorn
+# workers inherit this environment.
+os.environ.setdefault('FLAGS_ACCESS_LOG_SAMPLE_RATE', '0')
+
+OPERATIONS = ('read', 'evaluate', 'toggle', 'create')
+DEFAULT_MIX = 'read=85,evaluate=5,toggle=9,create=1'
+ENVIRONMENTS = ('development', 'staging', 'production')
+COUNTRIES = ('IL', 'US', 'DE', 'FR', 'GB', 'IN', 'BR', 'JP')
+BULK_CHUNK = 1000
+
+def generate_flags(count, seed):
+    """Flags shaped like real ones: random per-environment states, a fifth with targeting."""
+    rng = random.Random(seed)
+    flags = []
+    for index in range(count):
+        flag = {
+            "name": f"bench-flag-{index:06d}",
+            "description": f"Benchmark flag {index}",
+            "environments": {environment: rng.random() < 0.5 for environment in ENVIRONMENTS},
+        }
+        if rng.random() < 0.2:
+            flag["targeting"] = {"production": {
+                "rules": [{"attribute": "country", "operator": "in", "values": rng.sample(COUNTRIES, 3)}],
+                "rollout": {"percentage": rng.choice((10, 25, 50)), "key": "user_id"}
+            }}
+        flags.append(flag)
+    return flags
+
+def create_storage(backend, flags, path=None):
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        storage = MemoryStorage(seed=False)
+    else:
+        from sqlite_storage import SQLiteStorage
+        storage = SQLiteStorage(path, seed=False)
+    for start in range(0, len(flags), BULK_CHUNK):
+        storage.bulk_write([('create', {**flag, '_id': storage.new_id()}) for flag in flags[start:start + BULK_CHUNK]])
+    storage.bump_version()
+    return storage
+
+def build_request(op, rng, names, client_index, sequence):
+    """Return (method, path, json body) for one operation."""
+    if op == 'read':
+        return 'GET', f"/flags?environment={rng.choice(ENVIRONMENTS)}", None
+    if op == 'evaluate':
+        return 'POST', '/flags/evaluate', {
+            "flags": rng.sample(names, min(10, len(names))),
+            "environment": "production",
+            "context": {"user_id": f"user-{rng.randrange(100000)}", "country": rng.choice(COUNTRIES)}
+        }
+    if op == 'toggle':
+        return 'POST', f"/flags/{rng.choice(names)}/toggle", {"environment": rng.choice(ENVIRONMENTS)}
+    return 'POST', '/flags', {
+        "name": f"bench-new-{client_index}-{sequence}",
+        "environments": {environment: rng.random() < 0.5 for environment in ENVIRONMENTS}
+    }
+
+class InProcessClient:
+    """Calls the Flask app directly: measures the API layer without sockets."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+class HTTPClient:
+    """One keep-alive HTTP connection, reopened after network errors."""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, body):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body=data, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            return None
+
+    def close(self):
+        self.connection.close()
+
+def run_load(make_client, names, concurrency, duration, mix, seed):
+    """Drive the mix from `concurrency` threads; return latencies and error counts per operation."""
+    ops, weights = zip(*mix.items())
+    latencies = [{op: [] for op in ops} for _ in range(concurrency)]
+    errors = [{op: 0 for op in ops} for _ in range(concurrency)]
+    start_line = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def client_loop(index):
+        client = make_client()
+        rng = random.Random(seed * 1000 + index)
+        sequence = 0
+        start_line.wait()
+        try:
+            while time.perf_counter() < deadline[0]:
+                op = rng.choices(ops, weights)[0]
+                method, path, body = build_request(op, rng, names, index, sequence)
+                sequence += 1
+                started = time.perf_counter()
+                status = client.request(method, path, body)
+                latencies[index][op].append(time.perf_counter() - started)
+                if status is None or status >= 400:
+                    errors[index][op] += 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=client_loop, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    deadline[0] = time.perf_counter() + duration
+    started = time.perf_counter()
+    start_line.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    merged = {op: sorted(sample for per_client in latencies for sample in per_client[op]) for op in ops}
+    failed = {op: sum(per_client[op] for per_client in errors) for op in ops}
+    return merged, failed, elapsed
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[rank - 1]
+
+def summarize(latencies, errors, elapsed):
+    count = len(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 1) if elapsed else None,
+        "mean_ms": to_ms(sum(latencies) / count) if count else None,
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p95_ms": to_ms(percentile(latencies, 0.95)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1]) if count else None,
+    }
+
+def rss_mb(pid='self'):
+    """Resident set size of a process in MB (Linux only; None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def child_pids(parent):
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name can contain spaces; fields after it are fixed
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == parent:
+            pids.append(int(entry))
+    return pids
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(port, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Gunicorn exited with status {process.returncode}")
+        client = HTTPClient(port)
+        status = client.request('GET', '/ready', None)
+        client.close()
+        if status == 200:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"Gunicorn did not answer within {timeout} seconds")
+
+def run_inprocess(args, flags, concurrency):
+    from app import create_app
+    from feature_flag_service import FeatureFlagService
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = create_storage(args.backend, flags, os.path.join(directory, 'flags.db'))
+        service = FeatureFlagService(storage)
+        service.warm_up()
+        app = create_app(service)
+        make_client = lambda: InProcessClient(app)
+        warm_up(make_client)
+        latencies, errors, elapsed = run_load(
+            make_client, [flag['name'] for flag in flags], concurrency, args.duration, args.mix, args.seed
+        )
+        memory = {"rss_mb_per_worker": [rss_mb()]}
+    return latencies, errors, elapsed, memory
+
+def run_gunicorn(args, flags, concurrency):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'flags.db')
+        create_storage('sqlite', flags, path)
+        port = free_port()
+        env = dict(
+            os.environ,
+            PYTHONPATH=API_DIR,
+            PORT=str(port),
+            FLAGS_STORAGE_BACKEND='sqlite',
+            FLAGS_SQLITE_PATH=path,
+            GUNICORN_WORKERS=str(args.workers),
+            GUNICORN_WORKER_CLASS=args.worker_class,
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, 'prometheus'),
+        )
+        log_path = os.path.join(directory, 'gunicorn.log')
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '--config', os.path.join(API_DIR, 'gunicorn.conf.py'), 'app:create_app()'],
+                cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        try:
+            wait_until_ready(port, process, args.startup_timeout)
+            make_client = lambda: HTTPClient(port)
+            warm_up(make_client)
+            latencies, errors, elapsed = run_load(
+                make_client, [flag['name'] for flag in flags], concurrency, args.duration, args.mix, args.seed
+            )
+            memory = {"rss_mb_per_worker": [rss_mb(pid) for pid in child_pids(process.pid)]}
+        except RuntimeError:
+            with open(log_path) as log:
+                sys.stderr.write(log.read()[-4000:])
+            raise
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+    return latencies, errors, elapsed, memory
+
+def warm_up(make_client):
+    """Build each environment's cached response before measuring."""
+    client = make_client()
+    for environment in ENVIRONMENTS:
+        client.request('GET', f"/flags?environment={environment}", None)
+    client.close()
+
+def run_scenario(args, flag_count, concurrency):
+    flags = generate_flags(flag_count, args.seed)
+    runner = run_gunicorn if args.mode == 'gunicorn' else run_inprocess
+    latencies, errors, elapsed, memory = runner(args, flags, concurrency)
+
+    all_latencies = sorted(sample for samples in latencies.values() for sample in samples)
+    return {
+        "mode": args.mode,
+        "backend": 'sqlite' if args.mode == 'gunicorn' else args.backend,
+        "flags": flag_count,
+        "concurrency": concurrency,
+        "workers": args.workers if args.mode == 'gunicorn' else 1,
+        "duration_s": round(elapsed, 3),
+        "operations": {op: summarize(latencies[op], errors[op], elapsed) for op in latencies},
+        "total": summarize(all_latencies, sum(errors.values()), elapsed),
+        "memory": memory,
+    }
+
+def scenario_key(scenario):
+    return (scenario['mode'], scenario['backend'], scenario['flags'], scenario['concurrency'], scenario['workers'])
+
+def find_regressions(results, baseline, max_regression):
+    """Compare p95 latency and throughput with a previous run's matching scenarios."""
+    previous = {scenario_key(scenario): scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        before = previous.get(scenario_key(scenario))
+        if before is None:
+            continue
+        label = "{} flags x {} clients".format(scenario['flags'], scenario['concurrency'])
+        for op, stats in scenario['operations'].items():
+            old_p95 = before['operations'].get(op, {}).get('p95_ms')
+            if old_p95 and stats['p95_ms'] and stats['p95_ms'] > old_p95 * (1 + max_regression):
+                regressions.append(f"{label}: {op} p95 {old_p95}ms -> {stats['p95_ms']}ms")
+        old_rps, rps = before['total']['rps'], scenario['total']['rps']
+        if old_rps and rps is not None and rps < old_rps * (1 - max_regression):
+            regressions.append(f"{label}: throughput {old_rps} -> {rps} req/s")
+    return regressions
+
+def parse_counts(value):
+    counts = [int(part) for part in value.split(',') if part]
+    if not counts or any(count < 1 for count in counts):
+        raise argparse.ArgumentTypeError("expected a comma separated list of positive integers")
+    return counts
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        op, _, weight = part.partition('=')
+        if op not in OPERATIONS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"expected op=weight pairs with ops from {', '.join(OPERATIONS)}")
+        if int(weight):
+            mix[op] = int(weight)
+    if not mix:
+        raise argparse.ArgumentTypeError("at least one operation needs a positive weight")
+    return mix
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the flags API.")
+    parser.add_argument('--mode', choices=('inprocess', 'gunicorn'), default='inprocess',
+                        help="inprocess calls the Flask app directly; gunicorn serves it over HTTP")
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory',
+                        help="storage backend for inprocess runs (gunicorn runs always use sqlite)")
+    parser.add_argument('--flags', type=parse_counts, default=[10, 1000, 10000], help="flag counts, e.g. 10,1000,100000")
+    parser.add_argument('--concurrency', type=parse_counts, default=[1, 8, 32], help="client thread counts")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers")
+    parser.add_argument('--worker-class', default='gthread', help="Gunicorn worker class")
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=1, help="seed for the generated flags and request mix")
+    parser.add_argument('--output', help="write results to this file instead of stdout")
+    parser.add_argument('--baseline', help="results file of a previous run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="allowed relative p95 increase or throughput drop against the baseline")
+    args = parser.parse_args(argv)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mix": args.mix,
+        },
+        "scenarios": [],
+    }
+    for flag_count in args.flags:
+        for concurrency in args.concurrency:
+            scenario = run_scenario(args, flag_count, concurrency)
+            results["scenarios"].append(scenario)
+            total = scenario['total']
+            print(f"{flag_count:>7} flags {concurrency:>4} clients: {total['rps']:>9} req/s  "
+                  f"p50 {total['p50_ms']}ms  p95 {total['p95_ms']}ms  p99 {total['p99_ms']}ms  "
+                  f"errors {total['errors']}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+"""Python client for the Feature Flags API that evaluates flags in-process."""
+from .client import FlagsClient
+
+__version__ = '0.1.0'
+__all__ = ['FlagsClient']
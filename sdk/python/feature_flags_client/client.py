@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from .evaluation import compile_flag
+
+logger = logging.getLogger(__name__)
+
+class FlagsClient:
+    """Evaluates feature flags in-process from a locally held copy of one environment's flags.
+
+    The flags are fetched from `GET /flags` once and then refreshed by a
+    background thread every `refresh_interval` seconds. Refreshes send the
+    last ETag, so while nothing changed the API answers 304 with no body.
+    Lookups read an immutable index that refreshes replace in one assignment,
+    so they take no lock and never wait on the network.
+
+    With `snapshot_path`, every new flag set is also saved to that file, and
+    the file is loaded when the API cannot be reached at startup. A failed
+    refresh keeps the flags from the last successful one.
+    """
+
+    def __init__(self, base_url, environment='staging', tenant=None, refresh_interval=15.0,
+                 timeout=5.0, snapshot_path=None, start=True):
+        self.base_url = base_url.rstrip('/')
+        self.environment = environment
+        self.tenant = tenant
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.snapshot_path = snapshot_path
+        # (flags by id and name, ETag of the body they came from)
+        self._state = ({}, None)
+        self.last_refresh = None
+        self.stale = True
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        """Load the flags, from the API or else the snapshot file, and start refreshing."""
+        if self._thread is not None:
+            return
+        if not self.refresh() and self.snapshot_path:
+            self._load_snapshot()
+        self._thread = threading.Thread(target=self._run, name='flags-client-refresh', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the background refresh."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 1)
+            self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_enabled(self, key, context=None, default=False):
+        """Evaluate a flag, by name or id, for a context.
+
+        Without a context this is the flag's `enabled` state in the client's
+        environment, as `GET /flags` reports it; with one, the flag's
+        targeting rules and rollout decide. Unknown flags return `default`.
+        """
+        flag = self._state[0].get(key)
+        if flag is None:
+            return default
+        return flag.evaluate(self.environment, context)
+
+    def all_flags(self, context=None):
+        """Evaluate every flag; returns {name: enabled}."""
+        return {
+            flag.name: flag.evaluate(self.environment, context)
+            for key, flag in self._state[0].items() if key == flag.name
+        }
+
+    def refresh(self):
+        """Fetch the flags now; returns whether the API answered."""
+        request = urllib.request.Request(self._url(), headers=self._headers())
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                etag = response.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                return self._refresh_failed(e)
+        except (OSError, ValueError) as e:
+            return self._refresh_failed(e)
+        else:
+            try:
+                flags = json.loads(body)
+            except ValueError as e:
+                return self._refresh_failed(e)
+            self._replace(flags, etag)
+            if self.snapshot_path:
+                self._save_snapshot(flags, etag)
+        self.last_refresh = time.time()
+        self.stale = False
+        return True
+
+    def _url(self):
+        return f"{self.base_url}/flags?{urllib.parse.urlencode({'environment': self.environment})}"
+
+    def _headers(self):
+        headers = {'Accept': 'application/json'}
+        if self.tenant:
+            headers['X-Tenant'] = self.tenant
+        etag = self._state[1]
+        if etag:
+            headers['If-None-Match'] = f'"{etag}"'
+        return headers
+
+    def _refresh_failed(self, error):
+        logger.warning(f"Refreshing feature flags from {self.base_url} failed, keeping the last known flags: {error}")
+        self.stale = True
+        return False
+
+    def _replace(self, flags, etag):
+        index = {}
+        for flag in flags:
+            if flag.get('name') is not None:
+                index[flag['name']] = compile_flag(flag)
+        # Ids take precedence over names that happen to look like ids, as in the API
+        for flag in flags:
+            if flag.get('_id') is not None:
+                index[str(flag['_id'])] = index.get(flag.get('name')) or compile_flag(flag)
+        self._state = (index, etag.strip('"') if etag else None)
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.refresh()
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"No usable feature flag snapshot at {self.snapshot_path}: {e}")
+            return
+        if snapshot.get('environment') != self.environment or snapshot.get('tenant') != self.tenant:
+            logger.warning(f"Feature flag snapshot at {self.snapshot_path} is for another environment or tenant")
+            return
+        # Keep the ETag so the first successful refresh can still answer 304
+        self._replace(snapshot['flags'], snapshot.get('etag'))
+        logger.warning(f"Serving feature flags from snapshot {self.snapshot_path} saved at {snapshot.get('saved_at')}")
+
+    def _save_snapshot(self, flags, etag):
+        snapshot = {
+            'environment': self.environment,
+            'tenant': self.tenant,
+            'etag': etag,
+            'saved_at': time.time(),
+            'flags': flags
+        }
+        # Write a temporary file and rename it so readers never see half a snapshot
+        temporary = f"{self.snapshot_path}.tmp"
+        try:
+            with open(temporary, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file, separators=(',', ':'))
+            os.replace(temporary, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Saving feature flag snapshot to {self.snapshot_path} failed: {e}")
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import numbers
+
+logger = logging.getLogger(__name__)
+
+# A flag's per-environment targeting looks like:
+#
+#   "targeting": {
+#       "production": {
+#           "rules": [{"attribute": "country", "operator": "in", "values": ["IL", "US"]}],
+#           "match": "all",
+#           "rollout": {"percentage": 25, "key": "user_id"}
+#       }
+#   },
+#   "segments": {"beta-testers": ["user-1", "user-2"]}
+#
+# A context is enabled when the environment is on, its rules match ("all" or
+# "any" of them) and its key falls inside the rollout percentage.
+#
+# This is the API's api/evaluation.py without the write-side validation, so
+# flags evaluate the same in-process as through POST /flags/evaluate;
+# tests/test_evaluation_parity.py checks that the two agree.
+
+BUCKETS = 10000
+DEFAULT_ROLLOUT_KEY = 'key'
+
+_MISSING = object()
+
+def bucket(flag_name, key):
+    """Map a context key to a stable bucket in [0, BUCKETS) for a flag."""
+    digest = hashlib.sha1(f"{flag_name}:{key}".encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % BUCKETS
+
+class CompiledFlag:
+    """A flag with its targeting turned into plain Python predicates.
+
+    Built once per flag version so evaluating a context costs a few function
+    calls and set lookups instead of re-reading the raw document.
+    """
+
+    __slots__ = ('name', '_enabled', '_targeted')
+
+    def __init__(self, flag):
+        self.name = flag.get('name')
+        self._enabled = dict(flag.get('environments') or {})
+        segments = flag.get('segments') or {}
+        self._targeted = {}
+        for environment, targeting in (flag.get('targeting') or {}).items():
+            if not self._enabled.get(environment):
+                continue
+            try:
+                self._targeted[environment] = _compile_environment(self.name, targeting, segments)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                # Documents written around the API can hold anything; fail closed
+                logger.error(f"Invalid targeting for flag {self.name} in {environment}: {e}")
+                self._targeted[environment] = _never
+
+    def evaluate(self, environment, context=None):
+        """Evaluate for a context; without one, return the environment's on/off state."""
+        if not self._enabled.get(environment, False):
+            return False
+        if context is None:
+            return True
+        predicate = self._targeted.get(environment)
+        return predicate is None or predicate(context)
+
+def compile_flag(flag):
+    return CompiledFlag(flag)
+
+def _never(context):
+    return False
+
+def _compile_environment(flag_name, targeting, segments):
+    clauses = [_compile_clause(rule, segments) for rule in targeting.get('rules') or []]
+    match_any = targeting.get('match') == 'any'
+    rollout = targeting.get('rollout')
+    threshold = None
+    rollout_key = DEFAULT_ROLLOUT_KEY
+    if rollout:
+        threshold = round(rollout['percentage'] * BUCKETS / 100)
+        rollout_key = rollout.get('key', DEFAULT_ROLLOUT_KEY)
+
+    def predicate(context):
+        if clauses:
+            if match_any:
+                if not any(clause(context) for clause in clauses):
+                    return False
+            elif not all(clause(context) for clause in clauses):
+                return False
+        if threshold is None or threshold >= BUCKETS:
+            return True
+        key = context.get(rollout_key)
+        return key is not None and bucket(flag_name, key) < threshold
+
+    return predicate
+
+def _compile_clause(rule, segments):
+    attribute = rule['attribute']
+    operator = rule['operator']
+    values = rule['values']
+
+    if operator == 'in':
+        members = frozenset(values)
+        test = members.__contains__
+    elif operator == 'not_in':
+        excluded = frozenset(values)
+        test = lambda value: value not in excluded
+    elif operator == 'in_segment':
+        members = frozenset(key for name in values for key in segments.get(name, ()))
+        test = members.__contains__
+    elif operator == 'equals':
+        expected = values[0]
+        test = lambda value: value == expected
+    elif operator == 'not_equals':
+        expected = values[0]
+        test = lambda value: value != expected
+    elif operator == 'starts_with':
+        prefixes = tuple(values)
+        test = lambda value: isinstance(value, str) and value.startswith(prefixes)
+    elif operator == 'ends_with':
+        suffixes = tuple(values)
+        test = lambda value: isinstance(value, str) and value.endswith(suffixes)
+    elif operator == 'contains':
+        parts = tuple(values)
+        test = lambda value: isinstance(value, str) and any(part in value for part in parts)
+    else:
+        test = _compile_comparison(operator, values[0])
+
+    def clause(context):
+        value = context.get(attribute, _MISSING)
+        if value is _MISSING:
+            return False
+        try:
+            return test(value)
+        except TypeError:
+            # Unhashable or incomparable context values never match
+            return False
+
+    return clause
+
+def _compile_comparison(operator, threshold):
+    def test(value):
+        if not _is_number(value):
+            return False
+        if operator == 'gt':
+            return value > threshold
+        if operator == 'gte':
+            return value >= threshold
+        if operator == 'lt':
+            return value < threshold
+        return value <= threshold
+    return test
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
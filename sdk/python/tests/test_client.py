@@ -0,0 +1,124 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from feature_flags_client import FlagsClient
+
+FLAGS = [
+    {"_id": "1", "name": "dark-mode", "environments": {"staging": True, "production": False}},
+    {"_id": "2", "name": "beta-checkout", "environments": {"staging": True},
+     "targeting": {"staging": {"rules": [{"attribute": "country", "operator": "in", "values": ["IL"]}]}}},
+]
+
+class FakeFlagsAPI(BaseHTTPRequestHandler):
+    """Answers GET /flags like the API: the flag list with an ETag, or 304 when it matches."""
+
+    flags = FLAGS
+    requests = []
+    down = False
+
+    def do_GET(self):
+        type(self).requests.append((self.path, dict(self.headers)))
+        if self.down:
+            self.send_error(503)
+            return
+        body = json.dumps(self.flags).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestFlagsClient(unittest.TestCase):
+    def setUp(self):
+        FakeFlagsAPI.flags = FLAGS
+        FakeFlagsAPI.requests = []
+        FakeFlagsAPI.down = False
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFlagsAPI)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.snapshot_path = os.path.join(directory, 'flags.json')
+
+    def client(self, **options):
+        client = FlagsClient(self.url, refresh_interval=60, **options)
+        self.addCleanup(client.close)
+        return client
+
+    def test_evaluates_locally(self):
+        client = self.client(tenant='acme')
+
+        self.assertTrue(client.is_enabled('dark-mode'))
+        self.assertTrue(client.is_enabled('1'))
+        self.assertTrue(client.is_enabled('beta-checkout', {"country": "IL"}))
+        self.assertFalse(client.is_enabled('beta-checkout', {"country": "US"}))
+        self.assertTrue(client.is_enabled('missing', default=True))
+        self.assertEqual(client.all_flags({"country": "US"}), {"dark-mode": True, "beta-checkout": False})
+        path, headers = FakeFlagsAPI.requests[0]
+        self.assertEqual(path, '/flags?environment=staging')
+        self.assertEqual(headers['X-Tenant'], 'acme')
+
+    def test_environment(self):
+        client = self.client(environment='production')
+        self.assertFalse(client.is_enabled('dark-mode'))
+        self.assertFalse(client.is_enabled('beta-checkout'))
+
+    def test_refresh_revalidates_with_etag(self):
+        client = self.client()
+        self.assertTrue(client.refresh())
+        self.assertIn('If-None-Match', FakeFlagsAPI.requests[1][1])
+
+        FakeFlagsAPI.flags = [dict(FLAGS[0], environments={"staging": False})]
+        self.assertTrue(client.refresh())
+        self.assertFalse(client.is_enabled('dark-mode'))
+        self.assertFalse(client.is_enabled('beta-checkout'))
+
+    def test_failed_refresh_keeps_last_flags(self):
+        client = self.client()
+        FakeFlagsAPI.down = True
+
+        with self.assertLogs('feature_flags_client', 'WARNING'):
+            self.assertFalse(client.refresh())
+        self.assertTrue(client.stale)
+        self.assertTrue(client.is_enabled('dark-mode'))
+
+    def test_falls_back_to_snapshot_file(self):
+        self.client(snapshot_path=self.snapshot_path).close()
+        FakeFlagsAPI.down = True
+
+        with self.assertLogs('feature_flags_client', 'WARNING'):
+            client = self.client(snapshot_path=self.snapshot_path)
+            # A snapshot of another environment is not used
+            other = self.client(snapshot_path=self.snapshot_path, environment='production')
+        self.assertTrue(client.stale)
+        self.assertTrue(client.is_enabled('dark-mode'))
+        self.assertTrue(other.is_enabled('dark-mode', default=True))
+
+    def test_background_refresh(self):
+        client = FlagsClient(self.url, refresh_interval=0.05)
+        self.addCleanup(client.close)
+        FakeFlagsAPI.flags = []
+        for _ in range(100):
+            if not client.is_enabled('dark-mode'):
+                break
+            threading.Event().wait(0.02)
+        self.assertFalse(client.is_enabled('dark-mode'))
+
+if __name__ == '__main__':
+    unittest.main()
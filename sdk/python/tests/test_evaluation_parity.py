@@ -0,0 +1,61 @@
+import os
+import sys
+import random
+import unittest
+from feature_flags_client import evaluation
+
+API_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'api')
+
+def _load_api_evaluation():
+    sys.path.insert(0, API_DIR)
+    try:
+        import evaluation as api_evaluation
+    finally:
+        sys.path.remove(API_DIR)
+    return api_evaluation
+
+@unittest.skipUnless(os.path.exists(os.path.join(API_DIR, 'evaluation.py')), "needs the API source tree")
+class TestEvaluationParity(unittest.TestCase):
+    """The SDK must evaluate every flag exactly as the API does."""
+
+    def test_same_results_as_api(self):
+        api_evaluation = _load_api_evaluation()
+        rng = random.Random(7)
+        flag = {
+            "name": "checkout",
+            "environments": {"staging": True, "production": True, "development": False},
+            "segments": {"beta": ["u1", "u7"]},
+            "targeting": {
+                "staging": {
+                    "rules": [
+                        {"attribute": "country", "operator": "in", "values": ["IL", "US"]},
+                        {"attribute": "user_id", "operator": "in_segment", "values": ["beta"]},
+                        {"attribute": "age", "operator": "gte", "values": [18]},
+                    ],
+                    "match": "any",
+                    "rollout": {"percentage": 40, "key": "user_id"}
+                },
+                "production": {"rules": [{"attribute": "email", "operator": "ends_with", "values": ["@example.com"]}]}
+            }
+        }
+        sdk_flag = evaluation.compile_flag(flag)
+        api_flag = api_evaluation.compile_flag(flag)
+
+        for index in range(500):
+            context = {
+                "user_id": f"u{index}",
+                "country": rng.choice(["IL", "US", "DE", None]),
+                "age": rng.choice([12, 18, 40, "x"]),
+                "email": rng.choice(["a@example.com", "b@other.org"]),
+            }
+            for environment in ("staging", "production", "development", "missing"):
+                self.assertEqual(sdk_flag.evaluate(environment, context), api_flag.evaluate(environment, context))
+                self.assertEqual(sdk_flag.evaluate(environment), api_flag.evaluate(environment))
+
+    def test_same_buckets(self):
+        api_evaluation = _load_api_evaluation()
+        for key in ("u1", "u2", 42):
+            self.assertEqual(evaluation.bucket("flag", key), api_evaluation.bucket("flag", key))
+
+if __name__ == '__main__':
+    unittest.main()